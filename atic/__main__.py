@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+python -m atic runs the command line of cli.py.
+"""
+
+from atic.cli import main
+
+main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Stop criteria for adaptive settle and measurement windows.
+
+In adaptive mode iperf intervals are streamed from the radio as they are
+reported.  A settle window ends once the throughput is stable within a
+tolerance, and a measurement window ends once the confidence interval of
+the mean throughput is tight enough or the link is clearly down.  The
+fixed durations in the runner act as the maximum bounds, and the minimum
+bounds and tolerances come from optional runner columns:
+
+    adaptive                 enable adaptive windows for the row
+    min_start_settle_time    minimum seconds of the start settle window
+    min_test_settle_time     minimum seconds of the test settle window
+    min_test_time            minimum seconds of the measurement window
+    settle_tolerance         (max-min)/mean of the settle window, default 0.05
+    settle_window            number of intervals judged for stability, default 5
+    ci_target                relative 95% confidence half width, default 0.02
+    down_threshold           throughput in bits/s treated as down, default 1e5
+    down_time                seconds below down_threshold to end early, default 10
+"""
+
+import math
+import re
+
+INTERVAL_PATTERN = re.compile(
+    r"\[\s*(?:\d+|SUM)\]\s+(?P<start>[\d.]+)-(?P<end>[\d.]+)\s+sec\s+"
+    r"(?P<bytes>[\d.]+)\s+(?P<bytes_unit>[KMGT]?)Bytes\s+"
+    r"(?P<rate>[\d.]+)\s+(?P<rate_unit>[KMGT]?)bits/sec(?:\s+(?P<retransmits>\d+))?"
+)
+UNITS = {"": 1, "K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+BYTE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+# the optional runner columns read by this module
+ADAPTIVE_COLUMNS = [
+    "adaptive",
+    "min_start_settle_time",
+    "min_test_settle_time",
+    "min_test_time",
+    "settle_tolerance",
+    "settle_window",
+    "ci_target",
+    "down_threshold",
+    "down_time",
+]
+
+
+def parse_iperf_interval(line):
+    """Parse one interval line of the iperf3 text output
+
+    Args:
+        line (String): a line of iperf3 client output
+
+    Returns:
+        interval (dict): start, end, bytes, bits_per_second and retransmits
+            in the iperf3 json names, None for lines that are not intervals
+    """
+    match = INTERVAL_PATTERN.search(line)
+    if match is None or "sender" in line or "receiver" in line:
+        return None
+    return {
+        "start": float(match["start"]),
+        "end": float(match["end"]),
+        "bytes": int(float(match["bytes"]) * BYTE_UNITS[match["bytes_unit"]]),
+        "bits_per_second": float(match["rate"]) * UNITS[match["rate_unit"]],
+        "retransmits": int(match["retransmits"] or 0),
+    }
+
+
+def adaptive_enabled(test_config):
+    """True if the runner row asks for adaptive windows"""
+    return str(test_config.get("adaptive", "")).strip().lower() in ("1", "true", "yes")
+
+
+class SettleDetector:
+    """Ends a settle window once the throughput is stable
+
+    Args:
+        min_time (float): seconds before stability is judged
+        max_time (float): seconds after which the window always ends
+        tolerance (float): allowed (max-min)/mean over the judged intervals
+        window (int): number of most recent intervals judged
+    """
+
+    def __init__(self, min_time, max_time, tolerance=0.05, window=5):
+        self.min_time = min_time
+        self.max_time = max_time
+        self.tolerance = tolerance
+        self.window = window
+        self.throughput = []
+        self.elapsed = 0
+        self.reason = None
+
+    def update(self, interval):
+        """Add an interval, returns True when the window should end"""
+        self.throughput.append(interval["bits_per_second"])
+        self.elapsed = interval["end"]
+        if self.elapsed >= self.max_time:
+            self.reason = "max_time"
+        elif self.elapsed >= self.min_time and len(self.throughput) >= self.window:
+            recent = self.throughput[-self.window:]
+            mean = sum(recent) / len(recent)
+            if mean == 0 or (max(recent) - min(recent)) / mean <= self.tolerance:
+                self.reason = "stable"
+        return self.reason is not None
+
+
+class MeasurementStopper:
+    """Ends a measurement window once the mean throughput has converged or
+    the link is hard down
+
+    Args:
+        min_time (float): seconds before the window may end early
+        max_time (float): seconds after which the window always ends
+        ci_target (float): relative half width of the 95% confidence interval
+        down_threshold (float): bits per second below which the link is down
+        down_time (float): seconds of continuous down link to end early
+    """
+
+    def __init__(self, min_time, max_time, ci_target=0.02, down_threshold=1e5, down_time=10):
+        self.min_time = min_time
+        self.max_time = max_time
+        self.ci_target = ci_target
+        self.down_threshold = down_threshold
+        self.down_time = down_time
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.down_since = None
+        self.elapsed = 0
+        self.reason = None
+
+    def update(self, interval):
+        """Add an interval, returns True when the window should end"""
+        throughput = interval["bits_per_second"]
+        self.elapsed = interval["end"]
+        # Welford running mean and variance
+        self.n += 1
+        delta = throughput - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (throughput - self.mean)
+        if throughput < self.down_threshold:
+            if self.down_since is None:
+                self.down_since = interval["start"]
+        else:
+            self.down_since = None
+        if self.elapsed >= self.max_time:
+            self.reason = "max_time"
+        elif self.down_since is not None and self.elapsed - self.down_since >= self.down_time:
+            self.reason = "link_down"
+        elif self.elapsed >= self.min_time and self.n >= 3 and self.mean > 0:
+            half_width = 1.96 * math.sqrt(self.m2 / (self.n - 1) / self.n)
+            if half_width / self.mean <= self.ci_target:
+                self.reason = "converged"
+        return self.reason is not None
+
+
+def _column(test_config, name, default):
+    value = test_config.get(name, "")
+    return default if value == "" else float(value)
+
+
+def settle_criterion(test_config, phase):
+    """Build the stop criterion of a settle window from a runner row
+
+    Args:
+        test_config (dict): the runner row
+        phase (String): "start" or "test" settle window
+
+    Returns:
+        SettleDetector
+    """
+    max_time = float(test_config[f"{phase}_settle_time"])
+    return SettleDetector(
+        min_time=_column(test_config, f"min_{phase}_settle_time", 0),
+        max_time=max_time,
+        tolerance=_column(test_config, "settle_tolerance", 0.05),
+        window=int(_column(test_config, "settle_window", 5)),
+    )
+
+
+def measurement_criterion(test_config):
+    """Build the stop criterion of the measurement window from a runner row"""
+    return MeasurementStopper(
+        min_time=_column(test_config, "min_test_time", 0),
+        max_time=float(test_config["test_time"]),
+        ci_target=_column(test_config, "ci_target", 0.02),
+        down_threshold=_column(test_config, "down_threshold", 1e5),
+        down_time=_column(test_config, "down_time", 10),
+    )
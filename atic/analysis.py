@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Per config performance summary of one or more runs.
+
+The summary is computed from the Parquet dataset of a run (see dataset.py),
+which is brought up to date first, with one groupby over all the configs
+of a table instead of a loop over the raw files.  Every config gets
+
+    throughput_mean, throughput_median, throughput_p<n>   iperf bits per second
+    outage_fraction        share of intervals below the outage threshold
+    spectral_efficiency    mean coded bits per symbol, weighted by the MCS counters
+    sir, inr, sinr         dB at the RX port from the attenuator settings
+
+and configs run in UDP mode or with round trip probes (see latency.py)
+
+    jitter_mean_ms, jitter_p<n>_ms, loss_percent, goodput_mean
+    rtt_mean_ms, rtt_max_ms, rtt_p<n>_ms, probe_loss_percent
+
+next to the attenuator, waveform and X410 power settings of its
+measurement window.  The levels behind sir, inr and sinr follow the RF
+circuit of the testbed: the link signal passes the p2p_parent and
+p2p_child attenuators, the interferer the interferer and p2p_child
+attenuators, and the noise diode all but the p2p_parent attenuator.  Their
+reference levels and the other parameters are in the analysis_config of
+config.py.
+
+Results are cached per run in <run directory>/dataset/summary.parquet,
+keyed by the sha256 of the raw files of every config, so only new or
+changed configs are summarized again.  Runs are summarized in parallel:
+
+    python analysis.py Local_Data/run-1 Local_Data/run-2 --output summary.csv
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import testbed_config
+from dataset import ATTENUATORS, build_dataset, completed_configs, config_files, load_dataset
+
+SUMMARY_NAME = "summary.parquet"
+CACHE_NAME = "summary.json"
+# settings of the measurement window reported with the summary
+SETTINGS = ATTENUATORS + ["wv_file", "set_power"]
+
+
+def file_digest(files):
+    """sha256 over the raw files of a config
+
+    Args:
+        files (dict): kind -> path, as returned by dataset.config_files
+
+    Returns:
+        String: hex digest
+    """
+    digest = hashlib.sha256()
+    for kind, path in sorted(files.items()):
+        digest.update(kind.encode("utf-8"))
+        with open(path, "rb") as in_file:
+            for block in iter(lambda: in_file.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def power_sum(*levels):
+    """Sum of powers given in dBm, in dBm"""
+    return 10 * np.log10(sum(10 ** (np.asarray(level, dtype=float) / 10) for level in levels))
+
+
+def throughput_summary(iperf, outage_threshold, percentiles):
+    """Throughput statistics of the measurement window of every config
+
+    Args:
+        iperf (DataFrame): iperf table of the dataset
+        outage_threshold (float): bits per second below which an interval is an outage
+        percentiles (List): percentiles of the interval throughput to report
+
+    Returns:
+        DataFrame: one row per config, indexed by config
+    """
+    test = iperf[iperf["phase"] == "test"]
+    groups = test.groupby("config", observed=True)
+    rate = groups["bits_per_second"]
+    summary = pd.DataFrame(
+        {
+            "intervals": rate.size(),
+            "throughput_mean": rate.mean(),
+            "throughput_median": rate.median(),
+            "outage_fraction": (test["bits_per_second"] < outage_threshold).groupby(
+                test["config"], observed=True
+            ).mean(),
+        }
+    )
+    if percentiles:
+        quantiles = rate.quantile([percentile / 100 for percentile in percentiles]).unstack()
+        quantiles.columns = [f"throughput_p{percentile:g}" for percentile in percentiles]
+        summary = summary.join(quantiles)
+    # the settings are those of the last interval, after the test attenuations were set
+    settings = [column for column in SETTINGS if column in test.columns]
+    return summary.join(groups[settings].last())
+
+
+def mcs_summary(mcs, efficiency):
+    """MCS weighted spectral efficiency of every config
+
+    The counters of the radio are cumulative, the frames sent during a
+    config are the difference between its last and first sample.
+
+    Args:
+        mcs (DataFrame): mcs table of the dataset
+        efficiency (List): coded bits per symbol of every MCS index
+
+    Returns:
+        DataFrame: one row per config, indexed by config
+    """
+    counters = [f"mcs{index}" for index in range(len(efficiency)) if f"mcs{index}" in mcs.columns]
+    ordered = mcs.sort_values("clock", kind="stable").groupby("config", observed=True)[counters]
+    frames = (ordered.last() - ordered.first()).clip(lower=0)
+    total = frames.sum(axis=1)
+    weights = np.array([efficiency[int(counter[3:])] for counter in counters])
+    summary = pd.DataFrame(
+        {
+            "mcs_frames": total,
+            "spectral_efficiency": (frames.to_numpy() @ weights) / total.where(total > 0),
+        }
+    )
+    shares = frames.div(total.where(total > 0), axis=0)
+    shares.columns = [f"{counter}_fraction" for counter in counters]
+    return summary.join(shares)
+
+
+def udp_summary(iperf, percentiles):
+    """Jitter and loss of the measurement window of every UDP config
+
+    The client reports the rate it sent at, the goodput is what the
+    receiver got of it.
+
+    Args:
+        iperf (DataFrame): iperf table of the dataset
+        percentiles (List): percentiles of the interval jitter to report
+
+    Returns:
+        DataFrame: one row per UDP config, indexed by config
+    """
+    test = iperf[(iperf["phase"] == "test") & iperf["jitter_ms"].notna()]
+    groups = test.groupby("config", observed=True)
+    jitter = groups["jitter_ms"]
+    sent = groups["packets"].sum()
+    summary = pd.DataFrame(
+        {
+            "jitter_mean_ms": jitter.mean(),
+            "loss_percent": 100 * groups["lost_packets"].sum() / sent.where(sent > 0),
+            "goodput_mean": (test["bits_per_second"] * (1 - test["lost_percent"] / 100)).groupby(
+                test["config"], observed=True
+            ).mean(),
+        }
+    )
+    if percentiles:
+        quantiles = jitter.quantile([percentile / 100 for percentile in percentiles]).unstack()
+        quantiles.columns = [f"jitter_p{percentile:g}_ms" for percentile in percentiles]
+        summary = summary.join(quantiles)
+    return summary
+
+
+def rtt_summary(ping, percentiles):
+    """Round trip time and probe loss of every config with probes
+
+    Args:
+        ping (DataFrame): ping table of the dataset
+        percentiles (List): percentiles of the round trip time to report
+
+    Returns:
+        DataFrame: one row per config, indexed by config
+    """
+    groups = ping.groupby("config", observed=True)
+    rtt = groups["rtt_ms"]
+    # sequence numbers start at 0, a run ending in losses is not counted
+    sent = groups["seq"].max() + 1
+    summary = pd.DataFrame(
+        {
+            "rtt_mean_ms": rtt.mean(),
+            "rtt_max_ms": rtt.max(),
+            "probe_loss_percent": 100 * (1 - groups["seq"].nunique() / sent),
+        }
+    )
+    if percentiles:
+        quantiles = rtt.quantile([percentile / 100 for percentile in percentiles]).unstack()
+        quantiles.columns = [f"rtt_p{percentile:g}_ms" for percentile in percentiles]
+        summary = summary.join(quantiles)
+    return summary
+
+
+def link_levels(summary, analysis_config):
+    """Add the signal, interference and noise ratios from the attenuator settings
+
+    Args:
+        summary (DataFrame): per config rows with the attenuator settings
+        analysis_config (dict): reference levels, see config.py
+
+    Returns:
+        DataFrame: summary with sir, inr and sinr columns in dB
+    """
+    if not set(ATTENUATORS) <= set(summary.columns):
+        return summary
+    attn = {name: summary[name].astype(float) for name in ATTENUATORS}
+    output = analysis_config["interferer_reference_output"]
+    if "set_power" in summary.columns:
+        output = summary["set_power"].astype(float).fillna(output)
+    signal = analysis_config["signal_power"] - attn["p2p_parent_attn"] - attn["p2p_child_attn"]
+    interference = (
+        analysis_config["interferer_power"]
+        + (output - analysis_config["interferer_reference_output"])
+        - attn["interferer_attn"]
+        - attn["p2p_child_attn"]
+    )
+    diode = (
+        analysis_config["noise_diode_power"]
+        - attn["noise_diode_attn"]
+        - attn["interferer_attn"]
+        - attn["p2p_child_attn"]
+    )
+    noise = power_sum(analysis_config["noise_floor"], diode)
+    summary = summary.copy()
+    summary["sir"] = signal - interference
+    summary["inr"] = interference - noise
+    summary["sinr"] = signal - power_sum(interference, noise)
+    return summary
+
+
+def summarize_frames(iperf, mcs, analysis_config, ping=None):
+    """Per config summary of the iperf, mcs and ping tables of a dataset
+
+    Returns:
+        DataFrame: one row per config with a config column
+    """
+    parts = []
+    if not iperf.empty:
+        parts.append(
+            throughput_summary(iperf, analysis_config["outage_threshold"], analysis_config["percentiles"])
+        )
+        if "jitter_ms" in iperf.columns and iperf["jitter_ms"].notna().any():
+            parts.append(udp_summary(iperf, analysis_config["percentiles"]))
+    if not mcs.empty:
+        parts.append(mcs_summary(mcs, analysis_config["mcs_efficiency"]))
+    if ping is not None and not ping.empty:
+        parts.append(rtt_summary(ping, analysis_config["percentiles"]))
+    if not parts:
+        return pd.DataFrame(columns=["config"])
+    summary = parts[0].join(parts[1:], how="outer") if len(parts) > 1 else parts[0]
+    summary = link_levels(summary, analysis_config)
+    summary.index = summary.index.astype(str)
+    return summary.rename_axis("config").reset_index()
+
+
+def _read_table(dataset_directory, table, configs):
+    if not Path(dataset_directory, table).exists():
+        return pd.DataFrame()
+    frame = load_dataset(dataset_directory, table, configs)
+    frame["config"] = frame["config"].astype(str)
+    return frame
+
+
+def _config_key(config):
+    # configs are numbered, settle configs and other names sort after them
+    return (0, int(config), "") if str(config).isdigit() else (1, 0, str(config))
+
+
+def summarize_run(run_directory, analysis_config=None, workers=None, rebuild=False):
+    """Summarize every completed config of a run, reusing cached results
+
+    Args:
+        run_directory (Path): local run directory
+        analysis_config (dict): defaults to the analysis_config of config.py
+        workers (int): worker processes of the dataset builder
+        rebuild (bool): summarize every config instead of only new or changed ones
+
+    Returns:
+        DataFrame: one row per config with the run name in a run column
+    """
+    run_directory = Path(run_directory)
+    analysis_config = analysis_config or testbed_config["analysis_config"]
+    dataset_directory = Path(run_directory, "dataset")
+    summary_path = Path(dataset_directory, SUMMARY_NAME)
+    cache_path = Path(dataset_directory, CACHE_NAME)
+
+    completed = completed_configs(run_directory)
+    digests = {
+        config: file_digest(files)
+        for config, files in config_files(run_directory).items()
+        if completed is None or config in completed
+    }
+    cache = {"analysis_config": None, "digests": {}}
+    if cache_path.exists() and summary_path.exists() and not rebuild:
+        with open(cache_path, "r") as in_file:
+            cache = json.load(in_file)
+    if cache["analysis_config"] != analysis_config:
+        cache = {"analysis_config": analysis_config, "digests": {}}
+    changed = [config for config, digest in digests.items() if cache["digests"].get(config) != digest]
+
+    cached = pd.DataFrame(columns=["config"])
+    if cache["digests"]:
+        cached = pd.read_parquet(summary_path)
+        cached = cached[cached["config"].isin(digests) & ~cached["config"].isin(changed)]
+    if changed:
+        build_dataset(run_directory, workers=workers)
+        # reading every partition is faster than filtering most of them
+        configs = changed if len(changed) < len(digests) / 2 else None
+        fresh = summarize_frames(
+            _read_table(dataset_directory, "iperf", configs),
+            _read_table(dataset_directory, "mcs", configs),
+            analysis_config,
+            _read_table(dataset_directory, "ping", configs),
+        )
+        if configs is None:
+            cached = cached.iloc[0:0]
+        fresh = fresh[fresh["config"].isin(digests)]
+        summary = pd.concat([cached, fresh[~fresh["config"].isin(cached["config"])]], ignore_index=True)
+        keys = [_config_key(config) for config in summary["config"]]
+        summary = summary.iloc[sorted(range(len(summary)), key=keys.__getitem__)].reset_index(drop=True)
+        dataset_directory.mkdir(parents=True, exist_ok=True)
+        temp_path = summary_path.with_suffix(".tmp")
+        summary.to_parquet(temp_path, index=False)
+        os.replace(temp_path, summary_path)
+        temp_path = cache_path.with_suffix(".tmp")
+        with open(temp_path, "w") as out_file:
+            json.dump({"analysis_config": analysis_config, "digests": digests}, out_file, indent=1)
+        os.replace(temp_path, cache_path)
+        print(f"{run_directory.name}: {len(changed)} of {len(digests)} configs summarized")
+    else:
+        summary = cached.reset_index(drop=True)
+    summary.insert(0, "run", run_directory.name)
+    return summary
+
+
+def summarize_runs(run_directories, analysis_config=None, workers=None, rebuild=False):
+    """Summarize several runs in parallel, one process per run
+
+    Returns:
+        DataFrame: the per config summaries of every run
+    """
+    run_directories = [Path(run_directory) for run_directory in run_directories]
+    if len(run_directories) == 1:
+        return summarize_run(run_directories[0], analysis_config, workers, rebuild)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(summarize_run, run_directory, analysis_config, 1, rebuild)
+            for run_directory in run_directories
+        ]
+        summaries = [future.result() for future in futures]
+    return pd.concat(summaries, ignore_index=True)
+
+
+if __name__ == "__main__":
+    from cli import main
+
+    main(["analyze", *sys.argv[1:]])
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the per-config orchestration overhead of the runner.
+
+Campaigns of increasing size are run against the simulated testbed of
+simulators.py.  The runner phases are timed by wrapping the functions of
+test_link_x410 in place, and the overhead is everything the campaign
+spends beyond the simulated measurement windows, reported as a
+percentage of the nominal measurement time.  Results are saved as json
+and can be compared with a previous result to catch regressions:
+
+    python benchmark.py --sizes 10 100 1000 10000 --output overhead.json
+    python benchmark.py --baseline overhead.json --tolerance 0.2
+
+The import times of the command line modules and the time to validate a
+runner with atic validate are measured in fresh interpreters and saved
+with the results, so a heavy import creeping into the startup path shows
+up as a regression too:
+
+    python benchmark.py --imports-only --baseline overhead.json
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# runner functions that are timed, stage functions cover the remainder
+PHASES = [
+    "prepare_stage",
+    "settle_stage",
+    "measure_stage",
+    "collect_stage",
+    "persist_stage",
+    "set_channel_attenuation",
+    "move_data_files",
+    "write_log",
+    "write_x410_log",
+    "write_telemetry_log",
+]
+# modules on the startup path of the command line, each timed on its own
+IMPORT_MODULES = ["cli", "sweep", "catalog", "test_link_x410"]
+IMPORT_REPEAT = 5
+
+
+class PhaseTimer:
+    """Times module level functions by replacing them with timed wrappers
+
+    Args:
+        module: module holding the functions
+        names (List): names of the functions to time
+    """
+
+    def __init__(self, module, names):
+        self.module = module
+        self.names = names
+        self.originals = {}
+        self.durations = {name: [] for name in names}
+        self.lock = threading.Lock()
+
+    def _wrap(self, name, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                with self.lock:
+                    self.durations[name].append(duration)
+        return timed
+
+    def __enter__(self):
+        for name in self.names:
+            self.originals[name] = getattr(self.module, name)
+            setattr(self.module, name, self._wrap(name, self.originals[name]))
+        # the scheduler holds references to the stage functions
+        self.stages = dict(self.module.campaign_stages)
+        for stage, function in self.stages.items():
+            if function.__name__ in self.names:
+                self.module.campaign_stages[stage] = getattr(self.module, function.__name__)
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, function in self.originals.items():
+            setattr(self.module, name, function)
+        self.module.campaign_stages.update(self.stages)
+
+    def summary(self):
+        return {
+            name: {
+                "count": len(durations),
+                "total": round(sum(durations), 6),
+                "mean": round(sum(durations) / len(durations), 6) if durations else 0,
+            }
+            for name, durations in self.durations.items()
+        }
+
+
+def write_runner(folder, size, test_time=10, settle_time=2):
+    """Write a synthetic runner csv and yaml with size configs
+
+    Returns:
+        runner_path (Path): the csv file
+        measurement_time (float): nominal seconds of iperf windows in the runner
+    """
+    runner_path = Path(folder, f"benchmark_{size}.csv")
+    names = ["p2p_parent_attn", "p2p_child_attn", "noise_diode_attn", "interferer_attn"]
+    columns = ["config", "interval", "test_time", "packet_size", "start_settle_time",
+               "test_settle_time"]
+    columns += [f"{phase}_{name}" for phase in ("start", "test") for name in names]
+    columns += ["wv_file"]
+    with open(runner_path, "w", newline="") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(columns)
+        for config in range(1, size + 1):
+            attenuation = (config * 2) % 40
+            settings = [attenuation, attenuation, 10, 20 + attenuation]
+            writer.writerow([config, 1, test_time, 1400, settle_time, settle_time]
+                            + settings + settings + ["/data/wv_files/benchmark.wv"])
+    runner_path.with_suffix(".yaml").write_text("owner: benchmark\nreason: overhead benchmark\n")
+    measurement_time = size * (test_time + 2 * settle_time)
+    return runner_path, measurement_time
+
+
+def run_benchmark(size, time_scale=0.0, **delays):
+    """Run one simulated campaign of size configs and time its phases
+
+    Returns:
+        result (dict): wall time, overhead and per-phase timing
+    """
+    import test_link_x410 as runner
+
+    with tempfile.TemporaryDirectory(prefix="atic_bench_") as folder:
+        runner_path, measurement_time = write_runner(folder, size)
+        runner.open_instruments(simulate=True, time_scale=time_scale, **delays)
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            with PhaseTimer(runner, PHASES) as timer, open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    start = time.perf_counter()
+                    report = runner.run_campaign(runner_path, data_root=Path(folder, "data"))
+                    wall_time = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            runner.close_instruments()
+            runner.testbed.close()
+    overhead = wall_time - time_scale * measurement_time
+    return {
+        "configs": size,
+        "time_scale": time_scale,
+        "delays": delays,
+        "wall_time": round(wall_time, 6),
+        "measurement_time": measurement_time,
+        "overhead_time": round(overhead, 6),
+        "overhead_per_config": round(overhead / size, 6),
+        "overhead_percent": round(100 * overhead / measurement_time, 4),
+        "utilization": report["utilization"],
+        "phases": timer.summary(),
+    }
+
+
+def import_time(module, repeat=IMPORT_REPEAT):
+    """Best cumulative import time of a module in a fresh interpreter
+
+    Returns:
+        seconds (float): time reported by python -X importtime
+    """
+    times = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=HERE, capture_output=True, text=True, check=True,
+        )
+        # import time: self [us] | cumulative | imported package
+        for line in process.stderr.splitlines():
+            match = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(\S+)$", line)
+            if match and match[2] == module:
+                times.append(int(match[1]) / 1e6)
+    return min(times)
+
+
+def validate_time(size=1000, repeat=IMPORT_REPEAT):
+    """Best wall time of atic validate on a runner of size configs"""
+    with tempfile.TemporaryDirectory(prefix="atic_bench_") as folder:
+        runner_path, _ = write_runner(folder, size)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(HERE, "cli.py"), "validate", str(runner_path)],
+                           capture_output=True, check=True)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_startup_benchmark():
+    """Time the imports and the validation of the command line
+
+    Returns:
+        result (dict): seconds per imported module and for atic validate
+    """
+    return {
+        "imports": {module: round(import_time(module), 6) for module in IMPORT_MODULES},
+        "validate_1000_configs": round(validate_time(), 6),
+    }
+
+
+def compare_startup(startup, baseline, tolerance):
+    """List the startup times that regressed beyond tolerance"""
+    previous = baseline.get("startup")
+    if not previous:
+        return []
+    pairs = [(f"import {module}", previous["imports"].get(module), after)
+             for module, after in startup["imports"].items()]
+    pairs.append(("atic validate", previous["validate_1000_configs"], startup["validate_1000_configs"]))
+    return [
+        {"name": name, "before": before, "after": after}
+        for name, before, after in pairs
+        if before and after > before * (1 + tolerance)
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """List the sizes whose per-config overhead regressed beyond tolerance"""
+    previous = {result["configs"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        if result["configs"] not in previous:
+            continue
+        before = previous[result["configs"]]["overhead_per_config"]
+        after = result["overhead_per_config"]
+        if before > 0 and after > before * (1 + tolerance):
+            regressions.append({"configs": result["configs"], "before": before, "after": after})
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark per-config testbed overhead")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument("--time-scale", type=float, default=0.0,
+                        help="fraction of the measurement windows actually waited")
+    parser.add_argument("--ssh-latency", type=float, default=0.0)
+    parser.add_argument("--x410-latency", type=float, default=0.0)
+    parser.add_argument("--attenuator-latency", type=float, default=0.0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative increase of the per-config overhead")
+    parser.add_argument("--imports-only", action="store_true",
+                        help="only time the imports and validation of the command line")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    delays = {
+        "ssh_latency": args.ssh_latency,
+        "x410_latency": args.x410_latency,
+        "attenuator_latency": args.attenuator_latency,
+    }
+    startup = run_startup_benchmark()
+    for module, seconds in startup["imports"].items():
+        print(f"import {module}: {1000 * seconds:8.1f} ms")
+    print(f"atic validate, 1000 configs: {1000 * startup['validate_1000_configs']:8.1f} ms")
+    results = []
+    for size in [] if args.imports_only else args.sizes:
+        result = run_benchmark(size, time_scale=args.time_scale, **delays)
+        results.append(result)
+        print(f"{size:6d} configs: {result['wall_time']:9.3f} s wall, "
+              f"{1000 * result['overhead_per_config']:8.2f} ms overhead per config, "
+              f"{result['overhead_percent']:6.3f}% of measurement time")
+    output = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "startup": startup, "results": results}
+    with open(args.output, "w") as out_file:
+        json.dump(output, out_file, indent=2)
+    print(f"results saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r") as in_file:
+            baseline = json.load(in_file)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression at {regression['configs']} configs: "
+                  f"{regression['before']:.6f} s -> {regression['after']:.6f} s per config")
+        startup_regressions = compare_startup(startup, baseline, args.tolerance)
+        for regression in startup_regressions:
+            print(f"startup regression of {regression['name']}: "
+                  f"{regression['before']:.6f} s -> {regression['after']:.6f} s")
+        if regressions or startup_regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of the runs stored under the local data root.
+
+The catalog is a SQLite database, catalog.sqlite in the local data root,
+with one row per run and one row per config of every run.  The runner
+registers a run once its meta directory is written and marks every config
+as it completes, the dataset builder records where the dataset of a run
+is, and a scan rebuilds the catalog from the meta directories of runs
+that were recorded before the catalog existed:
+
+    python catalog.py scan Local_Data
+    python catalog.py find Local_Data --waveform pulsedWN --max interferer_attn=20
+
+Configs are indexed by waveform and test attenuation, so finding runs by
+their settings does not open any files.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from logs import YamlSerializer
+from sweep import Sweep
+
+CATALOG_NAME = "catalog.sqlite"
+ATTENUATORS = ["p2p_parent_attn", "p2p_child_attn", "noise_diode_attn", "interferer_attn"]
+RUN_TIMESTAMP_FORMAT = "%Y_%m_%d-%H_%M_%S"
+RUN_NAME_PATTERN = re.compile(r"(?P<runner>.+)-(?P<timestamp>\d{4}_\d\d_\d\d-\d\d_\d\d_\d\d)")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_name TEXT PRIMARY KEY,
+    runner TEXT,
+    local_directory TEXT,
+    created REAL,
+    updated REAL,
+    owner TEXT,
+    reason TEXT,
+    metadata TEXT,
+    waveforms TEXT,
+    attenuation_ranges TEXT,
+    config_count INTEGER,
+    completed_count INTEGER,
+    dataset_path TEXT
+);
+CREATE TABLE IF NOT EXISTS configs (
+    run_name TEXT,
+    config TEXT,
+    wv_file TEXT,
+    test_time REAL,
+    {", ".join(f"start_{name} REAL, test_{name} REAL" for name in ATTENUATORS)},
+    completed INTEGER DEFAULT 0,
+    completed_time REAL,
+    settings TEXT,
+    PRIMARY KEY (run_name, config)
+);
+CREATE TABLE IF NOT EXISTS waveforms (wv_file TEXT PRIMARY KEY);
+CREATE INDEX IF NOT EXISTS configs_wv_file ON configs (wv_file, test_interferer_attn, run_name);
+CREATE INDEX IF NOT EXISTS configs_interferer ON configs (test_interferer_attn, run_name);
+CREATE INDEX IF NOT EXISTS runs_owner ON runs (owner);
+"""
+
+
+CONFIG_COLUMNS = ["run_name", "config", "wv_file", "test_time"]
+CONFIG_COLUMNS += [f"{phase}_{name}" for name in ATTENUATORS for phase in ("start", "test")]
+CONFIG_COLUMNS += ["completed", "settings"]
+UPSERT_CONFIG = f"""INSERT INTO configs ({", ".join(CONFIG_COLUMNS)})
+    VALUES ({", ".join("?" * len(CONFIG_COLUMNS))})
+    ON CONFLICT (run_name, config) DO UPDATE SET
+        completed = max(completed, excluded.completed),
+        settings = excluded.settings"""
+
+
+def _number(value):
+    """Runner values as floats, None for empty or text cells"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _config_row(run_name, row, completed):
+    """Values of CONFIG_COLUMNS for a runner row"""
+    return (
+        run_name,
+        str(row["config"]),
+        str(row.get("wv_file", "")),
+        _number(row.get("test_time")),
+        *[_number(row.get(f"{phase}_{name}")) for name in ATTENUATORS for phase in ("start", "test")],
+        int(completed),
+        json.dumps(row, default=str),
+    )
+
+
+class Catalog:
+    """Index of the runs under a local data root
+
+    Args:
+        file_path (Path): location of the SQLite database, created if missing
+    """
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_data_root(cls, local_data_root):
+        return cls(Path(local_data_root, CATALOG_NAME))
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Connection that commits on success and is always closed"""
+        connection = sqlite3.connect(self.file_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def register_run(self, local_directory):
+        """Add or refresh a run from the files of its meta directory
+
+        Args:
+            local_directory (Path): local data directory of the run
+
+        Returns:
+            run_name (String): the catalog key of the run
+        """
+        local_directory = Path(local_directory)
+        meta_directory = Path(local_directory, "meta")
+        run_name = local_directory.name
+        match = RUN_NAME_PATTERN.fullmatch(run_name)
+        if match:
+            runner_name = match["runner"]
+            created = datetime.datetime.strptime(match["timestamp"], RUN_TIMESTAMP_FORMAT).timestamp()
+        else:
+            runner_name, created = run_name, os.path.getmtime(meta_directory)
+        metadata = {}
+        if Path(meta_directory, "experiment_metadata.yaml").exists():
+            metadata = YamlSerializer().load(Path(meta_directory, "experiment_metadata.yaml")) or {}
+        test_runner = []
+        if Path(meta_directory, "test_conditions.csv").exists():
+            import pandas as pd
+
+            test_runner = pd.read_csv(
+                Path(meta_directory, "test_conditions.csv"), keep_default_na=False
+            ).to_dict("records")
+        completed = set()
+        if Path(meta_directory, "checkpoint.json").exists():
+            with open(Path(meta_directory, "checkpoint.json"), "r") as in_file:
+                completed = set(json.load(in_file)["completed_configs"])
+
+        sweep = Sweep(metadata["sweep"]) if "sweep" in metadata else None
+        if sweep is None:
+            ranges = {}
+            for name in ATTENUATORS:
+                values = [_number(row.get(f"test_{name}")) for row in test_runner]
+                values = [value for value in values if value is not None]
+                if values:
+                    ranges[name] = [min(values), max(values)]
+            waveforms = sorted({str(row.get("wv_file", "")) for row in test_runner} - {""})
+            config_count = len(test_runner)
+        else:
+            # the csv of a sweep only holds the configs started so far
+            summary = sweep.summary()
+            ranges = {
+                name: summary["bounds"][f"test_{name}"]
+                for name in ATTENUATORS
+                if summary["bounds"].get(f"test_{name}") is not None
+            }
+            waveforms = summary["waveforms"]
+            config_count = summary["configs"]
+        config_rows = [_config_row(run_name, row, str(row["config"]) in completed) for row in test_runner]
+        with self.connect() as connection:
+            connection.execute(
+                """INSERT INTO runs (run_name, runner, local_directory, created, updated, owner,
+                       reason, metadata, waveforms, attenuation_ranges, config_count, completed_count)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (run_name) DO UPDATE SET
+                       runner = excluded.runner, created = excluded.created,
+                       local_directory = excluded.local_directory, updated = excluded.updated,
+                       owner = excluded.owner, reason = excluded.reason,
+                       metadata = excluded.metadata, waveforms = excluded.waveforms,
+                       attenuation_ranges = excluded.attenuation_ranges,
+                       config_count = excluded.config_count,
+                       completed_count = excluded.completed_count""",
+                (
+                    run_name,
+                    runner_name,
+                    str(local_directory),
+                    created,
+                    time.time(),
+                    metadata.get("owner"),
+                    metadata.get("reason"),
+                    json.dumps(metadata, default=str),
+                    ",".join(waveforms),
+                    json.dumps(ranges),
+                    config_count,
+                    len(completed),
+                ),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO waveforms (wv_file) VALUES (?)",
+                [(waveform,) for waveform in waveforms],
+            )
+            connection.executemany(UPSERT_CONFIG, config_rows)
+        return run_name
+
+    def complete_config(self, run_name, config, test_config=None):
+        """Mark a config of a run as measured
+
+        Args:
+            run_name (String): the catalog key of the run
+            config: config number
+            test_config (dict): the runner row, adds configs that were
+                generated after the run was registered
+        """
+        with self.connect() as connection:
+            if test_config is not None:
+                connection.execute(UPSERT_CONFIG, _config_row(run_name, test_config, True))
+            connection.execute(
+                """UPDATE configs SET completed = 1, completed_time = ?
+                   WHERE run_name = ? AND config = ?""",
+                (time.time(), run_name, str(config)),
+            )
+            connection.execute(
+                """UPDATE runs SET updated = ?, completed_count =
+                       (SELECT count(*) FROM configs WHERE run_name = ? AND completed = 1)
+                   WHERE run_name = ?""",
+                (time.time(), run_name, run_name),
+            )
+
+    def set_dataset(self, run_name, dataset_path):
+        """Record where the dataset of a run was written"""
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE runs SET dataset_path = ?, updated = ? WHERE run_name = ?",
+                (str(dataset_path), time.time(), run_name),
+            )
+
+    def scan(self, local_data_root):
+        """Register every run directory under the local data root
+
+        Returns:
+            run_names (List): the registered runs
+        """
+        run_names = []
+        for meta_directory in sorted(Path(local_data_root).glob("*/meta")):
+            if not Path(meta_directory, "test_conditions.csv").exists() and not Path(
+                meta_directory, "experiment_metadata.yaml"
+            ).exists():
+                continue
+            run_name = self.register_run(meta_directory.parent)
+            dataset_directory = Path(meta_directory.parent, "dataset")
+            if Path(dataset_directory, "manifest.json").exists():
+                self.set_dataset(run_name, dataset_directory)
+            run_names.append(run_name)
+        return run_names
+
+    def query(self, sql, parameters=()):
+        """Run a read query against the catalog
+
+        Returns:
+            rows (List): one dictionary per row
+        """
+        with self.connect() as connection:
+            return [dict(row) for row in connection.execute(sql, parameters)]
+
+    def find_runs(self, waveform=None, owner=None, runner=None, minimum=None, maximum=None):
+        """Runs with at least one config matching every condition
+
+        Args:
+            waveform (String): part of the waveform file name
+            owner (String): owner in the experiment metadata
+            runner (String): name of the runner csv the run was started from
+            minimum (dict): attenuator name -> lowest test attenuation in dB
+            maximum (dict): attenuator name -> test attenuation in dB the
+                config must be below
+
+        Returns:
+            runs (List): dictionaries of the matching runs, newest first
+        """
+        config_conditions, run_conditions, parameters = [], [], []
+        if waveform:
+            # match the few distinct waveforms, then use the configs index
+            config_conditions.append("wv_file IN (SELECT wv_file FROM waveforms WHERE wv_file LIKE ?)")
+            parameters.append(f"%{waveform}%")
+        for limits, operator in ((minimum or {}, ">="), (maximum or {}, "<")):
+            for name, value in limits.items():
+                if name not in ATTENUATORS:
+                    raise KeyError(f"Unknown attenuator {name}")
+                config_conditions.append(f"test_{name} {operator} ?")
+                parameters.append(float(value))
+        if config_conditions:
+            run_conditions.append(
+                f"run_name IN (SELECT run_name FROM configs WHERE {' AND '.join(config_conditions)})"
+            )
+        if owner:
+            run_conditions.append("owner = ?")
+            parameters.append(owner)
+        if runner:
+            run_conditions.append("runner = ?")
+            parameters.append(runner)
+        where = f"WHERE {' AND '.join(run_conditions)}" if run_conditions else ""
+        return self.query(f"SELECT * FROM runs {where} ORDER BY created DESC", parameters)
+
+
+def _limits(pairs):
+    limits = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        limits[name] = float(value)
+    return limits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog of the runs under the local data root")
+    parser.add_argument("command", choices=["scan", "find"])
+    parser.add_argument("local_data_root", help="directory holding the run directories")
+    parser.add_argument("--waveform", help="part of the waveform file name")
+    parser.add_argument("--owner")
+    parser.add_argument("--runner")
+    parser.add_argument("--min", action="append", metavar="ATTENUATOR=DB",
+                        help="lowest test attenuation, e.g. interferer_attn=10")
+    parser.add_argument("--max", action="append", metavar="ATTENUATOR=DB",
+                        help="test attenuation to stay below, e.g. interferer_attn=20")
+    args = parser.parse_args()
+    catalog = Catalog.for_data_root(args.local_data_root)
+    if args.command == "scan":
+        print(f"{len(catalog.scan(args.local_data_root))} runs in the catalog")
+    else:
+        runs = catalog.find_runs(
+            args.waveform, args.owner, args.runner, _limits(args.min), _limits(args.max)
+        )
+        for run in runs:
+            print(f"{run['run_name']}  owner {run['owner']}  "
+                  f"{run['completed_count']}/{run['config_count']} configs  {run['local_directory']}")
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint file that records the progress of a campaign so that a run
+that dies part way through can be resumed in the same directories.
+
+The checkpoint lives in the meta directory of the run and records the
+remote run directory, the configs that were started and completed and the
+state of every file moved off the radio.  It is rewritten atomically
+after every change so a crash never leaves a truncated checkpoint.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+def file_md5(file_path):
+    """Hex md5 digest of a file, read in blocks"""
+    digest = hashlib.md5()
+    with open(file_path, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """Progress record of a single campaign
+
+    Args:
+        file_path (Path): location of the checkpoint json file
+        run_directory (String): remote run directory, only needed for a new checkpoint
+    """
+
+    def __init__(self, file_path, run_directory=None):
+        self.file_path = Path(file_path)
+        self.lock = threading.Lock()
+        if self.file_path.exists():
+            with open(self.file_path, "r") as in_file:
+                self.state = json.load(in_file)
+        else:
+            self.state = {
+                "run_directory": run_directory,
+                "config_order": None,
+                "started_configs": [],
+                "completed_configs": [],
+                "files": {},
+            }
+            self.save()
+
+    @property
+    def run_directory(self):
+        return self.state["run_directory"]
+
+    def save(self):
+        """Atomically write the checkpoint to disk"""
+        temp_path = self.file_path.with_suffix(".tmp")
+        with open(temp_path, "w") as out_file:
+            json.dump(self.state, out_file, indent=1)
+        os.replace(temp_path, self.file_path)
+
+    def set_config_order(self, config_order):
+        """Record the order configs are run in when it differs from the runner"""
+        with self.lock:
+            self.state["config_order"] = [str(config) for config in config_order]
+            self.save()
+
+    def start_config(self, config):
+        with self.lock:
+            if str(config) not in self.state["started_configs"]:
+                self.state["started_configs"].append(str(config))
+                self.save()
+
+    def complete_config(self, config):
+        with self.lock:
+            if str(config) not in self.state["completed_configs"]:
+                self.state["completed_configs"].append(str(config))
+                self.save()
+
+    def is_complete(self, config):
+        return str(config) in self.state["completed_configs"]
+
+    def in_progress(self):
+        """Configs that were started but never completed"""
+        return [
+            config
+            for config in self.state["started_configs"]
+            if config not in self.state["completed_configs"]
+        ]
+
+    def start_transfer(self, remote_file, local_file, config):
+        """Record that a file is about to be moved off the radio"""
+        with self.lock:
+            self.state["files"][str(local_file)] = {
+                "remote": remote_file,
+                "config": str(config),
+                "status": "transferring",
+            }
+            self.save()
+
+    def record_transfer(self, local_file, **details):
+        """Record details such as the checksum of a file whose transfer has
+        not finished yet"""
+        with self.lock:
+            self.state["files"][str(local_file)].update(details)
+            self.save()
+
+    def finish_transfer(self, local_file, **details):
+        """Record that a file was moved and verified, with optional details
+        such as its size or checksum"""
+        with self.lock:
+            record = self.state["files"][str(local_file)]
+            record["status"] = "transferred"
+            record.update(details)
+            self.save()
+
+    def unfinished_transfers(self):
+        """Returns local path -> record of every transfer that did not finish"""
+        return {
+            local_file: record
+            for local_file, record in self.state["files"].items()
+            if record["status"] != "transferred"
+        }
+
+    def reopen_config(self, config):
+        """Mark a config as not completed so it is measured again"""
+        with self.lock:
+            config = str(config)
+            if config in self.state["completed_configs"]:
+                self.state["completed_configs"].remove(config)
+            self.save()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point of atic.
+
+    atic run RUNNER.csv --power 5 --reorder     run a campaign
+    atic run --resume LOCAL_DIRECTORY           resume an interrupted run
+    atic validate RUNNER.csv                    check a runner and its yaml
+    atic collect RUN_DIRECTORY                  build the dataset of a run
+    atic analyze RUN_DIRECTORY [...]            summarize the configs of runs
+    atic serve [QUEUE_DIRECTORY]                run the runners of a queue
+
+A runner is a csv with a yaml file of the same name, or just the yaml if
+it defines a sweep (see sweep.py).  Every subcommand imports the modules
+it needs when it runs, so validating a runner does not load pandas,
+labbench, paramiko or the instrument drivers.  From a checkout the same
+commands run with python -m atic.
+"""
+
+import argparse
+import csv
+import os
+import sys
+from pathlib import Path
+
+# the modules of atic import each other by file name
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def validate_runner(runner_path, preview=0):
+    """Check a runner csv, or the sweep of its yaml, without running it
+
+    Args:
+        runner_path (Path): the runner csv or yaml
+        preview (int): number of configs of a sweep to print
+
+    Returns:
+        problems (List): descriptions of everything wrong with the runner
+    """
+    from logs import YamlSerializer
+    from sweep import Sweep, validate_rows
+
+    yaml_file = Path(runner_path).with_suffix(".yaml")
+    if not yaml_file.exists():
+        return [f"{yaml_file} is missing"]
+    metadata = YamlSerializer().load(yaml_file) or {}
+    problems = [f"{yaml_file} does not name the {key}" for key in ("owner", "reason") if key not in metadata]
+    if "sweep" in metadata:
+        try:
+            sweep = Sweep(metadata["sweep"])
+        except ValueError as error:
+            return problems + str(error).splitlines()[1:]
+        print(f"{sweep.method} sweep of {len(sweep)} configs from a space of {sweep.size}")
+        for test_config, _ in zip(sweep, range(preview)):
+            print(test_config)
+        return problems
+    csv_file = Path(runner_path).with_suffix(".csv")
+    if not csv_file.exists():
+        return problems + [f"{csv_file} is missing and {yaml_file} has no sweep"]
+    with open(csv_file, "r", newline="") as in_file:
+        rows = list(csv.DictReader(in_file))
+    print(f"{len(rows)} configs in {csv_file}")
+    return problems + validate_rows(rows)
+
+
+def run(args):
+    if args.resume is None:
+        if args.runner is None:
+            raise SystemExit("a runner is needed unless a run is resumed")
+        problems = validate_runner(args.runner)
+        if problems:
+            print("\n".join(problems))
+            raise SystemExit(f"{args.runner} is not valid")
+    import test_link_x410 as runner
+
+    #instantiating and opening instruments
+    runner.open_instruments(simulate=args.simulate)
+    data_root = str(Path(runner.testbed.root, "Local_Data")) if args.simulate else None
+    runner.run_campaign(
+        args.runner,
+        resume=args.resume,
+        reorder=args.reorder,
+        power=args.power,
+        data_root=data_root,
+        trace=args.trace,
+        metrics_port=args.metrics_port,
+    )
+    #closing all the instruments once the test is over
+    runner.set_x410_playback(False, runner.usrp, args.power)
+    runner.close_instruments()
+
+
+def validate(args):
+    problems = validate_runner(args.runner, args.preview)
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print(f"{args.runner} is valid")
+
+
+def collect(args):
+    from dataset import build_dataset
+
+    build_dataset(args.run_directory, args.output, args.workers, args.rebuild)
+
+
+def analyze(args):
+    from analysis import summarize_runs
+
+    summary = summarize_runs(args.run_directories, workers=args.workers, rebuild=args.rebuild)
+    if args.output is None:
+        print(summary.to_string(index=False))
+    elif args.output.endswith(".parquet"):
+        summary.to_parquet(args.output, index=False)
+    else:
+        summary.to_csv(args.output, index=False)
+
+
+def serve(args):
+    from config import testbed_config
+    from daemon import QueueDaemon
+
+    daemon = QueueDaemon(
+        args.queue_directory or testbed_config["filepaths"]["local_queue"],
+        power=args.power,
+        reorder=args.reorder,
+        poll_period=args.poll,
+        simulate=args.simulate,
+        trace=args.trace,
+        metrics_port=args.metrics_port,
+    )
+    daemon.serve(once=args.once)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="atic", description="Automated testbed for interference testing")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run an interference test campaign")
+    run_parser.add_argument("runner", nargs="?", help="runner csv, or the yaml of a sweep")
+    run_parser.add_argument(
+        "--resume",
+        metavar="LOCAL_DIRECTORY",
+        help="resume an interrupted run from its local data directory",
+    )
+    run_parser.add_argument("--power", type=float, default=5, help="X410 output power")
+    run_parser.add_argument(
+        "--reorder",
+        action="store_true",
+        help="reorder the runner to minimize waveform and attenuator transitions",
+    )
+    run_parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="run against the local hardware stand-ins instead of the testbed",
+    )
+    run_parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="record a span trace of every testbed operation in the meta directory",
+    )
+    run_parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve live metrics of the campaign in Prometheus format on this port",
+    )
+    run_parser.set_defaults(function=run)
+
+    validate_parser = subparsers.add_parser("validate", help="check a runner without running it")
+    validate_parser.add_argument("runner", help="runner csv, or the yaml of a sweep")
+    validate_parser.add_argument("--preview", type=int, default=0, metavar="N",
+                                 help="print the first N configs of a sweep")
+    validate_parser.set_defaults(function=validate)
+
+    collect_parser = subparsers.add_parser("collect", help="build the columnar dataset of a run")
+    collect_parser.add_argument("run_directory", help="local run directory")
+    collect_parser.add_argument("--output", help="dataset directory, defaults to <run_directory>/dataset")
+    collect_parser.add_argument("--workers", type=int, help="number of worker processes")
+    collect_parser.add_argument("--rebuild", action="store_true", help="rebuild every config")
+    collect_parser.set_defaults(function=collect)
+
+    analyze_parser = subparsers.add_parser("analyze", help="summarize the per config performance of runs")
+    analyze_parser.add_argument("run_directories", nargs="+", help="local run directories")
+    analyze_parser.add_argument("--output", help="csv or parquet file for the summary, printed otherwise")
+    analyze_parser.add_argument("--workers", type=int, help="number of worker processes")
+    analyze_parser.add_argument("--rebuild", action="store_true", help="summarize every config again")
+    analyze_parser.set_defaults(function=analyze)
+
+    serve_parser = subparsers.add_parser("serve", help="run the runners of a queue directory as they arrive")
+    serve_parser.add_argument("queue_directory", nargs="?", help="defaults to the local_queue of config.py")
+    serve_parser.add_argument("--power", type=float, default=5, help="X410 output power")
+    serve_parser.add_argument("--reorder", action="store_true", help="reorder every runner")
+    serve_parser.add_argument("--poll", type=float, default=5.0, help="seconds between scans of an empty queue")
+    serve_parser.add_argument("--once", action="store_true", help="stop once the queue is empty")
+    serve_parser.add_argument("--simulate", action="store_true", help="run against the local hardware stand-ins")
+    serve_parser.add_argument("--trace", action="store_true", help="record a span trace of every campaign")
+    serve_parser.add_argument("--metrics-port", type=int, help="serve live metrics on this port")
+    serve_parser.set_defaults(function=serve)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
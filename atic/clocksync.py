@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Clock offset estimation between the host, the radios and the X410.
+
+The data of a run is stamped by four clocks: the host (log entries), the
+wall clock of the parent radio (iperf timesecs and the date column of the
+MCS samples), the monotonic clock of the parent radio (the clock column
+of the MCS samples, read from /proc/timer_list) and the system clock of
+the X410 (telemetry).  ClockSync estimates the offset of every device
+clock from the host clock with repeated timestamp exchanges over the
+existing SSH and TCP channels.  The host time of an exchange is taken as
+the midpoint of the request, and the exchange with the shortest round
+trip is kept, so the error is bounded by half its round trip.
+
+The radio date only has one second resolution, so every exchange reads
+the date and the monotonic clock together.  Each reading bounds the
+difference between the two clocks to a one second window, and the
+windows of exchanges spread over a second intersect to a narrow bound.
+
+Offsets are measured at the start of a run and periodically during it
+and are saved to meta/clock_sync.json.  ClockModel fits the offset and
+drift of every clock from the saved measurements and converts device
+times to host time.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+CLOCKS = ["parent_wall", "parent_monotonic", "child_wall", "child_monotonic", "x410"]
+# reads the wall clock in seconds and the monotonic clock in nanoseconds
+RADIO_TIME_COMMAND = "date +%s && awk 'NR==3{print $3}' /proc/timer_list"
+# drift is only fitted over measurements spanning at least this many seconds
+MIN_DRIFT_SPAN = 60
+
+
+class ClockSync:
+    """Measures the offsets of the device clocks from the host clock
+
+    Args:
+        p2p_link (P2PLink): link whose parent and child radios are measured
+        usrp (UsrpX410): X410 client, skipped if None
+        samples (int): timestamp exchanges per device and measurement
+        spacing (float): seconds between the exchanges with a radio,
+            spreads the readings over the second of the radio date
+    """
+
+    def __init__(self, p2p_link, usrp=None, samples=10, spacing=0.11):
+        self.p2p_link = p2p_link
+        self.usrp = usrp
+        self.samples = samples
+        self.spacing = spacing
+        self.measurements = []
+
+    def _exchange(self, query):
+        """Run a query bracketed by host timestamps
+
+        Returns:
+            host_time (float): midpoint of the exchange
+            round_trip (float): seconds the exchange took
+            reply: the return value of the query
+        """
+        before = time.time()
+        reply = query()
+        after = time.time()
+        return (before + after) / 2, after - before, reply
+
+    def _radio_reading(self, ssh_client):
+        stdin, stdout, stderr = self.p2p_link.run_command(ssh_client, RADIO_TIME_COMMAND)
+        date, monotonic = stdout.read().decode().split()[:2]
+        return int(date), int(monotonic) / 1e9
+
+    def measure_radio(self, ssh_client):
+        """Offsets of the wall and monotonic clocks of one radio
+
+        Returns:
+            offsets (dict): "wall" and "monotonic" offsets, device time minus
+                host time, each with its uncertainty in seconds
+        """
+        readings = []
+        for index in range(self.samples):
+            if index:
+                time.sleep(self.spacing)
+            readings.append(self._exchange(lambda: self._radio_reading(ssh_client)))
+        host_time, round_trip, (date, monotonic) = min(readings, key=lambda reading: reading[1])
+        monotonic_offset = monotonic - host_time
+        # wall - monotonic lies within [date - monotonic, date + 1 - monotonic) of every reading
+        lower = max(reply[0] - reply[1] for _, _, reply in readings)
+        upper = min(reply[0] + 1 - reply[1] for _, _, reply in readings)
+        if lower > upper:
+            # a clock was stepped between the readings, fall back to the best one
+            lower, upper = date - monotonic, date + 1 - monotonic
+        return {
+            "monotonic": {"offset": monotonic_offset, "uncertainty": round_trip / 2},
+            "wall": {
+                "offset": monotonic_offset + (lower + upper) / 2,
+                "uncertainty": round_trip / 2 + (upper - lower) / 2,
+            },
+        }
+
+    def measure_x410(self):
+        """Offset of the X410 system clock, device time minus host time"""
+        readings = [self._exchange(self.usrp.get_device_time) for _ in range(self.samples)]
+        host_time, round_trip, device_time = min(readings, key=lambda reading: reading[1])
+        return {"offset": device_time - host_time, "uncertainty": round_trip / 2}
+
+    def measure(self, event="periodic"):
+        """Measure every device clock once
+
+        Args:
+            event (String): why the measurement was taken, e.g. "start"
+
+        Returns:
+            measurement (dict): host time and the offset of every clock
+        """
+        start = time.time()
+        clocks = {}
+        for radio, ssh_client in (
+            ("parent", self.p2p_link.ssh_p2p_parent),
+            ("child", self.p2p_link.ssh_p2p_child),
+        ):
+            offsets = self.measure_radio(ssh_client)
+            clocks[f"{radio}_wall"] = offsets["wall"]
+            clocks[f"{radio}_monotonic"] = offsets["monotonic"]
+        if self.usrp is not None:
+            clocks["x410"] = self.measure_x410()
+        measurement = {"event": event, "host_time": (start + time.time()) / 2, "clocks": clocks}
+        self.measurements.append(measurement)
+        return measurement
+
+    def load(self, file_path):
+        """Continue the measurements saved by an earlier session of the run"""
+        if Path(file_path).exists():
+            with open(file_path, "r") as in_file:
+                self.measurements = json.load(in_file)["measurements"]
+
+    def save(self, file_path):
+        """Atomically write every measurement to a json file"""
+        temp_path = Path(file_path).with_suffix(".tmp")
+        with open(temp_path, "w") as out_file:
+            json.dump({"reference": "host", "measurements": self.measurements}, out_file, indent=1)
+        os.replace(temp_path, file_path)
+
+
+class ClockModel:
+    """Offset and drift of every clock fitted from saved measurements
+
+    Args:
+        measurements (List): measurements as returned by ClockSync.measure
+    """
+
+    def __init__(self, measurements):
+        self.fits = {}
+        for clock in CLOCKS:
+            points = [
+                (measurement["host_time"], measurement["clocks"][clock])
+                for measurement in measurements
+                if clock in measurement["clocks"]
+            ]
+            if not points:
+                continue
+            host_times = np.array([host_time for host_time, _ in points])
+            offsets = np.array([offset["offset"] for _, offset in points])
+            weights = 1 / np.maximum([offset["uncertainty"] for _, offset in points], 1e-4)
+            reference = host_times[0]
+            if host_times[-1] - reference >= MIN_DRIFT_SPAN:
+                drift, intercept = np.polyfit(host_times - reference, offsets, 1, w=weights)
+            else:
+                drift, intercept = 0.0, np.average(offsets, weights=weights)
+            self.fits[clock] = {"reference": reference, "offset": intercept, "drift": drift}
+
+    @classmethod
+    def load(cls, file_path):
+        """Model of a clock_sync.json file, None if there is no such file"""
+        if not Path(file_path).exists():
+            return None
+        with open(file_path, "r") as in_file:
+            return cls(json.load(in_file)["measurements"])
+
+    def to_host(self, clock, device_times):
+        """Convert device times to host time
+
+        With offset = a + b (host - reference) and device = host + offset,
+        host = (device - a + b reference) / (1 + b).
+
+        Args:
+            clock (String): one of CLOCKS
+            device_times (array): times read from that clock
+
+        Returns:
+            host_times (array): the same instants in host time
+        """
+        fit = self.fits[clock]
+        device_times = np.asarray(device_times, dtype=float)
+        return (device_times - fit["offset"] + fit["drift"] * fit["reference"]) / (1 + fit["drift"])
@@ -45,8 +45,63 @@ testbed_config = {
         "current1_max": 0.150,
         "current2_max": 0.300,
         "current3_max": 0.300,
+        # channels read by the background sampler and the seconds between reads
+        "sample_channels": [1, 2, 3],
+        "sample_period": 1.0,
     },
     "filepaths": { 
-        "local_data_root": r"C:\Users\Public\Documents\Local_Data"
+        "local_data_root": r"C:\Users\Public\Documents\Local_Data",
+        "local_queue": r"C:\Users\Public\Documents\Local_Queue",
+    },
+    "planner_config": {
+        "wv_switch_time": 15.0,
+        "settle_time_per_db": 0.2,
+    },
+    "clock_sync_config": {
+        "period": 600,
+        "samples": 10,
+        "spacing": 0.11,
+        # seconds the offsets of a finished campaign stay valid for the next one
+        "reuse_age": 120,
+    },
+    "log_config": {
+        # a new log segment is started at whichever limit is reached first
+        "max_entries": 1000,
+        "max_bytes": 1 << 20,
+        "max_configs": 50,
+    },
+    "io_config": {
+        # seconds before an operation on a radio or the X410 is abandoned,
+        # command is added to the duration of long running measurements
+        "deadlines": {
+            "connect": 10.0,
+            "command": 30.0,
+            "transfer": 300.0,
+            "x410": 10.0,
+            "x410_load": 180.0,
+        },
+        # attempts after the first, waiting backoff seconds doubled every time
+        "retries": 3,
+        "backoff": 1.0,
+        "max_backoff": 30.0,
+        # seconds an idle connection waits before a keepalive is sent
+        "heartbeat": 30.0,
+    },
+    "metrics_config": {
+        "host": "127.0.0.1",
+    },
+    "analysis_config": {
+        # nominal levels at the RX port in dBm with the attenuators in the
+        # path at 0 dB, replace them with measured values to calibrate
+        "signal_power": -20.0,
+        "interferer_power": -30.0,
+        "interferer_reference_output": 5.0,
+        "noise_diode_power": -60.0,
+        "noise_floor": -95.0,
+        # an iperf interval below this many bits per second is an outage
+        "outage_threshold": 1e6,
+        "percentiles": [5, 10, 90, 95],
+        # coded bits per symbol of MCS 0 to 9
+        "mcs_efficiency": [0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 4.5, 5.0, 6.0, 6.667],
     },
 }
\ No newline at end of file
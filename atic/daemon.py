@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Queue daemon that runs the runners dropped into a queue directory.
+
+The instruments are opened once and stay open between campaigns: the SSH
+sessions and the iperf server of the radios, the attenuators, the power
+supply and the X410 socket, whose replay buffer keeps the last waveform
+loaded for the next campaign.  The queue directory is polled for runners,
+a csv with its yaml or the yaml of a sweep, which are run one at a time
+in priority order, the highest priority key of the yaml first and then the
+oldest.  A finished runner is moved to the done folder of the queue, one
+that is invalid or whose campaign failed to the failed folder with the
+reason next to it:
+
+    <queue>/runner.csv, <queue>/runner.yaml     waiting
+    <queue>/done/runner.csv                     run
+    <queue>/failed/runner.csv, runner.error.txt not run, or failed
+
+    atic serve C:/Users/Public/Documents/Local_Queue --power 5
+"""
+
+import shutil
+import time
+import traceback
+from pathlib import Path
+
+import yaml
+
+import test_link_x410 as runner
+from cli import validate_runner
+from logs import YamlSerializer
+
+DONE_FOLDER = "done"
+FAILED_FOLDER = "failed"
+
+
+class QueueDaemon:
+    """Runs the runners of a queue directory on instruments kept open
+
+    Args:
+        queue_directory (Path): directory watched for runners
+        power (float): X410 output power
+        reorder (bool): reorder every runner to minimize transition time
+        poll_period (float): seconds between scans of an empty queue
+        min_age (float): seconds a runner must be unchanged before it is taken,
+            so files that are still being copied are left alone
+        simulate (bool): run against the local hardware stand-ins
+        trace (bool): record a span trace of every campaign
+        metrics_port (int): serve live metrics of the running campaign on this port
+        **simulate_options: SimulatedTestbed options such as time_scale and delays
+    """
+
+    def __init__(
+        self,
+        queue_directory,
+        power=5,
+        reorder=False,
+        poll_period=5.0,
+        min_age=2.0,
+        simulate=False,
+        trace=False,
+        metrics_port=None,
+        **simulate_options
+    ):
+        self.queue_directory = Path(queue_directory)
+        self.power = power
+        self.reorder = reorder
+        self.poll_period = poll_period
+        self.min_age = min_age
+        self.simulate = simulate
+        self.trace = trace
+        self.metrics_port = metrics_port
+        self.simulate_options = simulate_options
+        self.completed = []
+        self.instruments_open = False
+
+    def pending(self):
+        """Runners waiting in the queue, in the order they will run
+
+        Returns:
+            runners (List): the csv of every runner, or the yaml of a sweep
+        """
+        now = time.time()
+        runners = []
+        for yaml_file in self.queue_directory.glob("*.yaml"):
+            csv_file = yaml_file.with_suffix(".csv")
+            files = [yaml_file, csv_file] if csv_file.exists() else [yaml_file]
+            if any(now - path.stat().st_mtime < self.min_age for path in files):
+                continue
+            try:
+                metadata = YamlSerializer().load(yaml_file) or {}
+                sweep = "sweep" in metadata
+                priority = float(metadata.get("priority", 0))
+            except (yaml.YAMLError, AttributeError, TypeError, ValueError) as error:
+                # one bad file must not stop the queue
+                print(f"{yaml_file.name} could not be read, moved to {FAILED_FOLDER}")
+                self.archive(files[-1], FAILED_FOLDER, f"{yaml_file.name} could not be read: {error}\n")
+                continue
+            if not csv_file.exists() and not sweep:
+                continue
+            runners.append((-priority, yaml_file.stat().st_mtime, files[-1]))
+        return [runner_path for _, _, runner_path in sorted(runners)]
+
+    def archive(self, runner_path, folder, error=None):
+        """Move the csv and yaml of a runner to a folder of the queue"""
+        destination = Path(self.queue_directory, folder)
+        destination.mkdir(exist_ok=True)
+        stem = runner_path.stem
+        # a runner queued again under the same name keeps the earlier one
+        if any(Path(destination, stem + suffix).exists() for suffix in (".csv", ".yaml")):
+            stem += time.strftime("-%Y_%m_%d-%H_%M_%S")
+        for suffix in (".csv", ".yaml"):
+            if runner_path.with_suffix(suffix).exists():
+                shutil.move(str(runner_path.with_suffix(suffix)), str(Path(destination, stem + suffix)))
+        if error is not None:
+            Path(destination, stem + ".error.txt").write_text(error)
+        return Path(destination, stem + runner_path.suffix)
+
+    def run_next(self, runner_path):
+        """Validate and run one runner, then move it out of the queue
+
+        Returns:
+            bool: True if the campaign ran to the end
+        """
+        problems = validate_runner(runner_path)
+        if problems:
+            print(f"{runner_path.name} is not valid, moved to {FAILED_FOLDER}")
+            self.archive(runner_path, FAILED_FOLDER, "\n".join(problems) + "\n")
+            return False
+        print(f"starting {runner_path.name}")
+        start = time.time()
+        try:
+            runner.run_campaign(
+                runner_path,
+                reorder=self.reorder,
+                power=self.power,
+                data_root=self.data_root,
+                trace=self.trace,
+                metrics_port=self.metrics_port,
+            )
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+            print(f"{runner_path.name} failed, moved to {FAILED_FOLDER}")
+            self.archive(runner_path, FAILED_FOLDER, error)
+            # the connections may be what failed, they are opened again
+            self.reopen_instruments()
+            return False
+        #the interferer stays off while the queue waits
+        if not self.stop_interferer():
+            self.reopen_instruments()
+        self.archive(runner_path, DONE_FOLDER)
+        self.completed.append({"runner": runner_path.name, "seconds": round(time.time() - start, 3)})
+        print(f"{runner_path.name} done in {time.time() - start:.1f} seconds, moved to {DONE_FOLDER}")
+        return True
+
+    def open_instruments(self):
+        runner.open_instruments(simulate=self.simulate, **self.simulate_options)
+        self.data_root = str(Path(runner.testbed.root, "Local_Data")) if self.simulate else None
+        self.instruments_open = True
+
+    def close_instruments(self):
+        self.instruments_open = False
+        runner.close_instruments()
+        if self.simulate:
+            runner.testbed.close()
+
+    def stop_interferer(self):
+        """Stop the X410 playback and check that its RF output is off
+
+        Returns:
+            bool: True if the X410 reports its RF output off
+        """
+        runner.usrp.stop_wv()
+        if runner.usrp.query_rf():
+            print("the X410 RF output is still on after stop")
+            return False
+        return True
+
+    def reopen_instruments(self):
+        """Close every instrument and device connection and open them again
+
+        Exclusive sessions such as the serial port of the power supply have
+        to be released before they can be opened again.  A failure is
+        printed and the queue tries again before its next runner.
+
+        Returns:
+            bool: True if the instruments are open
+        """
+        try:
+            self.close_instruments()
+        except Exception:
+            print(f"closing the instruments failed\n{traceback.format_exc()}")
+        try:
+            self.open_instruments()
+            if not self.stop_interferer():
+                raise RuntimeError("the interferer could not be stopped")
+        except Exception:
+            print(f"opening the instruments failed\n{traceback.format_exc()}")
+            # closed again, so the next runner waits for a reopen
+            try:
+                self.close_instruments()
+            except Exception:
+                pass
+            return False
+        return True
+
+    def serve(self, once=False):
+        """Run the queue until interrupted
+
+        Args:
+            once (bool): return when the queue is empty instead of waiting for more
+        """
+        self.queue_directory.mkdir(parents=True, exist_ok=True)
+        self.open_instruments()
+        print(f"watching {self.queue_directory} for runners")
+        try:
+            while True:
+                runners = self.pending()
+                if runners and not self.instruments_open and not self.reopen_instruments():
+                    if once:
+                        break
+                    time.sleep(self.poll_period)
+                elif runners:
+                    self.run_next(runners[0])
+                elif once:
+                    break
+                else:
+                    time.sleep(self.poll_period)
+        except KeyboardInterrupt:
+            print("queue daemon stopped")
+        finally:
+            if self.instruments_open:
+                self.close_instruments()
+        return self.completed
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
+
+    main(["serve", *sys.argv[1:]])
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Builds a columnar dataset from the files of a run directory.
+
+A run directory holds the iperf output of every config (*_iperf.json for
+the measurement window and *s_iperf.json for the settle windows, read
+with the streaming parser of iperf_parser.py), the MCS counters sampled by
+mcs_loop.sh (*_mcs.json), the power supply samples of power_monitor.py
+(*_power.json), the round trip probes of UDP rows (*_ping.json, see
+latency.py) and the event log (meta/log.yaml, or its segments while the
+run is going, see logs.SegmentedLog).  The builder flattens the iperf
+intervals and the MCS, power and ping samples into tables, puts every row
+on the host time axis with the clock offsets of meta/clock_sync.json (see
+clocksync.py) and joins the attenuator, waveform and power
+settings that were active at that time from the log.  The tables are
+written as a Parquet dataset partitioned by config:
+
+    <run directory>/dataset/iperf/config=<config>/part.parquet
+    <run directory>/dataset/mcs/config=<config>/part.parquet
+    <run directory>/dataset/power/config=<config>/part.parquet
+    <run directory>/dataset/ping/config=<config>/part.parquet
+    <run directory>/dataset/manifest.json
+
+Configs are processed in parallel and the manifest records the size and
+modification time of the source files of every built config, so running
+the builder again only processes configs that are new or changed:
+
+    python dataset.py Local_Data/runner-2023_06_01-10_00_00
+"""
+
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from catalog import CATALOG_NAME, Catalog
+from clocksync import ClockModel
+from iperf_parser import parse_iperf_file
+from logs import load_log
+
+TABLES = ["iperf", "mcs", "power", "ping"]
+ATTENUATORS = ["p2p_parent_attn", "p2p_child_attn", "noise_diode_attn", "interferer_attn"]
+# log fields of the X410 entries and their dataset column names
+X410_FIELDS = {
+    "Playback WV": "wv_file",
+    "Set power output": "set_power",
+    "Reported power output": "reported_power",
+    "RF Output": "rf_output",
+}
+# UDP columns reported by the receiving server, the client counts the packets sent
+RECEIVER_FIELDS = ["jitter_ms", "lost_packets", "lost_percent"]
+MCS_DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
+# entries whose state was read before they were logged, the overlapped
+# persist stage writes them while the next config is already settling
+DEFERRED_EVENTS = ["after_test"]
+
+
+def iperf_frame(file_path, config, phase, clock_model=None):
+    """Read the interval sums of an iperf file into a table
+
+    Args:
+        file_path (Path): *_iperf.json file
+        config (String): config number of the file
+        phase (String): "test" for the measurement window, "settle" otherwise
+        clock_model (ClockModel): converts the parent radio clock to host time
+
+    Returns:
+        DataFrame: one row per interval with the epoch time at its end
+    """
+    parsed = parse_iperf_file(file_path)
+    frame = pd.DataFrame(parsed["intervals"])
+    if frame.empty:
+        return frame
+    frame = join_receiver(frame, pd.DataFrame(parsed["server_intervals"]))
+    # the UDP columns stay NaN for TCP tests, partitions of a campaign that
+    # mixes both modes must have the same columns to be read as one table
+    timestamp = frame.pop("timesecs").to_numpy() + frame["end"].to_numpy()
+    if clock_model is not None and "parent_wall" in clock_model.fits:
+        # the iperf client runs on the parent, streamed documents use host time
+        radio = np.array(parsed["clocks"])[frame["document"].to_numpy()] != "host"
+        timestamp[radio] = clock_model.to_host("parent_wall", timestamp[radio])
+    frame.insert(0, "timestamp", timestamp)
+    frame["phase"] = phase
+    frame["config"] = config
+    return frame
+
+
+def join_receiver(frame, server):
+    """Attach the jitter and loss the server reported for a UDP stream
+
+    The server output of every client document is matched to the document
+    that started closest to it, and its intervals to the client intervals
+    by position.
+
+    Args:
+        frame (DataFrame): client intervals
+        server (DataFrame): server intervals of the same file
+
+    Returns:
+        DataFrame: client intervals with the receiver columns filled in
+    """
+    if server.empty or server["jitter_ms"].isna().all():
+        return frame
+    starts = frame.groupby("document")["timesecs"].first()
+    nearest = np.abs(server["timesecs"].to_numpy()[:, None] - starts.to_numpy()[None, :]).argmin(axis=1)
+    server = server.assign(document=starts.index.to_numpy()[nearest])
+    server["position"] = server.groupby("document").cumcount()
+    receiver = server[["document", "position"] + RECEIVER_FIELDS]
+    frame = frame.drop(columns=RECEIVER_FIELDS).assign(position=frame.groupby("document").cumcount())
+    return frame.merge(receiver, on=["document", "position"], how="left").drop(columns="position")
+
+
+def mcs_frame(file_path, config, clock_model=None):
+    """Read the MCS samples of a config into a table
+
+    The counters are converted to numbers, and the epoch time of every
+    sample comes from the monotonic radio clock, converted with the clock
+    model, or offset by the median difference between the one second
+    resolution date and the clock without one.
+
+    Returns:
+        DataFrame: one row per sample
+    """
+    with open(file_path, "r") as in_file:
+        frame = pd.DataFrame.from_records(json.load(in_file))
+    if frame.empty:
+        return frame
+    counters = [column for column in frame.columns if column.startswith("mcs")]
+    frame[counters] = frame[counters].apply(pd.to_numeric, errors="coerce")
+    frame["clock"] = pd.to_numeric(frame["clock"], errors="coerce")
+    if clock_model is not None and "parent_monotonic" in clock_model.fits:
+        frame.insert(0, "timestamp", clock_model.to_host("parent_monotonic", frame["clock"]))
+        frame["config"] = config
+        return frame
+    # the radio runs on UTC, drop the zone name so one format parses every date
+    dates = frame["date"].astype(str).str.replace(r" [A-Z]{2,5} ", " ", regex=True)
+    dates = pd.to_datetime(dates, format=MCS_DATE_FORMAT, errors="coerce", utc=True)
+    seconds = (dates - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+    offset = np.nanmedian(seconds - frame["clock"]) if seconds.notna().any() else np.nan
+    frame.insert(0, "timestamp", frame["clock"] + offset)
+    frame["config"] = config
+    return frame
+
+
+def power_frame(file_path, config):
+    """Read the power supply samples of a config into a table
+
+    The samples are taken on the host, so their time needs no conversion.
+
+    Returns:
+        DataFrame: one row per sample with the voltage, current and power of every channel
+    """
+    with open(file_path, "r") as in_file:
+        frame = pd.DataFrame.from_records(json.load(in_file))
+    if frame.empty:
+        return frame
+    frame.insert(0, "timestamp", frame.pop("time"))
+    frame["config"] = config
+    return frame
+
+
+def ping_frame(file_path, config):
+    """Read the round trip probes of a config into a table
+
+    The replies are stamped with host time as they arrive, see latency.py.
+
+    Returns:
+        DataFrame: one row per reply with its sequence number and round trip time
+    """
+    with open(file_path, "r") as in_file:
+        frame = pd.DataFrame.from_records(json.load(in_file)["replies"])
+    if frame.empty:
+        return frame
+    frame.insert(0, "timestamp", frame.pop("time"))
+    frame["config"] = config
+    return frame
+
+
+def settings_frame(log):
+    """Table of the testbed settings recorded in the log
+
+    Every log entry that records attenuator or X410 settings becomes a row
+    with its epoch time, the settings it does not record are carried
+    forward from earlier entries.  Deferred entries are skipped because
+    their time is not the time their state was read, and waveforms that
+    were pushed to the X410 are named by their runner file instead of
+    their content addressed path.
+
+    Args:
+        log (List): entries of the log of the run
+
+    Returns:
+        DataFrame: time ordered settings
+    """
+    entries = [
+        entry
+        for entry in log
+        if isinstance(entry, dict) and "timestamp" in entry and entry.get("event") not in DEFERRED_EVENTS
+    ]
+    entries.sort(key=lambda entry: entry["timestamp"])
+    staged = {
+        entry["remote_file"]: entry["wv_file"]
+        for entry in entries
+        if entry.get("event") == "waveform staged"
+    }
+    current = {}
+    rows = []
+    for entry in entries:
+        changes = {name: entry[name] for name in ATTENUATORS if name in entry}
+        changes.update({column: entry[field] for field, column in X410_FIELDS.items() if field in entry})
+        if not changes:
+            continue
+        if changes.get("wv_file") in staged:
+            changes["wv_file"] = staged[changes["wv_file"]]
+        current.update(changes)
+        rows.append(
+            {"timestamp": pd.Timestamp(entry["timestamp"]).timestamp(), "event": entry.get("event"), **current}
+        )
+    columns = ["timestamp", "event"] + ATTENUATORS + list(X410_FIELDS.values())
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def join_settings(frame, settings):
+    """Attach the settings active at the time of every row"""
+    if frame.empty or settings.empty:
+        return frame
+    frame = frame.sort_values("timestamp", kind="stable")
+    valid = frame["timestamp"].notna()
+    joined = pd.merge_asof(
+        frame[valid],
+        settings.rename(columns={"event": "log_event"}),
+        on="timestamp",
+        direction="backward",
+    )
+    joined = pd.concat([joined, frame[~valid]], ignore_index=True)
+    joined["time"] = pd.to_datetime(joined["timestamp"], unit="s", utc=True)
+    return joined
+
+
+def config_files(run_directory):
+    """Map every config of a run directory to its source files
+
+    Returns:
+        configs (dict): config -> {"test": path, "settle": path, "mcs": path, "power": path, "ping": path}
+    """
+    configs = {}
+    for path in Path(run_directory).glob("*_iperf.json"):
+        match = re.fullmatch(r"(?P<config>.+?)(?P<settle>s?)_iperf\.json", path.name)
+        phase = "settle" if match["settle"] else "test"
+        configs.setdefault(match["config"], {})[phase] = path
+    for path in Path(run_directory).glob("*_mcs.json"):
+        configs.setdefault(path.name[: -len("_mcs.json")], {})["mcs"] = path
+    for path in Path(run_directory).glob("*_power.json"):
+        configs.setdefault(path.name[: -len("_power.json")], {})["power"] = path
+    for path in Path(run_directory).glob("*_ping.json"):
+        configs.setdefault(path.name[: -len("_ping.json")], {})["ping"] = path
+    return configs
+
+
+def signature(files):
+    """Size and modification time of the source files of a config"""
+    output = {}
+    for kind, path in sorted(files.items()):
+        stat = os.stat(path)
+        output[kind] = [path.name, stat.st_size, stat.st_mtime_ns]
+    return output
+
+
+def build_config(dataset_directory, config, files, settings, clock_model=None):
+    """Build and write the tables of a single config
+
+    Returns:
+        rows (dict): number of rows written per table
+    """
+    frames = {
+        "iperf": [
+            iperf_frame(files[phase], config, phase, clock_model)
+            for phase in ("settle", "test")
+            if phase in files
+        ],
+        "mcs": [mcs_frame(files["mcs"], config, clock_model)] if "mcs" in files else [],
+        "power": [power_frame(files["power"], config)] if "power" in files else [],
+        "ping": [ping_frame(files["ping"], config)] if "ping" in files else [],
+    }
+    rows = {}
+    for table, parts in frames.items():
+        parts = [part for part in parts if not part.empty]
+        partition = Path(dataset_directory, table, f"config={config}")
+        if not parts:
+            rows[table] = 0
+            continue
+        frame = join_settings(pd.concat(parts, ignore_index=True), settings)
+        # the partition directory holds the config, keep it out of the file
+        frame = frame.drop(columns="config")
+        partition.mkdir(parents=True, exist_ok=True)
+        temp_path = Path(partition, "part.parquet.tmp")
+        frame.to_parquet(temp_path, index=False)
+        os.replace(temp_path, Path(partition, "part.parquet"))
+        rows[table] = len(frame)
+    return rows
+
+
+def completed_configs(run_directory):
+    """Configs the checkpoint marks as complete, None without a checkpoint"""
+    checkpoint_path = Path(run_directory, "meta", "checkpoint.json")
+    if not checkpoint_path.exists():
+        return None
+    with open(checkpoint_path, "r") as in_file:
+        return set(json.load(in_file)["completed_configs"])
+
+
+def build_dataset(run_directory, output_directory=None, workers=None, rebuild=False):
+    """Build or update the dataset of a run directory
+
+    Args:
+        run_directory (Path): local run directory with the data files and meta
+        output_directory (Path): dataset location, defaults to <run directory>/dataset
+        workers (int): number of worker processes, defaults to the cpu count
+        rebuild (bool): rebuild every config instead of only new or changed ones
+
+    Returns:
+        manifest (dict): the updated manifest
+    """
+    run_directory = Path(run_directory)
+    dataset_directory = Path(output_directory or Path(run_directory, "dataset"))
+    dataset_directory.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(dataset_directory, "manifest.json")
+    manifest = {"run_directory": str(run_directory), "tables": TABLES, "configs": {}}
+    if manifest_path.exists() and not rebuild:
+        with open(manifest_path, "r") as in_file:
+            manifest = json.load(in_file)
+
+    # configs that are still being collected are left for the next update
+    completed = completed_configs(run_directory)
+    pending = {}
+    for config, files in config_files(run_directory).items():
+        if completed is not None and config not in completed:
+            continue
+        files_signature = signature(files)
+        if manifest["configs"].get(config, {}).get("files") != files_signature:
+            pending[config] = (files, files_signature)
+    if not pending:
+        print("dataset is up to date")
+        return manifest
+
+    settings = settings_frame(load_log(Path(run_directory, "meta")))
+    clock_model = ClockModel.load(Path(run_directory, "meta", "clock_sync.json"))
+    manifest["timebase"] = "host" if clock_model is not None else "radio estimate"
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            config: executor.submit(build_config, dataset_directory, config, files, settings, clock_model)
+            for config, (files, _) in pending.items()
+        }
+        for config, future in futures.items():
+            manifest["configs"][config] = {"files": pending[config][1], "rows": future.result()}
+            print(f"config {config} added to the dataset")
+
+    temp_path = manifest_path.with_suffix(".tmp")
+    with open(temp_path, "w") as out_file:
+        json.dump(manifest, out_file, indent=1)
+    os.replace(temp_path, manifest_path)
+    # runs are stored directly under the local data root
+    if Path(run_directory.parent, CATALOG_NAME).exists():
+        Catalog(Path(run_directory.parent, CATALOG_NAME)).set_dataset(run_directory.name, dataset_directory)
+    return manifest
+
+
+def load_dataset(dataset_directory, table="iperf", configs=None):
+    """Read a table of a dataset, optionally only some configs
+
+    Returns:
+        DataFrame: the rows of the table with a config column
+    """
+    filters = [("config", "in", [str(config) for config in configs])] if configs else None
+    return pd.read_parquet(Path(dataset_directory, table), filters=filters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the columnar dataset of a run directory")
+    parser.add_argument("run_directory", help="local run directory")
+    parser.add_argument("--output", help="dataset directory, defaults to <run_directory>/dataset")
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild every config")
+    args = parser.parse_args()
+    build_dataset(args.run_directory, args.output, args.workers, args.rebuild)
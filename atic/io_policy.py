@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded device I/O with retries and reconnects.
+
+Every blocking call to the radios and the X410 goes through an IOPolicy.
+An operation gets the deadline of its kind, after which its connection is
+treated as hung, and a failed or hung operation is tried again a capped
+number of times with exponential backoff.  Before every retry the device
+is given a chance to reconnect and restore its session, e.g. the
+frequency, power and waveform of the X410.  The deadlines and limits are
+the io_config of config.py:
+
+    deadlines    seconds per kind of operation: connect, command (an SSH
+                 command or read, on top of the duration of a measurement),
+                 transfer (a file copied off the radio), x410 and x410_load
+                 (an X410 command that loads a waveform)
+    retries      attempts after the first one
+    backoff      seconds before the first retry, doubled for every other
+    max_backoff  longest wait between attempts
+    heartbeat    seconds an SSH session or the X410 socket may be idle
+                 before a keepalive is sent
+
+The worst case time of an operation is therefore bounded, see
+IOPolicy.bound.  The time of every operation, with its retries, is
+recorded for the config that is running, and the runner logs the
+per config tail latencies with the persist stage:
+
+    {"event": "device io", "config_number": 3, "operations":
+        {"ssh exec_command": {"count": 41, "p50": 0.012, "p99": 0.31,
+                              "max": 0.4, "retries": 1, "reconnects": 1,
+                              "failures": 0}, ...}}
+"""
+
+import threading
+import time
+
+from latency import percentile
+from tracing import tracer
+
+DEFAULT_DEADLINES = {
+    "connect": 10.0,
+    "command": 30.0,
+    "transfer": 300.0,
+    "x410": 10.0,
+    "x410_load": 180.0,
+}
+# connection problems, the ssh errors of paramiko are added by P2PLink
+RETRYABLE = (OSError, EOFError)
+# errors that another attempt would only repeat
+PERMANENT = (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)
+
+
+class DeviceIOError(IOError):
+    """An operation that failed on every attempt"""
+
+
+class IOPolicy:
+    """Deadlines, retries and latency records of the device I/O
+
+    Args:
+        deadlines (dict): seconds per kind of operation, see DEFAULT_DEADLINES
+        retries (int): attempts after the first one
+        backoff (float): seconds before the first retry
+        max_backoff (float): longest wait between attempts
+        heartbeat (float): seconds an idle connection waits for a keepalive
+    """
+
+    def __init__(self, deadlines=None, retries=3, backoff=1.0, max_backoff=30.0, heartbeat=30.0):
+        self.deadlines = dict(DEFAULT_DEADLINES)
+        self.deadlines.update(deadlines or {})
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.heartbeat = heartbeat
+        # config the operations of threads without a traced config belong to
+        self.config = None
+        self.records = {}
+        self._lock = threading.Lock()
+
+    def deadline(self, kind):
+        """Seconds an operation of a kind may take before it is abandoned"""
+        return self.deadlines[kind]
+
+    def delay(self, attempt):
+        """Seconds to wait before an attempt, the first retry is attempt 1"""
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def bound(self, kind, retries=None):
+        """Worst case seconds of an operation, every attempt timing out"""
+        retries = self.retries if retries is None else retries
+        return (retries + 1) * self.deadline(kind) + sum(self.delay(attempt) for attempt in range(1, retries + 1))
+
+    def call(self, operation, function, reconnect=None, errors=RETRYABLE, retries=None):
+        """Run an operation, trying again after connection errors and timeouts
+
+        Args:
+            operation (String): name the latency is recorded under
+            function: callable running one attempt
+            reconnect: callable(attempt) run before every retry, e.g. to open
+                the connection again and restore the session
+            errors (tuple): exception types that are retried
+            retries (int): overrides the retries of the policy, 0 for
+                operations that must not run twice
+
+        Returns:
+            the return value of function
+
+        Raises:
+            DeviceIOError: if the last attempt failed as well
+        """
+        retries = self.retries if retries is None else retries
+        start = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return function()
+                except errors as error:
+                    # nested operations already used up their own attempts
+                    if isinstance(error, (DeviceIOError,) + PERMANENT):
+                        raise
+                    if attempt >= retries:
+                        self.count(operation, "failures")
+                        raise DeviceIOError(
+                            f"{operation} failed after {attempt + 1} attempts: {error!r}"
+                        ) from error
+                    attempt += 1
+                    self.count(operation, "retries")
+                    print(f"{operation} failed with {error!r}, retry {attempt} of {retries} "
+                          f"in {self.delay(attempt):g} seconds")
+                    time.sleep(self.delay(attempt))
+                    if reconnect is not None:
+                        try:
+                            reconnect(attempt)
+                        except errors as reconnect_error:
+                            # the next attempt fails as well and the one after reconnects again
+                            print(f"reconnect for {operation} failed with {reconnect_error!r}")
+                        else:
+                            self.count(operation, "reconnects")
+        finally:
+            self.record(operation, time.monotonic() - start)
+
+    def _operation(self, operation):
+        config = getattr(tracer.local, "config", None) or self.config
+        config = None if config is None else str(config)
+        operations = self.records.setdefault(config, {})
+        if operation not in operations:
+            operations[operation] = {"durations": [], "retries": 0, "reconnects": 0, "failures": 0}
+        return operations[operation]
+
+    def record(self, operation, seconds):
+        """Record the time of an operation for the config that is running"""
+        with self._lock:
+            self._operation(operation)["durations"].append(seconds)
+
+    def count(self, operation, event):
+        """Count a retry, reconnect or failure of an operation"""
+        with self._lock:
+            self._operation(operation)[event] += 1
+
+    def take(self, config):
+        """Remove and summarize the records of a config
+
+        Returns:
+            summary (dict): operation -> count, p50, p99 and max seconds and
+                the retries, reconnects and failures
+        """
+        with self._lock:
+            operations = self.records.pop(None if config is None else str(config), {})
+        summary = {}
+        for operation, record in sorted(operations.items()):
+            durations = sorted(record["durations"])
+            summary[operation] = {
+                "count": len(durations),
+                "p50": round(percentile(durations, 0.5), 4) if durations else None,
+                "p99": round(percentile(durations, 0.99), 4) if durations else None,
+                "max": round(durations[-1], 4) if durations else None,
+                "retries": record["retries"],
+                "reconnects": record["reconnects"],
+                "failures": record["failures"],
+            }
+        return summary
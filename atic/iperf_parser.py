@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming parser for the iperf3 json files of a run.
+
+The *_iperf.json files hold one or more iperf3 -J documents wrapped in
+hand made arrays by run_iperf, and a measurement that was stopped early
+leaves a trailing comma or a truncated document.  Instead of loading the
+whole tree, the parser reads the file in chunks, looks for the few keys
+it needs and decodes only the small "sum" object of every interval into
+NumPy arrays that grow as needed:
+
+    "timesecs"             start time of the document
+    "clock"                "host" for documents stamped with host time
+    "intervals": [         interval sums follow until the "end" section
+    "sum": {               one interval, decoded with raw_decode
+    "server_output_json"   server side results of UDP tests, whose
+                           interval sums are kept apart from the client
+    "error"                the error reported by iperf3
+
+Whatever follows a truncated document is ignored, the intervals before
+it are kept.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+INTERVAL_FIELDS = {
+    "start": np.float64,
+    "end": np.float64,
+    "bytes": np.int64,
+    "bits_per_second": np.float64,
+    "retransmits": np.int64,
+}
+# only present in UDP tests, NaN otherwise
+UDP_FIELDS = ["jitter_ms", "lost_packets", "packets", "lost_percent"]
+MARKERS = re.compile(
+    r'"(?:(?P<section>intervals|end|server_output_json)"\s*:\s*[\[{]'
+    r'|sum"\s*:\s*(?P<sum>\{)'
+    r'|timesecs"\s*:\s*(?P<timesecs>\d+(?:\.\d*)?)'
+    r'|clock"\s*:\s*"(?P<clock>\w+)"'
+    r'|error"\s*:\s*(?P<error>"))'
+)
+BRACES = re.compile(r"[{}]")
+CHUNK_SIZE = 1 << 20
+# longest marker, matches closer than this to the end of a chunk wait for more data
+MARKER_MARGIN = 64
+
+
+class IntervalArrays:
+    """Interval records in preallocated arrays that double when full
+
+    Args:
+        capacity (int): number of records allocated up front
+    """
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.arrays = {name: np.zeros(capacity, dtype) for name, dtype in INTERVAL_FIELDS.items()}
+        self.arrays.update({name: np.full(capacity, np.nan) for name in UDP_FIELDS})
+        self.arrays["document"] = np.zeros(capacity, np.int64)
+        self.arrays["timesecs"] = np.full(capacity, np.nan)
+
+    def append(self, record, document, timesecs):
+        if self.size == len(self.arrays["start"]):
+            for name, array in self.arrays.items():
+                grown = np.full(2 * len(array), np.nan if array.dtype == np.float64 else 0, array.dtype)
+                grown[: self.size] = array
+                self.arrays[name] = grown
+        index = self.size
+        for name in INTERVAL_FIELDS:
+            self.arrays[name][index] = record.get(name, 0)
+        for name in UDP_FIELDS:
+            if name in record:
+                self.arrays[name][index] = record[name]
+        self.arrays["document"][index] = document
+        self.arrays["timesecs"][index] = timesecs
+        self.size += 1
+
+    def trimmed(self):
+        """Returns name -> array of the filled records"""
+        return {name: array[: self.size] for name, array in self.arrays.items()}
+
+
+class IperfParser:
+    """Incremental parser of one iperf json file
+
+    Args:
+        capacity (int): number of interval records allocated up front
+    """
+
+    def __init__(self, capacity=1024):
+        self.client = IntervalArrays(capacity)
+        self.server = IntervalArrays(max(capacity // 8, 16))
+        self.decoder = json.JSONDecoder()
+        self.errors = []
+        # clock of every client document, the radio clock unless it says otherwise
+        self.clocks = []
+        self.truncated = False
+        # text that was not parsed yet and the brace depth at its start
+        self.buffer = ""
+        self.depth = 0
+        self.document = -1
+        self.timesecs = np.nan
+        self.server_document = -1
+        self.server_timesecs = np.nan
+        # depth of the open "intervals" section, None outside of one
+        self.intervals_depth = None
+        # depth of the open "server_output_json" object, None outside of one
+        self.server_depth = None
+
+    def _advance(self, buffer, start, end):
+        """Count the braces of buffer[start:end] into the depth, and close
+        the server section if the depth fell back to where it started"""
+        if self.server_depth is not None:
+            for brace in BRACES.finditer(buffer, start, end):
+                self.depth += 1 if brace.group() == "{" else -1
+                if self.depth <= self.server_depth:
+                    self.server_depth = None
+                    self.intervals_depth = None
+                    self.depth += buffer.count("{", brace.end(), end) - buffer.count("}", brace.end(), end)
+                    return
+        else:
+            self.depth += buffer.count("{", start, end) - buffer.count("}", start, end)
+
+    def feed(self, text, final=False):
+        """Parse the next piece of the file
+
+        Args:
+            text (String): the next characters of the file
+            final (bool): no more text follows, decode failures are truncation
+        """
+        buffer = self.buffer + text
+        # everything before position is counted into self.depth
+        position = 0
+        limit = len(buffer) if final else max(len(buffer) - MARKER_MARGIN, 0)
+        for match in MARKERS.finditer(buffer):
+            if match.start() < position:
+                # inside an object that was already decoded
+                continue
+            if match.start() >= limit:
+                break
+            self._advance(buffer, position, match.start())
+            position = match.start()
+            in_server = self.server_depth is not None
+            if match["section"] == "server_output_json":
+                self.server_depth = self.depth
+                self.intervals_depth = None
+            elif match["section"] == "intervals":
+                self.intervals_depth = self.depth
+            elif match["section"] == "end":
+                if self.depth == self.intervals_depth:
+                    self.intervals_depth = None
+            elif match["timesecs"] is not None:
+                if in_server:
+                    self.server_document += 1
+                    self.server_timesecs = float(match["timesecs"])
+                else:
+                    self.document += 1
+                    self.timesecs = float(match["timesecs"])
+                    self.clocks.append("radio")
+                    self.intervals_depth = None
+            elif match["clock"] is not None:
+                if not in_server and self.clocks:
+                    self.clocks[-1] = match["clock"]
+            else:
+                try:
+                    value, end = self.decoder.raw_decode(buffer, match.end() - 1)
+                except json.JSONDecodeError:
+                    if final:
+                        self.truncated = True
+                        self.buffer = ""
+                        return
+                    # wait for the rest of the object
+                    self.buffer = buffer[position:]
+                    return
+                if match["error"] is not None:
+                    self.errors.append(value)
+                elif self.intervals_depth is not None and self.depth == self.intervals_depth + 1:
+                    if in_server:
+                        self.server.append(value, self.server_document, self.server_timesecs)
+                    else:
+                        self.client.append(value, self.document, self.timesecs)
+                # the decoded object is balanced, the depth is unchanged
+                position = end
+        end = max(position, limit)
+        self._advance(buffer, position, end)
+        self.buffer = buffer[end:]
+        if final and self.depth > 0:
+            self.truncated = True
+
+    def result(self):
+        """Returns the parsed intervals, see parse_iperf_file"""
+        return {
+            "intervals": self.client.trimmed(),
+            "server_intervals": self.server.trimmed(),
+            "documents": self.document + 1,
+            "clocks": self.clocks,
+            "errors": self.errors,
+            "truncated": self.truncated,
+        }
+
+
+def parse_iperf_file(file_path, chunk_size=CHUNK_SIZE):
+    """Parse the interval sums of an iperf json file in a single pass
+
+    Args:
+        file_path (Path): *_iperf.json file of a run
+        chunk_size (int): characters read at a time
+
+    Returns:
+        parsed (dict): "intervals" and "server_intervals" (name -> array,
+            with the document index and start timesecs of every interval),
+            the number of documents, the clock of every document, the iperf
+            errors and whether the file ended in a truncated document
+    """
+    # pretty printed iperf output takes well over 500 bytes per interval
+    parser = IperfParser(capacity=max(1024, os.path.getsize(file_path) // 500))
+    with open(file_path, "r") as in_file:
+        while True:
+            text = in_file.read(chunk_size)
+            if not text:
+                break
+            parser.feed(text)
+    parser.feed("", final=True)
+    return parser.result()
+
+
+def close_truncated_array(file_path):
+    """Close the array of a file that was stopped after a separating comma
+
+    Only the end of the file is read, so large files are not loaded.
+
+    Returns:
+        bool: True if the file was changed
+    """
+    with open(file_path, "rb+") as file_handle:
+        file_handle.seek(0, os.SEEK_END)
+        size = file_handle.tell()
+        file_handle.seek(max(0, size - MARKER_MARGIN))
+        tail = file_handle.read()
+        stripped = tail.rstrip()
+        if not stripped.endswith(b","):
+            return False
+        file_handle.seek(size - len(tail) + len(stripped) - 1)
+        file_handle.truncate()
+        file_handle.write(b"\n]")
+    return True
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+UDP measurement mode for latency, jitter and loss.
+
+Runner rows measure TCP throughput unless they select another mode with
+the optional runner columns read by this module:
+
+    mode             "tcp" (default) or "udp"
+    udp_rate         target rate of the UDP stream in bits/s, a K, M or G
+                     suffix is allowed, default 10M
+    ping_interval    seconds between round trip probes sent while the
+                     stream runs, no probes if empty
+    ping_size        payload bytes of every probe, default 56
+
+A UDP row runs the iperf client with -u at udp_rate and asks for the
+server output, whose interval sums carry the jitter and loss seen by the
+receiver, so <config>_iperf.json keeps the same layout as a TCP row and
+both are collected and parsed by the same code.  The settle windows of a
+UDP row run the same stream.  The round trip probes run ping on the parent
+towards the child, their output is parsed line by line as it arrives and
+the replies are written next to the other files of the config:
+
+    <local run directory>/<config>_ping.json
+
+    {"replies": [{"time": ..., "seq": ..., "rtt_ms": ...}, ...],
+     "summary": {"transmitted": ..., "received": ..., "loss_percent": ...,
+                 "rtt_min_ms": ..., "rtt_mean_ms": ..., "rtt_p99_ms": ..., ...}}
+"""
+
+import json
+import math
+import os
+import re
+import time
+
+from adaptive import UNITS
+
+# the optional runner columns read by this module
+LATENCY_COLUMNS = ["mode", "udp_rate", "ping_interval", "ping_size"]
+MODES = ["tcp", "udp"]
+DEFAULT_UDP_RATE = 10e6
+DEFAULT_PING_SIZE = 56
+# round trip percentiles of the probe summary
+RTT_PERCENTILES = [50, 90, 95, 99]
+# largest UDP payload, larger packet_size values are refused by iperf3
+MAX_UDP_PAYLOAD = 65507
+RATE_PATTERN = re.compile(r"\s*(?P<value>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)\s*(?P<unit>[KMGT]?)\s*")
+# replies of busybox ping ("seq=") and iputils ping ("icmp_seq=")
+REPLY_PATTERN = re.compile(r"\bseq=(?P<seq>\d+)\b.*\btime=(?P<rtt>[\d.]+)\s*ms")
+TRANSMITTED_PATTERN = re.compile(r"(?P<transmitted>\d+) packets transmitted")
+
+
+def measurement_mode(test_config):
+    """Mode of a runner row, "tcp" unless the row selects another"""
+    return str(test_config.get("mode", "") or "tcp").strip().lower()
+
+
+def parse_rate(value):
+    """Rate in bits/s from a number or a string like 10M
+
+    Raises:
+        ValueError: if the value is not a rate
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = RATE_PATTERN.fullmatch(str(value).upper())
+    if match is None:
+        raise ValueError(f"{value!r} is not a rate")
+    return float(match["value"]) * UNITS[match["unit"]]
+
+
+def udp_rate(test_config):
+    """Target rate of the UDP stream of a runner row in bits/s"""
+    value = test_config.get("udp_rate", "")
+    return DEFAULT_UDP_RATE if value == "" or value is None else parse_rate(value)
+
+
+def ping_settings(test_config):
+    """Probe interval and payload size of a runner row
+
+    Returns:
+        settings (tuple): interval in seconds and size in bytes, None if
+            the row sends no probes
+    """
+    interval = test_config.get("ping_interval", "")
+    if interval == "" or interval is None or float(interval) == 0:
+        return None
+    size = test_config.get("ping_size", "")
+    return float(interval), int(DEFAULT_PING_SIZE if size == "" or size is None else float(size))
+
+
+def iperf_traffic_options(test_config):
+    """iperf3 client options that select the traffic of a runner row
+
+    Returns:
+        String: the send timeout for TCP, the UDP rate and server output for UDP
+    """
+    if measurement_mode(test_config) == "udp":
+        return f"-u -b {int(udp_rate(test_config))} --get-server-output"
+    return "--snd-timeout 3000"
+
+
+def latency_problems(row):
+    """Check the latency columns of a runner row
+
+    Args:
+        row (dict): runner row, values as strings or numbers
+
+    Returns:
+        problems (List): descriptions of everything wrong with the columns
+    """
+    problems = []
+    mode = measurement_mode(row)
+    if mode not in MODES:
+        return [f"mode {row['mode']!r} is not one of {MODES}"]
+    try:
+        rate = udp_rate(row)
+        if rate <= 0:
+            problems.append(f"udp_rate is {row['udp_rate']}")
+    except ValueError as error:
+        problems.append(f"udp_rate {error}")
+    try:
+        settings = ping_settings(row)
+    except (TypeError, ValueError):
+        problems.append(f"ping_interval {row.get('ping_interval')!r} or ping_size "
+                        f"{row.get('ping_size')!r} is not a number")
+    else:
+        if settings is not None and (settings[0] < 0 or settings[1] < 0):
+            problems.append(f"ping_interval {settings[0]} or ping_size {settings[1]} is negative")
+    if mode == "udp":
+        if str(row.get("adaptive", "")).strip().lower() in ("1", "true", "yes"):
+            problems.append("adaptive windows judge TCP throughput, they are not available in udp mode")
+        try:
+            if float(row.get("packet_size", 0)) > MAX_UDP_PAYLOAD:
+                problems.append(f"packet_size {row['packet_size']} is larger than a UDP datagram")
+        except (TypeError, ValueError):
+            pass
+    return problems
+
+
+def parse_ping_reply(line):
+    """Parse one reply line of ping
+
+    Returns:
+        reply (dict): sequence number and round trip time in ms, None for
+            lines that are not replies
+    """
+    match = REPLY_PATTERN.search(line)
+    if match is None:
+        return None
+    return {"seq": int(match["seq"]), "rtt_ms": float(match["rtt"])}
+
+
+def percentile(ordered, fraction):
+    """Linearly interpolated percentile of a sorted list"""
+    position = (len(ordered) - 1) * fraction
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class RttRecorder:
+    """Collects the replies of a ping run as its output arrives
+
+    Args:
+        percentiles (List): round trip percentiles of the summary
+    """
+
+    def __init__(self, percentiles=RTT_PERCENTILES):
+        self.percentiles = list(percentiles)
+        self.replies = []
+        # reported by the statistics at the end of the output
+        self.transmitted = None
+
+    def feed(self, line):
+        """Parse the next line of ping output
+
+        Returns:
+            reply (dict): host time, sequence number and round trip time,
+                None for lines that are not replies
+        """
+        reply = parse_ping_reply(line)
+        if reply is None:
+            match = TRANSMITTED_PATTERN.search(line)
+            if match is not None:
+                self.transmitted = int(match["transmitted"])
+            return None
+        reply = {"time": time.time(), **reply}
+        self.replies.append(reply)
+        return reply
+
+    def summary(self):
+        """Loss and round trip statistics of the replies so far
+
+        Without the final statistics, e.g. for a stopped run, the probes
+        sent are counted up to the highest sequence number replied to.
+        """
+        received = len({reply["seq"] for reply in self.replies})
+        transmitted = self.transmitted
+        if transmitted is None:
+            transmitted = max((reply["seq"] for reply in self.replies), default=-1) + 1
+        summary = {
+            "transmitted": transmitted,
+            "received": received,
+            "loss_percent": 100.0 * (1 - received / transmitted) if transmitted else None,
+        }
+        rtts = sorted(reply["rtt_ms"] for reply in self.replies)
+        if rtts:
+            summary.update(
+                {
+                    "rtt_min_ms": rtts[0],
+                    "rtt_mean_ms": sum(rtts) / len(rtts),
+                    "rtt_max_ms": rtts[-1],
+                }
+            )
+            for value in self.percentiles:
+                summary[f"rtt_p{value:g}_ms"] = percentile(rtts, value / 100)
+        return summary
+
+    def write(self, file_path):
+        """Write the replies and their summary to a json file
+
+        Returns:
+            summary (dict): the summary written
+        """
+        summary = self.summary()
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, "w") as out_file:
+            json.dump({"replies": self.replies, "summary": summary}, out_file)
+        os.replace(temp_path, file_path)
+        return summary
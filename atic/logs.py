@@ -28,6 +28,8 @@ import datetime
 import re
 import pickle
 import json
+import threading
+from tracing import span
 
 
 
@@ -281,6 +283,7 @@ class Log(object):
         """Creates a log object the optional parameters
 
         """
+        self.lock = threading.Lock()
         defaults = {'serializer': YamlSerializer(),
                     "db_serializer": None,
                     "directory": os.getcwd(),
@@ -343,14 +346,17 @@ class Log(object):
                     new_entry[key] = value
         else:
             new_entry["event"] = entry
-        self.log.append(new_entry)
-        self.save()
+        # entries may be added from a background thread while the next config runs
+        with self.lock:
+            self.log.append(new_entry)
+            self.save()
 
     def save(self, file_path=None, **options):
         if file_path:
             self.file_path = file_path
         data = list(self.log)
-        self.serializer.save(self.file_path, data)
+        with span("log save", "log", entries=len(data)):
+            self.serializer.save(self.file_path, data)
         return self.file_path
 
     def __str__(self):
@@ -400,6 +406,230 @@ class Log(object):
             except:
                 raise KeyError()
 
+class SegmentedLog(object):
+    """Append only log written as rolling yaml segments tracked by a manifest
+
+    Entries are appended to the current segment file and a new segment is
+    started once it holds max_entries entries, max_bytes bytes or entries of
+    max_configs configs.  Appending never rewrites earlier entries, and the
+    manifest that records the entry count, time range and configs of every
+    segment is replaced atomically, so a crash can at most cut the last
+    entry short.  Nothing but the manifest is kept in memory: queries load
+    only the segments that overlap them, and compact merges the segments
+    into one time sorted yaml file once the run is over.
+
+    Args:
+        directory (String): directory of the segments and the manifest
+        max_entries (int): entries per segment
+        max_bytes (int): bytes per segment
+        max_configs (int): configs per segment, unlimited if None
+        compacted_path (String): file written by compact, defaults to log.yaml
+            next to the directory
+    """
+    manifest_name = "manifest.json"
+
+    def __init__(self, directory, max_entries=1000, max_bytes=1 << 20, max_configs=None, compacted_path=None):
+        self.lock = threading.Lock()
+        self.directory = str(directory)
+        self.file_path = self.directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_configs = max_configs
+        self.compacted_path = compacted_path or os.path.join(os.path.dirname(self.directory), "log.yaml")
+        self.manifest_path = os.path.join(self.directory, self.manifest_name)
+        # the segment entries are appended to, a reopened log starts a new one
+        self.current = None
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as in_file:
+                self.manifest = json.load(in_file)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            self.manifest = {"next_segment": 1, "segments": [], "compacted": None}
+            if os.path.exists(self.compacted_path):
+                # a single file log of an older run is continued in segments
+                self.manifest["compacted"] = {
+                    "file": os.path.basename(self.compacted_path),
+                    "entries": len(self.load_compacted()),
+                }
+                self.save()
+            else:
+                self.add_entry("Log Creation")
+
+    def add_entry(self, entry):
+        """Appends an entry to the current segment with datetime.now as a timestamp"""
+        new_entry = {"timestamp": datetime.datetime.now()}
+        if isinstance(entry, dict):
+            new_entry.update(entry)
+        else:
+            new_entry["event"] = entry
+        text = yaml.dump([new_entry], default_flow_style=False)
+        config = segment_config(new_entry.get("config_number"))
+        # entries may be added from a background thread while the next config runs
+        with self.lock, span("log save", "log", entries=1):
+            if self._full(len(text.encode("utf-8")), config):
+                self._start_segment()
+            segment = self.current
+            with open(os.path.join(self.directory, segment["file"]), "a") as out_file:
+                out_file.write(text)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            segment["entries"] += 1
+            segment["bytes"] += len(text.encode("utf-8"))
+            segment["first"] = segment["first"] or new_entry["timestamp"].isoformat()
+            segment["last"] = new_entry["timestamp"].isoformat()
+            if config is not None and config not in segment["configs"]:
+                segment["configs"].append(config)
+            self.save()
+
+    def _full(self, size, config):
+        segment = self.current
+        if segment is None:
+            return True
+        if segment["entries"] >= self.max_entries or segment["bytes"] + size > self.max_bytes:
+            return segment["entries"] > 0
+        return (
+            self.max_configs is not None
+            and config is not None
+            and config not in segment["configs"]
+            and len(segment["configs"]) >= self.max_configs
+        )
+
+    def _start_segment(self):
+        name = "segment_{:05d}.yaml".format(self.manifest["next_segment"])
+        self.manifest["next_segment"] += 1
+        self.current = {"file": name, "entries": 0, "bytes": 0, "first": None, "last": None, "configs": []}
+        self.manifest["segments"].append(self.current)
+
+    def save(self, file_path=None, **options):
+        """Replaces the manifest atomically, the entries are already on disk"""
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as out_file:
+            json.dump(self.manifest, out_file, indent=1)
+        os.replace(temp_path, self.manifest_path)
+        return self.manifest_path
+
+    def load_segment(self, segment):
+        """Entries of a segment, without an entry cut short by a crash
+
+        The manifest is saved after every append, so only the entries it
+        counts are complete.  A cut entry often still parses, e.g. with its
+        timestamp cut to a string, and is dropped like one that does not.
+        """
+        with open(os.path.join(self.directory, segment["file"]), "r") as in_file:
+            text = in_file.read()
+        try:
+            entries = yaml.load(text, Loader=yaml.FullLoader) or []
+        except yaml.YAMLError:
+            # every entry starts a line with "- ", drop the last one
+            entries = yaml.load(text[: text.rfind("\n- ") + 1], Loader=yaml.FullLoader) or []
+        return entries[: segment["entries"]]
+
+    def segments(self, start=None, end=None, config=None):
+        """Segments that hold entries in a time range or of a config"""
+        selected = []
+        for segment in list(self.manifest["segments"]):
+            if not segment["entries"]:
+                continue
+            if start is not None and datetime.datetime.fromisoformat(segment["last"]) < start:
+                continue
+            if end is not None and datetime.datetime.fromisoformat(segment["first"]) > end:
+                continue
+            if config is not None and segment_config(config) not in segment["configs"]:
+                continue
+            selected.append(segment)
+        return selected
+
+    def entries(self, start=None, end=None, config=None, event=None):
+        """Generates the entries that match a query, loading only the segments it touches
+
+        Args:
+            start (datetime): earliest timestamp
+            end (datetime): latest timestamp
+            config: config number of the entries
+            event (String): event of the entries
+
+        Returns:
+            generator: matching entries of the compacted log and the segments in order
+        """
+        sources = [lambda: self.load_compacted()] if self.manifest["compacted"] else []
+        sources += [
+            lambda segment=segment: self.load_segment(segment) for segment in self.segments(start, end, config)
+        ]
+        for source in sources:
+            for entry in source():
+                if start is not None and entry["timestamp"] < start:
+                    continue
+                if end is not None and entry["timestamp"] > end:
+                    continue
+                if config is not None and str(entry.get("config_number")) != str(config):
+                    continue
+                if event is not None and entry.get("event") != event:
+                    continue
+                yield entry
+
+    def load_compacted(self):
+        if not os.path.exists(self.compacted_path):
+            return []
+        return YamlSerializer().load(self.compacted_path) or []
+
+    def compact(self):
+        """Merges the compacted log and every segment into one time sorted yaml file
+
+        The merged file is written atomically before the segments are removed.
+
+        Returns:
+            String: path of the compacted file
+        """
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry["timestamp"])
+            temp_path = self.compacted_path + ".tmp"
+            YamlSerializer().save(temp_path, entries)
+            os.replace(temp_path, self.compacted_path)
+            segments = self.manifest["segments"]
+            self.manifest["segments"] = []
+            self.manifest["compacted"] = {
+                "file": os.path.basename(self.compacted_path),
+                "entries": len(entries),
+            }
+            self.current = None
+            self.save()
+            for segment in segments:
+                os.remove(os.path.join(self.directory, segment["file"]))
+        return self.compacted_path
+
+    def __len__(self):
+        compacted = self.manifest["compacted"]["entries"] if self.manifest["compacted"] else 0
+        return compacted + sum(segment["entries"] for segment in self.manifest["segments"])
+
+    def __iter__(self):
+        return self.entries()
+
+    def __str__(self):
+        return yaml.dump(list(self.entries()), default_flow_style=False)
+
+
+def segment_config(config):
+    """Config an entry is indexed under, settle configs such as 3s under their config"""
+    if config is None:
+        return None
+    return re.sub(r"(?<=\d)s$", "", str(config))
+
+
+def load_log(meta_directory):
+    """Entries of the log of a run, compacted, segmented or a single log.yaml
+
+    Args:
+        meta_directory (String): meta directory of the run
+
+    Returns:
+        List: the log entries
+    """
+    segment_directory = os.path.join(meta_directory, "log")
+    if os.path.exists(os.path.join(segment_directory, SegmentedLog.manifest_name)):
+        return list(SegmentedLog(segment_directory))
+    return YamlSerializer().load(os.path.join(meta_directory, "log.yaml")) or []
+
+
 #-----------------------------------------------------------------------------
 # Module Scripts
 def test_Log():
@@ -418,9 +648,36 @@ def test_Log():
     print(new_log.log)
 
 
+def test_SegmentedLog_truncated():
+    """Script to test that a segment cut short by a crash still compacts"""
+    import tempfile
+    directory = os.path.join(tempfile.mkdtemp(), "log")
+    segmented_log = SegmentedLog(directory)
+    for config_number in range(3):
+        segmented_log.add_entry({"event": "after_test", "config_number": config_number})
+    segment_path = os.path.join(directory, segmented_log.manifest["segments"][-1]["file"])
+    with open(segment_path, "a") as out_file:
+        out_file.write(yaml.dump([{"timestamp": datetime.datetime.now(), "event": "torn"}]))
+    # the crash cut the entry inside its timestamp, before the manifest was saved
+    with open(segment_path, "r+") as in_file:
+        text = in_file.read()
+        in_file.seek(0)
+        in_file.write(text[: text.rfind("\n- ")] + "\n- timestamp: 2026-10-19 15:3")
+        in_file.truncate()
+    reopened_log = SegmentedLog(directory)
+    entries = list(reopened_log)
+    print(f"The reopened log has {len(entries)} entries")
+    assert len(entries) == 4
+    assert all(isinstance(entry["timestamp"], datetime.datetime) for entry in entries)
+    reopened_log.compact()
+    assert len(YamlSerializer().load(reopened_log.compacted_path)) == 4
+    print(f"Compacted into {reopened_log.compacted_path}")
+
+
 
 #-----------------------------------------------------------------------------
 # Module Runner
 if __name__ == '__main__':
     test_Log()
+    test_SegmentedLog_truncated()
  
\ No newline at end of file
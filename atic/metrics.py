@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Live metrics of a running campaign over HTTP.
+
+The runner keeps the state of the campaign in the module level Metrics
+object: the current config, progress, attenuator settings, interferer
+state, X410 temperatures, the MCS distribution of the running config, live
+from the samples the MCS loop prints, and the iperf throughput.  Only
+adaptive rows stream their iperf intervals, a fixed length -J run reports
+its json when it ends, so the live throughput is empty while such a row
+runs and its mean throughput is shown once its data is collected.  The hot path only
+assigns attributes, values are replaced instead of changed in place, so
+the state needs no locks and costs no I/O.  MetricsServer serves it from
+a background thread in the Prometheus text format and as json:
+
+    http://<host>:<port>/metrics         Prometheus text format
+    http://<host>:<port>/metrics.json    the same state as json
+
+and is started with the --metrics-port option of test_link_x410.py.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from iperf_parser import parse_iperf_file
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metrics:
+    """In-memory state of the running campaign"""
+
+    def __init__(self):
+        self.start()
+
+    def start(self, run_name=None, total=None):
+        """Reset the state for a new campaign
+
+        Args:
+            run_name (String): name of the run directory
+            total (int): configs to run, None if unknown
+        """
+        self.run_name = run_name
+        self.start_time = time.time()
+        self.total = total
+        self.completed = 0
+        self.config = None
+        self.config_start = None
+        self.attenuators = {}
+        self.interferer = {}
+        self.temperatures = {}
+        # latest interval of an adaptive window of the current config,
+        # time it was reported
+        self.throughput = None
+        self.throughput_time = None
+        # mean throughput of the last collected config
+        self.config_throughput = None
+        # MCS shares of the running config, or the last one until it reports
+        self.mcs = None
+        self.mcs_first = None
+        # device operation latencies of the last persisted config
+        self.device_io = None
+
+    def start_config(self, config, start_time):
+        """Mark a config as running, dropping the live throughput of the last one"""
+        self.config = config
+        self.config_start = start_time
+        self.throughput = None
+        self.throughput_time = None
+        self.mcs_first = None
+
+    def record_interval(self, interval):
+        """Take the throughput of an iperf interval as it is reported"""
+        self.throughput = interval["bits_per_second"]
+        self.throughput_time = time.time()
+
+    def record_mcs_sample(self, sample):
+        """Take the counters of an MCS loop sample as it is printed"""
+        if self.mcs_first is None:
+            self.mcs_first = sample
+        self.mcs = {"config": self.config, "fractions": mcs_fractions([self.mcs_first, sample])}
+
+    def record_config_data(self, config, iperf_file=None):
+        """Summarize the collected iperf file of a config
+
+        Args:
+            config: config number
+            iperf_file (Path): the *_iperf.json of the measurement window
+        """
+        if iperf_file is not None and os.path.exists(iperf_file):
+            intervals = parse_iperf_file(iperf_file)["intervals"]
+            if len(intervals["bits_per_second"]):
+                self.config_throughput = {
+                    "config": config,
+                    "bits_per_second": float(intervals["bits_per_second"].mean()),
+                }
+
+    def eta(self, now=None):
+        """Seconds until the remaining configs finish at the pace so far"""
+        if not self.total or not self.completed:
+            return None
+        elapsed = (now or time.time()) - self.start_time
+        return elapsed / self.completed * max(self.total - self.completed, 0)
+
+    def snapshot(self):
+        """The current state as a json serializable dictionary"""
+        now = time.time()
+        return {
+            "run_name": self.run_name,
+            "config": self.config,
+            "config_elapsed": now - self.config_start if self.config_start else None,
+            "configs_total": self.total,
+            "configs_completed": self.completed,
+            "elapsed": now - self.start_time,
+            "eta": self.eta(now),
+            "throughput": self.throughput,
+            "throughput_age": now - self.throughput_time if self.throughput_time else None,
+            "config_throughput": self.config_throughput,
+            "mcs": self.mcs,
+            "device_io": self.device_io,
+            "attenuators": self.attenuators,
+            "interferer": self.interferer,
+            "temperatures": self.temperatures,
+        }
+
+    def prometheus(self):
+        """The current state in the Prometheus text exposition format"""
+        state = self.snapshot()
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append(f"# HELP atic_{name} {help_text}")
+            lines.append(f"# TYPE atic_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"atic_{name}{_labels(labels)} {_value(value)}")
+
+        gauge("run_info", "Run being measured", [({"run": state["run_name"] or ""}, 1)])
+        gauge("configs_total", "Configs of the campaign", [({}, state["configs_total"])])
+        gauge("configs_completed", "Configs completed in this session", [({}, state["configs_completed"])])
+        gauge("current_config_info", "Config being measured", [({"config": state["config"]}, 1)])
+        gauge("config_elapsed_seconds", "Seconds since the current config started",
+              [({}, state["config_elapsed"])])
+        gauge("campaign_elapsed_seconds", "Seconds since the campaign started", [({}, state["elapsed"])])
+        gauge("campaign_eta_seconds", "Estimated seconds until the campaign ends", [({}, state["eta"])])
+        gauge("iperf_throughput_bits_per_second",
+              "Latest iperf interval of the current config, only reported by adaptive rows, "
+              "see config_throughput for fixed length rows",
+              [({}, state["throughput"])])
+        gauge("iperf_throughput_age_seconds", "Seconds since the latest iperf interval",
+              [({}, state["throughput_age"])])
+        if state["config_throughput"]:
+            gauge("config_throughput_bits_per_second", "Mean iperf throughput of the last collected config",
+                  [({"config": state["config_throughput"]["config"]},
+                    state["config_throughput"]["bits_per_second"])])
+        if state["mcs"]:
+            gauge("mcs_fraction", "Share of the frames sent at each MCS so far in the running config, or the last one",
+                  [({"config": state["mcs"]["config"], "mcs": index}, fraction)
+                   for index, fraction in state["mcs"]["fractions"].items()])
+        if state["device_io"]:
+            config = state["device_io"]["config"]
+            operations = state["device_io"]["operations"].items()
+            gauge("device_io_p99_seconds", "99th percentile seconds of a device operation in the last persisted config",
+                  [({"config": config, "operation": name}, record["p99"]) for name, record in operations])
+            gauge("device_io_max_seconds", "Longest device operation in the last persisted config",
+                  [({"config": config, "operation": name}, record["max"]) for name, record in operations])
+            gauge("device_io_retries", "Retries of a device operation in the last persisted config",
+                  [({"config": config, "operation": name}, record["retries"]) for name, record in operations])
+        gauge("attenuation_db", "Attenuator settings",
+              [({"attenuator": name}, value) for name, value in state["attenuators"].items()])
+        interferer = state["interferer"]
+        if interferer:
+            gauge("interferer_rf_output", "X410 RF output on", [({}, interferer.get("rf_output"))])
+            gauge("interferer_power_dbm", "X410 output power", [({}, interferer.get("power"))])
+            gauge("interferer_info", "Waveform played by the X410",
+                  [({"wv_file": interferer.get("wv_file")}, 1)])
+        gauge("x410_temperature_celsius", "X410 temperatures",
+              [({"sensor": sensor}, value) for sensor, value in state["temperatures"].items()])
+        return "\n".join(lines) + "\n"
+
+
+def mcs_fractions(samples):
+    """Share of the frames sent at every MCS over a config
+
+    The counters of the radio are cumulative, so the frames of the config
+    are the difference between the last and the first sample.
+
+    Args:
+        samples (List): rows of a *_mcs.json file, or samples printed by the MCS loop
+
+    Returns:
+        fractions (dict): MCS index -> share of the frames
+    """
+    if not samples:
+        return {}
+    counts = {}
+    for name in samples[0]:
+        if name.startswith("mcs"):
+            try:
+                counts[name[3:]] = max(float(samples[-1][name]) - float(samples[0][name]), 0)
+            except (TypeError, ValueError):
+                continue
+    total = sum(counts.values())
+    return {index: count / total if total else 0.0 for index, count in counts.items()}
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        str("" if value is None else value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in labels.values()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return "NaN"
+    return "NaN" if math.isnan(value) else repr(value)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = self.server.metrics.prometheus(), PROMETHEUS_CONTENT_TYPE
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(self.server.metrics.snapshot(), default=str), "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes would flood the console of the runner
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves a Metrics object from a daemon thread
+
+    Args:
+        metrics (Metrics): the state to serve
+        port (int): TCP port, 0 picks a free one
+        host (String): interface to listen on
+    """
+
+    daemon_threads = True
+
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        super().__init__((host, port), MetricsHandler)
+        self.metrics = metrics
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+metrics = Metrics()
@@ -9,9 +9,53 @@ Relies heavily on the paramiko library for SSHClient.
 @author: mkf3
 """
 
+import csv
+import functools
+import hashlib
+import json
+import socket
+import threading
+import zlib
 import paramiko
 from paramiko import SSHClient
 import time
+from pathlib import Path
+from adaptive import parse_iperf_interval
+from io_policy import RETRYABLE, IOPolicy
+from latency import RttRecorder, iperf_traffic_options
+from tracing import span, traced
+
+# bytes read from the ssh channel at a time while fetching files
+TRANSFER_CHUNK = 1 << 16
+IPERF_PORT = 5201
+# seconds a started iperf server has to start listening
+IPERF_START_TIMEOUT = 5
+# errors after which a remote operation is tried again
+SSH_ERRORS = RETRYABLE + (paramiko.SSHException,)
+
+
+def retried(operation, role="parent"):
+    """Decorator running a P2PLink method under the I/O policy of the link,
+    the whole method is tried again after a connection error or a timeout,
+    so it must be safe to repeat
+
+    Args:
+        operation (String): name the latency of the method is recorded under
+        role (String): "parent" or "child", the radio whose session is
+            reconnected before a retry
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return self.policy.call(
+                operation,
+                lambda: method(self, *args, **kwargs),
+                reconnect=lambda attempt: self.reconnect(role, attempt),
+                errors=SSH_ERRORS,
+            )
+        return wrapper
+    return decorator
+
 
 class P2PLink:
     """Point to Point link pair class with one parent and one child
@@ -20,22 +64,134 @@ class P2PLink:
     
     Args:
         options["p2p_parent_address]
+        options["policy"] (IOPolicy): deadlines and retries of the remote
+            operations, the defaults of io_policy.py if not given
     """
+    # called with every interval run_iperf_adaptive streams, e.g. live metrics
+    on_interval = None
+    # called with every sample run_mcsloop streams, the counters by column name
+    on_mcs_sample = None
+
     def __init__(self, **options):
         self.p2p_parent_address = options["p2p_parent_address"]
         self.p2p_child_address = options["p2p_child_address"]
+        self.policy = options.get("policy") or IOPolicy()
+        # role of every session, including those replaced by a reconnect
+        self.roles = {}
+        self._connect_lock = threading.Lock()
 
-        self.ssh_p2p_parent = SSHClient()
-        self.ssh_p2p_parent.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh_p2p_parent.connect(
-            self.p2p_parent_address, username="admin", password="password"
-        )
-        self.sftp_p2p_parent = self.ssh_p2p_parent.open_sftp()
+        self.ssh_p2p_parent = self.connect(self.p2p_parent_address)
+        self.roles[self.ssh_p2p_parent] = "parent"
+        self.sftp_p2p_parent = self.open_sftp(self.ssh_p2p_parent)
+
+        self.ssh_p2p_child = self.connect(self.p2p_child_address)
+        self.roles[self.ssh_p2p_child] = "child"
+
+    def connect(self, address):
+        """Open an ssh session to one radio within the connect deadline,
+        sending keepalive heartbeats while it is idle
+
+        Args:
+            address (String): ip address of the radio
+
+        Returns:
+            ssh_client (SSHClient): the connected client
+        """
+        deadline = self.policy.deadline("connect")
+        ssh_client = SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with span("ssh connect", "ssh", address=address):
+            ssh_client.connect(
+                address,
+                username="admin",
+                password="password",
+                timeout=deadline,
+                banner_timeout=deadline,
+                auth_timeout=deadline,
+            )
+        ssh_client.get_transport().set_keepalive(int(self.policy.heartbeat))
+        return ssh_client
+
+    def open_sftp(self, ssh_client):
+        """Open an sftp client whose reads time out like commands"""
+        sftp_client = ssh_client.open_sftp()
+        sftp_client.get_channel().settimeout(self.policy.deadline("command"))
+        return sftp_client
+
+    def session(self, role):
+        """The current ssh client of the "parent" or "child" radio"""
+        return self.ssh_p2p_parent if role == "parent" else self.ssh_p2p_child
+
+    def reconnect(self, role, attempt=1, failed=None):
+        """Open the session of a radio again before a retry
+
+        A session that is still up is kept for the first retry, which only
+        needs a new channel after a hung command, and replaced from the
+        second retry on.
+
+        Args:
+            role (String): "parent" or "child"
+            attempt (Int): the retry about to be made
+            failed (SSHClient): the client that failed, nothing is done if
+                another thread already replaced it
+        """
+        with self._connect_lock:
+            ssh_client = self.session(role)
+            if failed is not None and failed is not ssh_client:
+                return
+            transport = ssh_client.get_transport()
+            if attempt < 2 and transport is not None and transport.is_active():
+                return
+            address = self.p2p_parent_address if role == "parent" else self.p2p_child_address
+            print(f"reconnecting to the {role} radio at {address}")
+            ssh_client.close()
+            ssh_client = self.connect(address)
+            self.roles[ssh_client] = role
+            if role == "parent":
+                self.ssh_p2p_parent = ssh_client
+                self.sftp_p2p_parent = self.open_sftp(ssh_client)
+            else:
+                self.ssh_p2p_child = ssh_client
 
-        self.ssh_p2p_child = SSHClient()
-        self.ssh_p2p_child.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh_p2p_child.connect(
-            self.p2p_child_address, username="admin", password="password"
+    def close(self):
+        """Close the sftp and ssh sessions of both radios"""
+        self.sftp_p2p_parent.close()
+        self.ssh_p2p_parent.close()
+        self.ssh_p2p_child.close()
+
+    def run_command(self, ssh_client, command, timeout=None, retries=None):
+        """Run exec_command on one of the ssh clients, traced as a span
+
+        Starting the command is tried again on a new channel, or a new
+        session if the radio dropped it, following the I/O policy.  A
+        failed start may still have run the command, so appends and
+        measurements pass retries=0.
+
+        Args:
+            ssh_client (SSHClient): the parent or child ssh client
+            command (String): the command to run on the remote device
+            timeout (float): seconds a read of its output may wait, the
+                command deadline by default
+            retries (int): overrides the retries of the policy
+
+        Returns:
+            stdin, stdout, stderr of the remote command
+        """
+        role = self.roles.get(ssh_client, "parent")
+        timeout = timeout or self.policy.deadline("command")
+        clients = []
+
+        def execute():
+            clients.append(self.session(role))
+            with span("ssh exec_command", "ssh", command=command):
+                return clients[-1].exec_command(command, timeout=timeout)
+
+        return self.policy.call(
+            "ssh exec_command",
+            execute,
+            reconnect=lambda attempt: self.reconnect(role, attempt, clients[-1]),
+            errors=SSH_ERRORS,
+            retries=retries,
         )
 
     def check_stderr(self, stderr):
@@ -50,43 +206,83 @@ class P2PLink:
             print("stderr read", msg)
             raise Exception("StdErr reported from the remote device")
 
+    @traced("p2p start_child_iperf_server", "p2p")
     def start_child_iperf_server(self, interval=1):
         """Function that will start an iperf server on the remote device
         
         Args: 
             interval (Int): the interval that the iperf server should report
         """
-        #start server
-        stdin, stdout, stderr = self.ssh_p2p_child.exec_command(
-            f"/data/iperf3-arm32v7 -s -i {interval} --rcv-timeout 5000"
+        #start server as a daemon so it outlives the ssh channel
+        stdin, stdout, stderr = self.run_command(
+            self.ssh_p2p_child,
+            f"/data/iperf3-arm32v7 -s -D -i {interval} --rcv-timeout 5000"
             )
         self.check_stderr(stderr)
-        #check if server has a pid
-        stdin, stdout, stderr = self.ssh_p2p_child.exec_command(
-            "pidof iperf3-arm32v7"
+        #wait until the server is listening
+        deadline = time.time() + IPERF_START_TIMEOUT
+        while not self.iperf_server_ready():
+            if time.time() > deadline:
+                raise Exception("Remote iperf server not started.")
+            time.sleep(0.2)
+
+    @traced("p2p iperf_server_ready", "p2p")
+    @retried("iperf server probe", "child")
+    def iperf_server_ready(self):
+        """Probe the child in one round trip for a running iperf server
+        that is listening on its port
+
+        Returns:
+            ready (bool): True if the server can accept a client
+        """
+        stdin, stdout, stderr = self.run_command(
+            self.ssh_p2p_child,
+            "pidof iperf3-arm32v7 && netstat -ltn"
         )
-        self.check_stderr(stderr)
-        iperf_pid = stdout.read().decode().strip()
-        #if no iperf_pid then server isn't started
-        if not iperf_pid:
-            raise Exception("Remote iperf server not started.")
+        lines = stdout.read().decode().splitlines()
+        #the first line is the pid, the rest is netstat output
+        if not lines or not lines[0].strip():
+            return False
+        return any(f":{IPERF_PORT} " in line and "LISTEN" in line for line in lines[1:])
+
+    @traced("p2p ensure_iperf_server", "p2p")
+    def ensure_iperf_server(self, interval=1):
+        """Keep one iperf server running on the child across configs,
+        restarting it only when the readiness probe fails
 
+        Args:
+            interval (Int): the interval that a restarted server should report
+
+        Returns:
+            log_dict (dict): Dictionary compatible with AWS log class
+        """
+        if self.iperf_server_ready():
+            return {"event": "iperf server ready", "restarted": False}
+        killed = self.find_kill_iperf_server()
+        self.start_child_iperf_server(interval=interval)
+        return {"event": "iperf server restarted", "restarted": True, "stale_pid": killed["pid"]}
+
+    @traced("p2p find_kill_iperf_server", "p2p")
+    @retried("iperf server kill", "child")
     def find_kill_iperf_server(self):
         """Function to find and kill any stale iperf servers"""
         #get pid of iperf
-        stdin, stdout, stderr = self.ssh_p2p_child.exec_command(
+        stdin, stdout, stderr = self.run_command(
+            self.ssh_p2p_child,
             "pidof iperf3-arm32v7"
         )
         #get pid
         iperf_pid = stdout.read().decode().strip()
         #if there's no pid then no need to kill it
         if iperf_pid:
-            stdin, stdout, stderr = self.ssh_p2p_child.exec_command(f"kill {iperf_pid}")
+            stdin, stdout, stderr = self.run_command(self.ssh_p2p_child, f"kill {iperf_pid}")
             self.check_stderr(stderr)
             return {"event": "kill iperf3-arm32v7", "pid": iperf_pid}
         else:
             return {"event": "kill iperf3-arm32v7", "pid": None}
 
+    @traced("p2p copy_p2p_config", "p2p")
+    @retried("copy p2p config")
     def copy_p2p_config(self, run_directory, meta_directory):
         """copies the json link config file from the p2p into the run directory remote & local
         
@@ -98,22 +294,86 @@ class P2PLink:
             log_dict (dict):  Dictionary compatible with AWS log class
         """
         #copy the configuration to the run directory
-        stdin, stdout, stderr = self.ssh_p2p_parent.exec_command(
+        stdin, stdout, stderr = self.run_command(
+            self.ssh_p2p_parent,
             f"cp /tmp/config.json {run_directory}/p2p_config.json"
         )
         self.check_stderr(stderr)
         #move the file over
         remote_file = f"{run_directory}/p2p_config.json"
-        local_file = str(meta_directory) + r"\p2p_link_config.json"
-        self.sftp_p2p_parent.get(remote_file, local_file)
+        local_file = str(Path(meta_directory, "p2p_link_config.json"))
+        self.fetch_file(remote_file, local_file)
         print(f"copied p2p config to {run_directory}")
         log_dict =  {"event": "copy_p2p_config", "path": f"{run_directory}"}
         return log_dict
 
+    @traced("p2p fetch_file", "p2p")
+    @retried("fetch file")
+    def fetch_file(self, remote_file, local_file, compress=True):
+        """Copy a file off the parent radio and verify it against the md5
+        digest computed on the radio
+
+        With compress the file is gzipped by the radio straight into the ssh
+        channel, so nothing extra is written to its flash, and decompressed
+        on the host while the digest is computed.  A transfer that takes
+        longer than the transfer deadline is abandoned and started again.
+
+        Args:
+            remote_file (String): path of the file on the parent radio
+            local_file (String): path to store the file on the local machine
+            compress (bool): gzip the file on the radio, sftp it as is otherwise
+
+        Returns:
+            details (dict): md5 digest, size of the file and bytes transferred
+
+        Raises:
+            IOError: if the transfer is incomplete or the digests differ
+        """
+        deadline = time.monotonic() + self.policy.deadline("transfer")
+        stdin, stdout, stderr = self.run_command(self.ssh_p2p_parent, f"md5sum {remote_file}")
+        self.check_stderr(stderr)
+        remote_digest = stdout.read().decode().split()[0]
+        digest = hashlib.md5()
+        size = 0
+        transferred = 0
+        if compress:
+            stdin, stdout, stderr = self.run_command(self.ssh_p2p_parent, f"gzip -c {remote_file}")
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            with open(local_file, "wb") as out_file:
+                while True:
+                    data = stdout.read(TRANSFER_CHUNK)
+                    if not data:
+                        break
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"transfer of {remote_file} took longer than its deadline")
+                    transferred += len(data)
+                    chunk = decompressor.decompress(data)
+                    digest.update(chunk)
+                    out_file.write(chunk)
+                    size += len(chunk)
+            self.check_stderr(stderr)
+            if not decompressor.eof or stdout.channel.recv_exit_status() != 0:
+                raise IOError(f"Incomplete transfer of {remote_file}")
+        else:
+            with span("sftp get", "sftp", remote_file=remote_file):
+                self.sftp_p2p_parent.get(remote_file, local_file)
+            with open(local_file, "rb") as in_file:
+                for chunk in iter(lambda: in_file.read(TRANSFER_CHUNK), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+            transferred = size
+        if digest.hexdigest() != remote_digest:
+            raise IOError(f"Checksum mismatch for {remote_file}")
+        return {"md5": remote_digest, "size": size, "transferred": transferred}
+
+    @traced("p2p run_mcsloop", "p2p")
     def run_mcsloop(self, test_input, run_directory):
         """
         Function that will run the mcs_loop.sh terminal command on the remote machine
 
+        The loop prints every sample it writes, each is passed to
+        on_mcs_sample as it arrives.
+
         Args:
             test_input (Dict): dictionary that contains the input to the remote script
             run_directory (String): the remote directory where data is temporarily stored.
@@ -124,13 +384,38 @@ class P2PLink:
         
         mcs_cmd = f"/data/mcs_loop.sh {test_input['test_time']} {run_directory} {test_input['config']} {test_input['interval']}" 
         print(mcs_cmd)
-        stdin, stdout, stderr = self.ssh_p2p_parent.exec_command(mcs_cmd)
-        self.check_stderr(stderr)
-        return stdout.read().decode()
+        # a read waits at most the whole window
+        stdin, stdout, stderr = self.run_command(
+            self.ssh_p2p_parent,
+            mcs_cmd,
+            timeout=float(test_input['test_time']) + self.policy.deadline("command"),
+            retries=0,
+        )
+
+        def finish():
+            lines = []
+            fields = None
+            for line in stdout:
+                lines.append(line)
+                values = next(csv.reader([line]), None)
+                if not values:
+                    continue
+                if values[0] == "date":
+                    # the header the loop prints before its first sample
+                    fields = values
+                elif fields is not None and len(values) == len(fields) and self.on_mcs_sample is not None:
+                    self.on_mcs_sample(dict(zip(fields, values)))
+            self.check_stderr(stderr)
+            return "".join(lines)
 
+        # the loop is not run twice, a hung loop ends the config
+        return self.policy.call("mcs loop", finish, errors=SSH_ERRORS, retries=0)
+
+    @traced("p2p run_iperf", "p2p")
     def run_iperf(self, test_input, run_directory):
         """
-        Function that will run an iperf terminal command on the remote machine
+        Function that will run an iperf terminal command on the remote machine,
+        TCP or UDP as the mode column of the runner row selects
 
         Args:
             test_input (Dict): dictionary that contains the input to the remote script
@@ -141,39 +426,152 @@ class P2PLink:
         """
         iperf_remote_file = run_directory + fr'/{test_input["config"]}_iperf.json'
         remaining_time = test_input['test_time']
-        for attempt in range(3):
-            try:
-                self.ssh_p2p_parent.exec_command(f"echo \"[\" >> {iperf_remote_file}")
-            except paramiko.ssh_exception.SSHException:
-                time.sleep(2)
-                continue
-            else:
-                break
+        # a TCP stream, or a UDP stream at the rate of the runner row, see latency.py
+        traffic = iperf_traffic_options(test_input)
+        output = ""
+        # the appends and the client are not started twice, that would corrupt the file
+        self.run_command(self.ssh_p2p_parent, f"echo \"[\" >> {iperf_remote_file}", retries=0)
         start_time = time.time()
         end_time = start_time + remaining_time
         while time.time() <= start_time + test_input['test_time']:
             print('entering')
-            iperf_command = f"/data/iperf3-arm32v7 -c {self.p2p_child_address} -i {test_input['interval']} -t {remaining_time} -l {test_input['packet_size']} --snd-timeout 3000 -J >> {iperf_remote_file}"
+            iperf_command = f"/data/iperf3-arm32v7 -c {self.p2p_child_address} -i {test_input['interval']} -t {remaining_time} -l {test_input['packet_size']} {traffic} -J >> {iperf_remote_file}"
             print(iperf_command)
-            stdin, stdout, stderr = self.ssh_p2p_parent.exec_command(iperf_command)
-            self.check_stderr(stderr)
-            output=stdout.read().decode()
+            stdin, stdout, stderr = self.run_command(
+                self.ssh_p2p_parent,
+                iperf_command,
+                timeout=float(remaining_time) + self.policy.deadline("command"),
+                retries=0,
+            )
+            try:
+                self.check_stderr(stderr)
+                output=stdout.read().decode()
+            except socket.timeout:
+                # the client hung past the end of the window, stop it
+                print("iperf client hung, stopping it")
+                self.run_command(self.ssh_p2p_parent, "kill -INT `pidof iperf3-arm32v7`")
+                stdout.channel.close()
+                break
             if time.time() <= start_time + test_input['test_time'] and "unable to connect to server" in output:
                 # change run time, restart, repeat until time is up
                 print("restarting iperf")
-                self.ssh_p2p_parent.exec_command(f"echo \",\" | tee -a {iperf_remote_file}")
+                self.run_command(self.ssh_p2p_parent, f"echo \",\" | tee -a {iperf_remote_file}", retries=0)
                 remaining_time = int(end_time - time.time())
                 if remaining_time <= 0:
                     break
-        for attempt in range(3):
-            try:
-                self.ssh_p2p_parent.exec_command(f"echo \"]\" >> {iperf_remote_file}")
-            except paramiko.ssh_exception.SSHException:
-                time.sleep(2)
-                if attempt != 2:
-                    continue
-                else:
-                    raise
             else:
+                # only a failed connection is restarted
+                break
+        self.run_command(self.ssh_p2p_parent, f"echo \"]\" >> {iperf_remote_file}", retries=0)
+        return output
+
+    @traced("p2p run_ping", "p2p")
+    def run_ping(self, test_input, interval, size=56):
+        """
+        Function that will probe the round trip time from the parent to the
+        child for the measurement window, parsing the replies as they arrive
+
+        Args:
+            test_input (Dict): dictionary that contains the input to the remote script
+            interval (float): seconds between probes
+            size (Int): payload bytes of every probe
+
+        Returns:
+            recorder (RttRecorder): the replies and their summary
+        """
+        recorder = RttRecorder()
+        ping_command = f"ping -i {interval:g} -s {size} -w {int(float(test_input['test_time']))} {self.p2p_child_address}"
+        print(ping_command)
+        stdin, stdout, stderr = self.run_command(
+            self.ssh_p2p_parent,
+            ping_command,
+            timeout=float(test_input['test_time']) + self.policy.deadline("command"),
+            retries=0,
+        )
+        try:
+            for line in stdout:
+                recorder.feed(line)
+        except socket.timeout:
+            # the replies so far are kept
+            print("ping output stalled, stopping it")
+            stdout.channel.close()
+        summary = recorder.summary()
+        print(f"ping {test_input['config']}: {summary['received']} of {summary['transmitted']} replies")
+        return recorder
+
+    @traced("p2p run_iperf_adaptive", "p2p")
+    def run_iperf_adaptive(self, test_input, run_directory, criterion):
+        """
+        Function that will stream an iperf run from the remote machine and end it
+        as soon as the stop criterion is met
+
+        The intervals are written to the usual remote iperf file as an iperf3
+        style json document, so the data is collected like a fixed length run.
+
+        Args:
+            test_input (Dict): dictionary that contains the input to the remote script
+            run_directory (String): the remote directory where data is temporarily stored.
+            criterion: object with update(interval) returning True to stop, see adaptive.py
+
+        Returns:
+            result (Dict): the reason the window ended and its elapsed time
+        """
+        iperf_remote_file = run_directory + fr'/{test_input["config"]}_iperf.json'
+        max_time = criterion.max_time
+        intervals = []
+        start_time = time.time()
+        while criterion.reason is None and time.time() < start_time + max_time:
+            offset = time.time() - start_time
+            remaining_time = max(int(max_time - offset), 1)
+            iperf_command = f"/data/iperf3-arm32v7 -c {self.p2p_child_address} -i {test_input['interval']} -t {remaining_time} -l {test_input['packet_size']} --snd-timeout 3000 -f k --forceflush"
+            print(iperf_command)
+            stdin, stdout, stderr = self.run_command(
+                self.ssh_p2p_parent,
+                iperf_command,
+                timeout=float(test_input['interval']) + self.policy.deadline("command"),
+                retries=0,
+            )
+            try:
+                for line in stdout:
+                    interval = parse_iperf_interval(line)
+                    if interval is None:
+                        continue
+                    # restarted clients count from zero again
+                    interval["start"] += offset
+                    interval["end"] += offset
+                    intervals.append({"sum": interval})
+                    if self.on_interval is not None:
+                        self.on_interval(interval)
+                    if criterion.update(interval):
+                        break
+            except socket.timeout:
+                # no interval within the deadline, the client is restarted
+                print("iperf client hung, restarting iperf")
+                self.run_command(self.ssh_p2p_parent, "kill -INT `pidof iperf3-arm32v7`")
+                stdout.channel.close()
+                continue
+            if criterion.reason is not None:
+                # stop the client early, only the iperf client runs on the parent
+                self.run_command(self.ssh_p2p_parent, "kill -INT `pidof iperf3-arm32v7`")
+                stdout.channel.close()
+                break
+            error = stderr.read().decode()
+            if "unable to connect to server" not in error:
                 break
-        return stdout.read().decode()
+            print("restarting iperf")
+            time.sleep(1)
+        result = {
+            "reason": criterion.reason or "completed",
+            "elapsed": round(time.time() - start_time, 3),
+        }
+        document = {
+            "start": {"timestamp": {"timesecs": int(start_time), "clock": "host"}},
+            "intervals": intervals,
+            "end": {"adaptive": result},
+        }
+        stdin, stdout, stderr = self.run_command(self.ssh_p2p_parent, f"cat >> {iperf_remote_file}", retries=0)
+        stdin.write("[\n" + json.dumps(document) + "\n]\n")
+        stdin.channel.shutdown_write()
+        self.check_stderr(stderr)
+        print(f"adaptive iperf {test_input['config']} ended: {result['reason']}")
+        return result
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Planner that reorders the rows of a runner to minimize the time spent on
+transitions between configs.
+
+Reloading the playback waveform on the X410 and large attenuator jumps
+are far more expensive than small attenuation steps.  The planner groups
+the rows by wv_file, starting with the waveform that is already playing,
+and orders the rows in each group as a short path through attenuation
+space, judged by the same transition cost that is reported.  A plan that
+is not cheaper than the file order is not used.  Rows keep their config
+numbers so outputs are unaffected.
+"""
+
+ATTENUATORS = ["p2p_parent_attn", "p2p_child_attn", "noise_diode_attn", "interferer_attn"]
+
+default_cost_model = {
+    # seconds to load a new waveform into the X410 replay buffer
+    "wv_switch_time": 15.0,
+    # seconds the link needs to reconverge per dB of attenuator change
+    "settle_time_per_db": 0.2,
+}
+
+
+def attenuation_jump(previous_row, row):
+    """Largest attenuator change in dB when moving from previous_row to row"""
+    if previous_row is None:
+        return 0.0
+    return max(
+        abs(float(row[f"start_{name}"]) - float(previous_row[f"test_{name}"]))
+        for name in ATTENUATORS
+    )
+
+
+def transition_cost(previous_row, row, cost_model=None, previous_wv=None):
+    """Predicted seconds spent moving from previous_row to row
+
+    Args:
+        previous_row (dict): the config that just ran, None for the first config
+        row (dict): the next config
+        cost_model (dict): see default_cost_model
+        previous_wv (String): waveform playing before row, if known
+
+    Returns:
+        cost (float): predicted transition time in seconds
+    """
+    if cost_model is None:
+        cost_model = default_cost_model
+    if previous_row is not None:
+        previous_wv = previous_row.get("wv_file", previous_wv)
+    cost = cost_model["settle_time_per_db"] * attenuation_jump(previous_row, row)
+    if "wv_file" in row and row["wv_file"] != previous_wv:
+        cost += cost_model["wv_switch_time"]
+    return cost
+
+
+def path_cost(test_runner, cost_model=None, initial_wv=None):
+    """Predicted total transition time for running the rows in order"""
+    total = 0.0
+    previous_row = None
+    for row in test_runner:
+        total += transition_cost(previous_row, row, cost_model, initial_wv)
+        previous_row = row
+    return total
+
+
+def order_attenuation_path(rows, start_row=None, max_two_opt=500, cost_model=None):
+    """Order rows as a short open path through attenuation space
+
+    The cost of a step is transition_cost, from the test attenuations of a
+    row to the start attenuations of the next, so it depends on the
+    direction.  A nearest neighbour path is built from start_row and then
+    improved with 2-opt moves when the group is small enough, reversed
+    segments being costed in their new direction.
+
+    Args:
+        rows (List): test condition dictionaries sharing one waveform
+        start_row (dict): the row the path continues from, if any
+        max_two_opt (Int): largest group that is refined with 2-opt
+        cost_model (dict): see default_cost_model
+
+    Returns:
+        path (List): the reordered rows
+    """
+    if not rows:
+        return []
+    # node 0 is start_row, the first step from None costs nothing
+    nodes = [start_row] + list(rows)
+    cost = [
+        [transition_cost(row_a, row_b, cost_model) if b else 0.0 for b, row_b in enumerate(nodes)]
+        for row_a in nodes
+    ]
+    remaining = list(range(1, len(nodes)))
+    path = [0]
+    while remaining:
+        current = min(remaining, key=lambda node: cost[path[-1]][node])
+        remaining.remove(current)
+        path.append(current)
+    if len(rows) <= max_two_opt:
+        improved = True
+        while improved:
+            improved = False
+            for i in range(1, len(path) - 1):
+                # steps inside path[i:j + 1] in their current and reversed direction
+                forward = reverse = 0.0
+                for j in range(i + 1, len(path)):
+                    forward += cost[path[j - 1]][path[j]]
+                    reverse += cost[path[j]][path[j - 1]]
+                    before = cost[path[i - 1]][path[i]] + forward
+                    after = cost[path[i - 1]][path[j]] + reverse
+                    if j + 1 < len(path):
+                        before += cost[path[j]][path[j + 1]]
+                        after += cost[path[i]][path[j + 1]]
+                    if after < before - 1e-9:
+                        path[i:j + 1] = path[i:j + 1][::-1]
+                        improved = True
+                        break
+    return [nodes[node] for node in path[1:]]
+
+
+def plan_configs(test_runner, cost_model=None, initial_wv=None):
+    """Reorder a runner to minimize the predicted transition time
+
+    Args:
+        test_runner (List): test condition dictionaries in file order
+        cost_model (dict): see default_cost_model
+        initial_wv (String): waveform playing on the X410 before the run
+
+    Returns:
+        planned_runner (List): the same dictionaries in planned order
+        plan (dict): config order and predicted costs for the log
+    """
+    groups = {}
+    for row in test_runner:
+        groups.setdefault(row.get("wv_file", initial_wv), []).append(row)
+    wv_order = list(groups)
+    if initial_wv in groups:
+        wv_order.remove(initial_wv)
+        wv_order.insert(0, initial_wv)
+    planned_runner = []
+    for wv_file in wv_order:
+        start_row = planned_runner[-1] if planned_runner else None
+        planned_runner.extend(order_attenuation_path(groups[wv_file], start_row, cost_model=cost_model))
+    original_cost = path_cost(test_runner, cost_model, initial_wv)
+    planned_cost = path_cost(planned_runner, cost_model, initial_wv)
+    reordered = planned_cost < original_cost - 1e-9
+    if not reordered:
+        # the file order is at least as fast
+        planned_runner = list(test_runner)
+        planned_cost = original_cost
+    plan = {
+        "reordered": reordered,
+        "config_order": [row["config"] for row in planned_runner],
+        "predicted_original_cost": round(original_cost, 3),
+        "predicted_planned_cost": round(planned_cost, 3),
+        "predicted_saving": round(original_cost - planned_cost, 3),
+    }
+    return planned_runner, plan
+
+
+def evaluate_plan(plan, planned_runner, campaign_records):
+    """Compare the planner prediction with the transitions that actually ran
+
+    The actual transition time is the prepare and settle stage wall time
+    minus the settle iperf windows requested in the runner.  The original
+    order was not run, so its actual cost is estimated by scaling the
+    predicted original cost by the measured/predicted ratio of the plan.
+
+    Args:
+        plan (dict): output of plan_configs
+        planned_runner (List): the rows that were run
+        campaign_records (List): CampaignScheduler.records
+
+    Returns:
+        evaluation (dict): actual transition time and estimated saving
+    """
+    actual = sum(
+        record["duration"]
+        for record in campaign_records
+        if record["stage"] in ("prepare", "settle")
+    )
+    actual -= sum(
+        float(row["start_settle_time"]) + float(row["test_settle_time"])
+        for row in planned_runner
+    )
+    actual = max(actual, 0.0)
+    if plan["predicted_planned_cost"] > 0:
+        scale = actual / plan["predicted_planned_cost"]
+    else:
+        scale = 1.0
+    return {
+        "actual_transition_time": round(actual, 3),
+        "estimated_actual_saving": round(scale * plan["predicted_saving"], 3),
+    }
+
+
+#-----------------------------------------------------------------------------
+# Module Scripts
+def test_plan_fallback():
+    """Script to test that a plan slower than the file order is not used"""
+    def row(config, start, test):
+        attenuations = {f"start_{name}": 0 for name in ATTENUATORS}
+        attenuations.update({f"test_{name}": 0 for name in ATTENUATORS})
+        attenuations.update({"start_p2p_parent_attn": start, "test_p2p_parent_attn": test})
+        return {"config": config, **attenuations}
+
+    # the greedy path takes the short step to config 3 and pays for it after
+    test_runner = [row(1, 15, 5), row(2, 15, 0), row(3, 0, 0)]
+    greedy_path = order_attenuation_path(test_runner)
+    print(f"greedy order {[row['config'] for row in greedy_path]} predicted "
+          f"{path_cost(greedy_path)} s, file order {path_cost(test_runner)} s")
+    assert path_cost(greedy_path) > path_cost(test_runner)
+    planned_runner, plan = plan_configs(test_runner)
+    print(plan)
+    assert not plan["reordered"]
+    assert planned_runner == test_runner
+    assert plan["predicted_saving"] == 0
+
+
+#-----------------------------------------------------------------------------
+# Module Runner
+if __name__ == '__main__':
+    test_plan_fallback()
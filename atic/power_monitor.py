@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Background sampling of the power supply during a campaign.
+
+The DP800 supply powers the noise diode and the amplifiers.  PowerSampler
+reads the voltage, current and power of every channel with :MEAS:ALL? at a
+fixed period from a daemon thread, so the runner never waits on the serial
+round trips.  Every sample is tagged with the config being run, from its
+prepare stage to the end of its measurement, and kept in memory until the
+persist stage of that config writes them in one file:
+
+    <local run directory>/<config>_power.json
+
+The instrument is shared with control calls through PowerSampler.query,
+which holds the same lock as the sampler.  Channels that exceed the current
+limits of power_supply_config, or whose voltage drifts from its setting,
+are reported by summarize and logged with the config.
+"""
+
+import json
+import os
+import threading
+import time
+
+from tracing import span, tracer
+
+# relative voltage deviation from the setting reported as drift
+VOLTAGE_TOLERANCE = 0.05
+
+
+class PowerSampler:
+    """Samples the channels of a power supply from a background thread
+
+    Args:
+        power_supply: opened instrument with a SCPI query method
+        channels (List): channel numbers to sample
+        period (float): seconds between samples
+    """
+
+    def __init__(self, power_supply, channels=(1, 2, 3), period=1.0):
+        self.power_supply = power_supply
+        self.channels = list(channels)
+        self.period = period
+        # config the samples are tagged with, set by the runner, None between configs
+        self.config = None
+        self.samples = []
+        self.errors = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def query(self, command):
+        """Send a query to the power supply between samples
+
+        Args:
+            command (String): SCPI query
+
+        Returns:
+            String: the response of the instrument
+        """
+        with self.lock, span("power supply query", "power_supply", command=command):
+            return self.power_supply.query(command)
+
+    def measure(self):
+        """Read every channel once
+
+        Returns:
+            sample (dict): host time, config and voltage, current and power per channel
+        """
+        config = self.config
+        # the queries of the sampler thread belong to the config being sampled
+        tracer.set_config(config)
+        sample = {}
+        for channel in self.channels:
+            voltage, current, power = (float(value) for value in self.query(f":MEAS:ALL? CH{channel}").split(","))
+            sample[f"ch{channel}_voltage"] = voltage
+            sample[f"ch{channel}_current"] = current
+            sample[f"ch{channel}_power"] = power
+        return {"time": time.time(), "config": config, **sample}
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            if self.config is not None:
+                try:
+                    sample = self.measure()
+                except Exception as error:
+                    # a failed read is counted, the next one is tried on time
+                    self.errors += 1
+                    self.last_error = repr(error)
+                else:
+                    # a sample read across a config change belongs to neither
+                    if sample["config"] == self.config:
+                        with self._buffer_lock:
+                            self.samples.append(sample)
+            self._stop.wait(max(self.period - (time.monotonic() - start), 0))
+
+    def start(self):
+        """Start sampling, samples are taken once a config is set"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="power sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sample in progress"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def take(self, config):
+        """Remove and return the samples of a config"""
+        with self._buffer_lock:
+            taken = [sample for sample in self.samples if sample["config"] == config]
+            self.samples = [sample for sample in self.samples if sample["config"] != config]
+        return taken
+
+    def write(self, config, file_path):
+        """Write the samples of a config to a json file
+
+        Args:
+            config: config number the samples are tagged with
+            file_path (Path): output *_power.json file
+
+        Returns:
+            samples (List): the samples written
+        """
+        samples = self.take(config)
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, "w") as out_file:
+            json.dump(samples, out_file)
+        os.replace(temp_path, file_path)
+        return samples
+
+
+def summarize(samples, power_supply_config):
+    """Ranges of every channel and the faults among the samples of a config
+
+    Args:
+        samples (List): samples of PowerSampler
+        power_supply_config (dict): voltage_setting<n> and current<n>_max per channel
+
+    Returns:
+        summary (dict): samples, per channel ranges and the list of faults
+    """
+    summary = {"samples": len(samples), "channels": {}, "faults": []}
+    if not samples:
+        return summary
+    channels = sorted({name.split("_")[0][2:] for name in samples[0] if name.startswith("ch")})
+    for channel in channels:
+        voltages = [sample[f"ch{channel}_voltage"] for sample in samples]
+        currents = [sample[f"ch{channel}_current"] for sample in samples]
+        summary["channels"][channel] = {
+            "voltage_min": min(voltages),
+            "voltage_max": max(voltages),
+            "current_mean": sum(currents) / len(currents),
+            "current_max": max(currents),
+        }
+        current_max = power_supply_config.get(f"current{channel}_max")
+        if current_max is not None and max(currents) > current_max:
+            summary["faults"].append(f"channel {channel} current {max(currents)} A above {current_max} A")
+        setting = power_supply_config.get(f"voltage_setting{channel}")
+        if setting and max(abs(voltage - setting) for voltage in voltages) > VOLTAGE_TOLERANCE * setting:
+            summary["faults"].append(
+                f"channel {channel} voltage {min(voltages)} to {max(voltages)} V, set to {setting} V"
+            )
+    return summary
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Campaign scheduler that splits every runner row into stages and overlaps
+the stages that use different parts of the testbed.
+
+Each config goes through the stages prepare, settle, measure, collect and
+persist.  Only measure is useful testbed time, so when overlap is enabled
+the collect and persist stages of config N run on a background worker
+while config N+1 is prepared and settled.  The background work of config
+N always finishes before the measurement of config N+1 starts.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import span, tracer
+
+STAGES = ["prepare", "settle", "measure", "collect", "persist"]
+
+
+class CampaignScheduler:
+    """Runs runner rows through the campaign stages and times each stage
+
+    Args:
+        stages (dict): stage name -> callable(test_config, context), where
+            context is a dictionary shared by the stages of one config
+        overlap (bool): run collect/persist of config N alongside
+            prepare/settle of config N+1
+    """
+
+    def __init__(self, stages, overlap=True):
+        missing = [name for name in STAGES if name not in stages]
+        if missing:
+            raise KeyError(f"Missing campaign stages {missing}")
+        self.stages = stages
+        self.overlap = overlap
+        self.records = []
+        self.wall_time = 0
+
+    def run_stage(self, name, test_config, context):
+        """Run a single stage and record its wall time"""
+        tracer.set_config(test_config["config"])
+        start = time.perf_counter()
+        with span(f"stage {name}", "stage"):
+            self.stages[name](test_config, context)
+        end = time.perf_counter()
+        self.records.append(
+            {
+                "config": test_config["config"],
+                "stage": name,
+                "start": start - self.start_time,
+                "duration": end - start,
+            }
+        )
+
+    def finish_config(self, test_config, context):
+        """Run the stages that only touch collected data"""
+        self.run_stage("collect", test_config, context)
+        self.run_stage("persist", test_config, context)
+
+    def run(self, test_runner):
+        """Run every config in the runner
+
+        Args:
+            test_runner (Iterable): test condition dictionaries
+
+        Returns:
+            report (dict): see CampaignScheduler.report
+        """
+        self.records = []
+        self.start_time = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=1) if self.overlap else None
+        pending = None
+        try:
+            for test_config in test_runner:
+                context = {}
+                self.run_stage("prepare", test_config, context)
+                self.run_stage("settle", test_config, context)
+                # the previous config must be off the radio before measuring
+                if pending is not None:
+                    pending.result()
+                    pending = None
+                self.run_stage("measure", test_config, context)
+                if executor is None:
+                    self.finish_config(test_config, context)
+                else:
+                    pending = executor.submit(self.finish_config, test_config, context)
+            if pending is not None:
+                pending.result()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self.wall_time = time.perf_counter() - self.start_time
+        return self.report()
+
+    def report(self):
+        """Summarize per-stage wall time and testbed utilization
+
+        Returns:
+            report (dict): campaign wall time, measurement utilization and
+                total/mean/max seconds for every stage
+        """
+        stages = {}
+        for name in STAGES:
+            durations = [r["duration"] for r in self.records if r["stage"] == name]
+            stages[name] = {
+                "count": len(durations),
+                "total": round(sum(durations), 3),
+                "mean": round(sum(durations) / len(durations), 3) if durations else 0,
+                "max": round(max(durations), 3) if durations else 0,
+            }
+        utilization = stages["measure"]["total"] / self.wall_time if self.wall_time else 0
+        return {
+            "wall_time": round(self.wall_time, 3),
+            "utilization": round(utilization, 4),
+            "stages": stages,
+        }
+
+    def print_report(self):
+        """Print the campaign report in a readable form"""
+        report = self.report()
+        print(f"campaign took {report['wall_time']} seconds, "
+              f"testbed utilization {100 * report['utilization']:.1f}%")
+        for name, stats in report["stages"].items():
+            print(f"  {name:8s} total {stats['total']:10.3f} s  "
+                  f"mean {stats['mean']:8.3f} s  max {stats['max']:8.3f} s")
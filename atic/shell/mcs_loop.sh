@@ -11,6 +11,7 @@ interval=$4
 #use awk to do some floating point math
 uinterval=$(awk 'BEGIN{print $interval*1000000}')
 postfix=_mcs
+stop=.stop
 under=_
 
 exit_message="Expecting an # of loops as 1st argument and output directory as second argument, and config number as 3rd. Exit" 
@@ -55,10 +56,16 @@ while [ $curr_time -le $end_time ]; do
 		printf '%s\n' "\"$date\",$clock,$mcs_value" | tee -a $mcs_dir/$config_number$postfix.csv
 	fi
 	i=$((i+1))
+	#Stop early if the host ended the measurement window
+	if [ -f $mcs_dir/$config_number$stop ]; then
+		break
+	fi
 	#Loop rate
 	usleep $uinterval
   curr_time=`awk 'NR==3{printf int($3/1000000)}' /proc/timer_list`
 done
+#remove the early stop file if there was one
+rm -f $mcs_dir/$config_number$stop
 
 #change the output to json using some awk
 lines=`cat $mcs_dir/$config_number$postfix.csv|wc -l`
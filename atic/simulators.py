@@ -0,0 +1,907 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-ins for the testbed hardware so the runner can be exercised
+and its orchestration overhead measured without any instruments.
+
+SimulatedTestbed holds the shared state of the simulated hardware and
+hands out the fakes:
+    p2p_link()      P2PLink whose SSH and SFTP clients emulate the radios,
+                    including iperf3-arm32v7 (TCP and UDP), ping, athstats,
+                    pidof, mcs_loop.sh, gzip, md5sum, netstat and a /data
+                    directory backed by a temporary folder
+    x410()          UsrpX410 connected to a localhost server speaking the
+                    playback server protocol
+    attenuator()    stand-in for MiniCircuitsRCDAT
+    power_supply()  stand-in for RigolDP800Series
+
+Every device has a tunable latency per operation, and time_scale scales
+the simulated test durations (0 makes measurements instantaneous) so the
+overhead of the orchestration can be benchmarked on its own.  The link
+throughput follows a toy model of the attenuator settings.  Faults can be
+injected to exercise the I/O policy of io_policy.py: radio sessions that
+drop or commands that hang, and an X410 server that restarts or loses a
+response.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import random
+import re
+import shlex
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import paramiko
+
+from p2p_link import P2PLink
+from x410_driver import UsrpX410
+
+default_delays = {
+    # seconds per ssh exec_command round trip
+    "ssh_latency": 0.0,
+    # bytes per second of sftp and gzip transfers, None for unlimited
+    "sftp_rate": None,
+    # seconds per X410 command
+    "x410_latency": 0.0,
+    # seconds to load a waveform into the X410 replay buffer
+    "x410_load_time": 0.0,
+    # seconds per attenuator write or read
+    "attenuator_latency": 0.0,
+    # seconds per power supply query
+    "power_supply_latency": 0.0,
+}
+
+default_faults = {
+    # probability per ssh command that the session drops
+    "ssh_drop": 0.0,
+    # probability per ssh command that it hangs until the read times out
+    "ssh_hang": 0.0,
+    # probability per X410 command that the server restarts with its defaults
+    "x410_drop": 0.0,
+    # probability per X410 command that its response is lost
+    "x410_hang": 0.0,
+}
+
+
+def command_options(args):
+    """Options of a command line, flags without a value map to None"""
+    options = {}
+    for index, arg in enumerate(args[1:], start=1):
+        if arg.startswith("-"):
+            following = args[index + 1] if index + 1 < len(args) else None
+            options[arg] = None if following is None or following.startswith("-") else following
+    return options
+
+
+class SimulatedTestbed:
+    """Shared state of the simulated testbed
+
+    Args:
+        root (Path): folder that backs the simulated file systems, a
+            temporary folder is made if None
+        time_scale (float): multiplier applied to simulated test durations
+        seed (Int): seed of the throughput noise
+        clock_offsets (dict): seconds the parent, child and x410 clocks are
+            ahead of the host clock
+        faults (dict): overrides of default_faults
+        **delays: overrides of default_delays
+    """
+
+    def __init__(self, root=None, time_scale=0.0, seed=0, clock_offsets=None, faults=None, **delays):
+        self.root = Path(root or tempfile.mkdtemp(prefix="atic_sim_"))
+        self.time_scale = time_scale
+        self.delays = dict(default_delays)
+        self.delays.update(delays)
+        self.faults = dict(default_faults)
+        self.faults.update(faults or {})
+        self.random = random.Random(seed)
+        # separate so injected faults leave the throughput noise unchanged
+        self.fault_random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.attenuation = {}
+        self.iperf_server_pid = None
+        self.next_pid = 1000
+        self.x410_state = {"rf_output": False, "power": -10.0, "wv_file": None}
+        self.servers = []
+        self.clock_offsets = {"parent": 0.0, "child": 0.0, "x410": 0.0}
+        self.clock_offsets.update(clock_offsets or {})
+
+    def device_time(self, device):
+        """Wall clock time of a simulated device"""
+        return time.time() + self.clock_offsets[device]
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def fault(self, device):
+        """Draw the fault of the next operation of "ssh" or "x410"
+
+        Returns:
+            fault (String): "drop", "hang" or None
+        """
+        with self.lock:
+            draw = self.fault_random.random()
+        for fault in ("drop", "hang"):
+            probability = self.faults[f"{device}_{fault}"]
+            if draw < probability:
+                return fault
+            draw -= probability
+        return None
+
+    def new_pid(self):
+        with self.lock:
+            self.next_pid += 1
+            return self.next_pid
+
+    def sinr(self):
+        """Toy SINR in dB from the attenuator settings and interferer state"""
+        link_loss = self.attenuation.get(1, 0) + self.attenuation.get(4, 0)
+        interference = 0.0
+        if self.x410_state["rf_output"]:
+            interference = max(0.0, 40 + self.x410_state["power"] - self.attenuation.get(3, 0))
+        noise = max(0.0, 20 - self.attenuation.get(2, 0))
+        return 60 - link_loss - interference - noise
+
+    def throughput(self):
+        """Throughput in bits per second for one iperf interval"""
+        capacity = 400e6 * min(max(self.sinr() / 40, 0.0), 1.0)
+        return max(capacity * (1 + self.random.gauss(0, 0.02)), 0.0)
+
+    def round_trip(self):
+        """Round trip time in ms of one ping probe, None if it is lost"""
+        quality = min(max(self.sinr() / 40, 0.0), 1.0)
+        if self.random.random() < 0.5 * (1 - quality) ** 2:
+            return None
+        return 0.4 + 8 * (1 - quality) + abs(self.random.gauss(0, 0.1 + 2 * (1 - quality)))
+
+    def mcs_index(self):
+        """Dominant MCS index for the current SINR"""
+        return int(min(max(self.sinr() / 4, 0), 9))
+
+    def p2p_link(self, **options):
+        return SimulatedP2PLink(self, **options)
+
+    def x410(self, freq=2.4e6, rf_power=-40, policy=None):
+        server = SimulatedX410Server(self)
+        self.servers.append(server)
+        return SimulatedUsrpX410(
+            usrp_ip_addr="127.0.0.1", freq=freq, rf_power=rf_power, port=server.port, policy=policy
+        )
+
+    def attenuator(self, resource=None, frequency=None, channel=1):
+        return SimulatedAttenuator(self, channel)
+
+    def power_supply(self, resource=None):
+        return SimulatedPowerSupply(self)
+
+    def close(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class SimulatedChannel:
+    """Channel attribute of the simulated stdin/stdout/stderr files"""
+
+    def __init__(self):
+        self.closed = False
+        self.stdin_done = threading.Event()
+        self.exit_status = 0
+
+    def close(self):
+        self.closed = True
+
+    def shutdown_write(self):
+        self.stdin_done.set()
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def settimeout(self, timeout):
+        pass
+
+
+class SimulatedStdin:
+    def __init__(self, channel):
+        self.channel = channel
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data if isinstance(data, str) else data.decode())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.channel.shutdown_write()
+
+
+class SimulatedStdout:
+    """Lazily produced command output with the ChannelFile interface,
+    read() returns bytes and iteration yields lines as str, or the bytes
+    blocks of binary output"""
+
+    def __init__(self, channel, producer):
+        self.channel = channel
+        self.producer = producer
+        self.lines = None
+        self.buffer = []
+        self.position = 0
+        self.reader = None
+        self.pending = b""
+
+    def _next_line(self):
+        if self.lines is None:
+            self.lines = iter(self.producer())
+        line = next(self.lines)
+        self.buffer.append(line)
+        return line
+
+    def finish(self):
+        """Run the command to completion without consuming its output"""
+        # a StopIteration from _next_line ends the loop
+        for line in iter(self._next_line, None):
+            pass
+
+    def _iter_lines(self):
+        while not self.channel.closed:
+            if self.position == len(self.buffer):
+                try:
+                    self._next_line()
+                except StopIteration:
+                    return
+            self.position += 1
+            yield self.buffer[self.position - 1]
+
+    def __iter__(self):
+        return self._iter_lines()
+
+    def read(self, size=-1):
+        """Returns up to size bytes of output, all of it if size is negative"""
+        if self.reader is None:
+            self.reader = self._iter_lines()
+        while size < 0 or len(self.pending) < size:
+            item = next(self.reader, None)
+            if item is None:
+                break
+            self.pending += item if isinstance(item, bytes) else item.encode()
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+class SimulatedSSHClient:
+    """Emulates the commands the testbed runs over SSH on one radio
+
+    Args:
+        testbed (SimulatedTestbed): shared simulated state
+        host_root (Path): folder mirroring the radio file system
+        child_address (String): address the iperf client connects to
+    """
+
+    def __init__(self, testbed, host_root, child_address=None):
+        self.testbed = testbed
+        self.host_root = Path(host_root)
+        self.child_address = child_address
+        Path(self.host_root, "data").mkdir(parents=True, exist_ok=True)
+        Path(self.host_root, "tmp").mkdir(parents=True, exist_ok=True)
+        Path(self.host_root, "tmp", "config.json").write_text(json.dumps({"simulated": True}))
+        self.client_pid = None
+        self.failed = False
+        self.device = "child" if child_address is None else "parent"
+        self.active = True
+
+    def local(self, remote_path):
+        """Local path of a path on the simulated radio"""
+        return Path(self.host_root, str(remote_path).lstrip("/"))
+
+    def open_sftp(self):
+        return SimulatedSFTPClient(self)
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        pass
+
+    def close(self):
+        self.active = False
+
+    def exec_command(self, command, timeout=None):
+        self.testbed.sleep(self.testbed.delays["ssh_latency"])
+        if not self.active:
+            raise paramiko.SSHException("SSH session not active")
+        fault = self.testbed.fault("ssh")
+        if fault == "drop":
+            self.active = False
+            raise EOFError("simulated session drop")
+        channel = SimulatedChannel()
+        stdin = SimulatedStdin(channel)
+        if fault == "hang":
+            # the command never answers, reads time out like on a channel
+            def hang():
+                time.sleep(timeout or 0)
+                raise socket.timeout("simulated hung command")
+
+            return stdin, SimulatedStdout(channel, hang), SimulatedStdout(channel, hang)
+        errors = []
+
+        def producer():
+            output = self.run(command, stdin, errors)
+            for line in output:
+                yield line
+            if errors:
+                channel.exit_status = 1
+
+        stdout = SimulatedStdout(channel, producer)
+
+        def error_producer():
+            # the command finishes before its stderr is complete
+            stdout.finish()
+            return errors
+
+        stderr = SimulatedStdout(channel, error_producer)
+        if not self.is_streaming(command):
+            # run now like a remote process would, output is read later
+            stdout.finish()
+        return stdin, stdout, stderr
+
+    def is_streaming(self, command):
+        return "--forceflush" in command or command.startswith(("cat >>", "ping ", "/data/mcs_loop.sh"))
+
+    def append(self, remote_path, text):
+        with open(self.local(remote_path), "a") as out_file:
+            out_file.write(text)
+
+    def run(self, command, stdin, errors):
+        """Run a command, yields its stdout lines"""
+        target = None
+        tee = False
+        if command.startswith("cat >>"):
+            yield from self.cat_append(command.split(">>", 1)[1].strip(), stdin)
+            return
+        if " >> " in command:
+            command, target = command.rsplit(" >> ", 1)
+        elif "| tee -a " in command:
+            command, target = command.split("| tee -a ", 1)
+            tee = True
+        elif " > " in command:
+            command, target = command.rsplit(" > ", 1)
+            self.local(target.strip()).write_text("")
+        if " && " in command:
+            # later commands only run while the earlier ones succeed
+            for part in command.split(" && "):
+                yield from self.run(part, stdin, errors)
+                if errors or self.failed:
+                    return
+            return
+        lines = self.dispatch(command.strip(), stdin, errors)
+        if target is None:
+            yield from lines
+            return
+        for line in lines:
+            self.append(target.strip(), line)
+            if tee:
+                yield line
+
+    def dispatch(self, command, stdin, errors):
+        args = shlex.split(command)
+        name = args[0] if args else ""
+        self.failed = False
+        if name == "/data/iperf3-arm32v7":
+            if "-s" in args:
+                self.testbed.iperf_server_pid = self.testbed.new_pid()
+                return []
+            return self.iperf_client(args, errors)
+        if name == "pidof":
+            if args[1] != "iperf3-arm32v7":
+                return []
+            if self.child_address is None and self.testbed.iperf_server_pid:
+                return [f"{self.testbed.iperf_server_pid}\n"]
+            if self.child_address is not None and self.client_pid:
+                return [f"{self.client_pid}\n"]
+            self.failed = True
+            return []
+        if name == "netstat":
+            lines = ["Active Internet connections (only servers)\n",
+                     "Proto Recv-Q Send-Q Local Address           Foreign Address         State\n",
+                     "tcp        0      0 0.0.0.0:22              0.0.0.0:*               LISTEN\n"]
+            if self.child_address is None and self.testbed.iperf_server_pid:
+                lines.append("tcp        0      0 :::5201                 :::*                    LISTEN\n")
+            return lines
+        if name == "kill":
+            pids = [arg for arg in args[1:] if not arg.startswith("-")]
+            if str(self.testbed.iperf_server_pid) in pids and self.child_address is None:
+                self.testbed.iperf_server_pid = None
+            if str(self.client_pid) in pids or "`pidof" in command:
+                self.client_pid = None
+            return []
+        if name == "ping":
+            return self.ping(args)
+        if name == "/data/mcs_loop.sh":
+            return self.mcs_loop(*args[1:5])
+        if name == "athstats":
+            return athstats_output(self.testbed)
+        if name == "date" and args[1:] == ["+%s"]:
+            return [f"{int(self.testbed.device_time(self.device))}\n"]
+        if name == "awk" and args[-1] == "/proc/timer_list":
+            # the monotonic clock reported on the "now at" line
+            return [f"{int(time.monotonic() * 1e9)}\n"]
+        if name == "echo":
+            return [" ".join(args[1:]) + "\n"]
+        if name == "mkdir":
+            for path in args[1:]:
+                if path != "-p":
+                    self.local(path).mkdir(parents=True, exist_ok="-p" in args)
+            return []
+        if name == "cp":
+            shutil.copy(self.local(args[1]), self.local(args[2]))
+            return []
+        if name == "md5sum":
+            source = self.local(args[1])
+            if not source.exists():
+                errors.append(f"md5sum: can't open '{args[1]}': No such file or directory\n")
+                return []
+            return [f"{hashlib.md5(source.read_bytes()).hexdigest()}  {args[1]}\n"]
+        if name == "gzip" and args[1] == "-c":
+            return self.gzip_stream(args[2], errors)
+        if name == "touch":
+            self.local(args[1]).touch()
+            return []
+        if name == "rm":
+            for pattern in args[1:]:
+                if pattern.startswith("-"):
+                    continue
+                folder = self.local(pattern).parent
+                if folder.exists():
+                    for path in folder.iterdir():
+                        if fnmatch.fnmatch(path.name, Path(pattern).name):
+                            path.unlink()
+            return []
+        errors.append(f"sh: {name}: not found\n")
+        return []
+
+    def gzip_stream(self, remote_path, errors):
+        """Emulates gzip -c, yields compressed blocks paced by the link rate"""
+        source = self.local(remote_path)
+        if not source.exists():
+            errors.append(f"gzip: can't open '{remote_path}': No such file or directory\n")
+            return
+        rate = self.testbed.delays["sftp_rate"]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        with open(source, "rb") as in_file:
+            for block in iter(lambda: in_file.read(1 << 16), b""):
+                data = compressor.compress(block)
+                if data:
+                    if rate:
+                        self.testbed.sleep(len(data) / rate)
+                    yield data
+        yield compressor.flush()
+
+    def cat_append(self, remote_path, stdin):
+        stdin.channel.stdin_done.wait()
+        self.append(remote_path, "".join(stdin.data))
+        return []
+
+    def iperf_client(self, args, errors):
+        """Emulates an iperf3 client run, -J json or streamed text output"""
+        options = command_options(args)
+        test_time = float(options.get("-t", 10))
+        interval = float(options.get("-i", 1))
+        json_output = "-J" in args
+        # a UDP stream sends at the -b rate whatever the link can carry
+        udp_rate = float(options.get("-b", 1e6)) if "-u" in args else None
+        if self.testbed.iperf_server_pid is None:
+            if json_output:
+                return [json.dumps({"start": {}, "intervals": [], "end": {},
+                                    "error": "error - unable to connect to server: Connection refused"}, indent="\t") + "\n"]
+            errors.append("iperf3: error - unable to connect to server: Connection refused\n")
+            return []
+        self.client_pid = self.testbed.new_pid()
+        if json_output:
+            return [self.iperf_json(test_time, interval, udp_rate, options.get("-l", 1460)) + "\n"]
+        return self.iperf_text(test_time, interval)
+
+    def iperf_intervals(self, test_time, interval, udp_rate=None, packet_size=1460):
+        start = 0.0
+        while start < test_time - 1e-9 and self.client_pid is not None:
+            end = min(start + interval, test_time)
+            self.testbed.sleep((end - start) * self.testbed.time_scale)
+            bits_per_second = self.testbed.throughput()
+            interval_sum = {
+                "start": start,
+                "end": end,
+                "seconds": end - start,
+                "bytes": int(bits_per_second * (end - start) / 8),
+                "bits_per_second": bits_per_second,
+                "retransmits": 0,
+                "omitted": False,
+                "sender": True,
+            }
+            if udp_rate is not None:
+                # what the link cannot carry is lost, the jitter grows as the SINR falls
+                packets = int(udp_rate * (end - start) / 8 / int(packet_size))
+                lost = int(packets * max(1 - bits_per_second / udp_rate, 0.0))
+                interval_sum = {
+                    "start": start,
+                    "end": end,
+                    "seconds": end - start,
+                    "bytes": packets * int(packet_size),
+                    "bits_per_second": udp_rate,
+                    "packets": packets,
+                    "omitted": False,
+                    "sender": True,
+                    "received": {
+                        "jitter_ms": 0.02 + abs(self.testbed.random.gauss(0, 0.01)) + 4e6 / max(bits_per_second, 1e6),
+                        "lost_packets": lost,
+                        "packets": packets,
+                        "lost_percent": 100 * lost / packets if packets else 0,
+                    },
+                }
+            yield interval_sum
+            start = end
+
+    def iperf_json(self, test_time, interval, udp_rate=None, packet_size=1460):
+        start_time = self.testbed.device_time(self.device)
+        intervals = [{"streams": [dict(interval_sum, socket=5)], "sum": interval_sum}
+                     for interval_sum in self.iperf_intervals(test_time, interval, udp_rate, packet_size)]
+        received = [interval["sum"].pop("received", None) for interval in intervals]
+        for interval in intervals:
+            interval["streams"][0].pop("received", None)
+        total_bytes = sum(interval["sum"]["bytes"] for interval in intervals)
+        seconds = intervals[-1]["sum"]["end"] if intervals else 0
+        summary = {"start": 0, "end": seconds, "seconds": seconds, "bytes": total_bytes,
+                   "bits_per_second": 8 * total_bytes / seconds if seconds else 0}
+        document = {
+            "start": {
+                "connecting_to": {"host": self.child_address, "port": 5201},
+                "version": "iperf 3.9 (simulated)",
+                "timestamp": {"time": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(start_time)),
+                              "timesecs": int(start_time)},
+                "test_start": {"protocol": "TCP", "duration": test_time},
+            },
+            "intervals": intervals,
+            "end": {"sum_sent": dict(summary, retransmits=0), "sum_received": summary},
+        }
+        if udp_rate is not None:
+            document["start"]["test_start"]["protocol"] = "UDP"
+            # --get-server-output, the receiver side of every interval
+            server_intervals = []
+            for interval, receiver in zip(intervals, received):
+                received_bytes = (receiver["packets"] - receiver["lost_packets"]) * int(packet_size)
+                server_sum = {key: interval["sum"][key] for key in ("start", "end", "seconds")}
+                server_sum.update(bytes=received_bytes, bits_per_second=8 * received_bytes / server_sum["seconds"])
+                server_intervals.append({"sum": dict(server_sum, **receiver, omitted=False, sender=False)})
+            document["server_output_json"] = {
+                "start": {"timestamp": {"timesecs": int(self.testbed.device_time("child"))}},
+                "intervals": server_intervals,
+                "end": {},
+            }
+        self.client_pid = None
+        return json.dumps(document, indent="\t")
+
+    def ping(self, args):
+        """Emulates busybox ping -i -s -w, yields its output lines"""
+        options = command_options(args)
+        interval = float(options.get("-i", 1))
+        size = int(options.get("-s", 56))
+        deadline = float(options.get("-w", 10))
+        host = args[-1]
+        yield f"PING {host} ({host}): {size} data bytes\n"
+        received = 0
+        transmitted = 0
+        rtts = []
+        while transmitted * interval < deadline - 1e-9:
+            rtt = self.testbed.round_trip()
+            if rtt is not None:
+                received += 1
+                rtts.append(rtt)
+                yield f"{size + 8} bytes from {host}: seq={transmitted} ttl=64 time={rtt:.3f} ms\n"
+            transmitted += 1
+            self.testbed.sleep(interval * self.testbed.time_scale)
+        yield f"\n--- {host} ping statistics ---\n"
+        yield (f"{transmitted} packets transmitted, {received} packets received, "
+               f"{round(100 * (1 - received / transmitted)) if transmitted else 0}% packet loss\n")
+        if rtts:
+            yield f"round-trip min/avg/max = {min(rtts):.3f}/{sum(rtts) / len(rtts):.3f}/{max(rtts):.3f} ms\n"
+
+    def iperf_text(self, test_time, interval):
+        yield f"Connecting to host {self.child_address}, port 5201\n"
+        for interval_sum in self.iperf_intervals(test_time, interval):
+            yield (f"[  5] {interval_sum['start']:6.2f}-{interval_sum['end']:<6.2f} sec  "
+                   f"{interval_sum['bytes'] / 2**20:.1f} MBytes  "
+                   f"{interval_sum['bits_per_second'] / 1e3:.0f} Kbits/sec    0   352 KBytes\n")
+        self.client_pid = None
+
+    def mcs_loop(self, test_time, mcs_dir, config_number, interval):
+        """Emulates /data/mcs_loop.sh, prints every sample like the script
+        and writes <config>_mcs.json"""
+        test_time = float(test_time)
+        interval = float(interval)
+        stop_file = self.local(f"{mcs_dir}/{config_number}.stop")
+        counters = [0] * 10
+        rows = []
+        elapsed = 0.0
+        yield "date,clock," + ",".join(f"mcs{i}" for i in range(len(counters))) + "\n"
+        while elapsed <= test_time:
+            counters[self.testbed.mcs_index()] += int(self.testbed.throughput() * interval / 12000)
+            clock = time.monotonic()
+            date = time.gmtime(self.testbed.device_time(self.device))
+            rows.append({"date": time.strftime("%a %b %d %H:%M:%S UTC %Y", date),
+                         "clock": round(clock, 3),
+                         **{f"mcs{i}": counter for i, counter in enumerate(counters)}})
+            yield f'"{rows[-1]["date"]}",{clock:.3f},' + ",".join(map(str, counters)) + "\n"
+            if stop_file.exists():
+                break
+            self.testbed.sleep(interval * self.testbed.time_scale)
+            elapsed += interval
+        if stop_file.exists():
+            stop_file.unlink()
+        with open(self.local(f"{mcs_dir}/{config_number}_mcs.json"), "w") as out_file:
+            out_file.write("[\n" + ",\n".join("  " + json.dumps(row) for row in rows) + "\n]")
+
+
+def athstats_output(testbed):
+    counters = [0] * 10
+    counters[testbed.mcs_index()] = 1000
+    first = ",".join(f"{counter:6d}" for counter in counters[:5])
+    second = ",".join(f"{counter:6d}" for counter in counters[5:])
+    return ["Tx MCS STATS:\n", f"mcs 0- mcs 4 STATS:{first},\n", f"mcs 5- mcs 9 STATS:{second},\n"]
+
+
+class SimulatedSFTPClient:
+    """SFTP client over the simulated radio file system"""
+
+    def __init__(self, ssh_client):
+        self.ssh = ssh_client
+
+    def _transfer_delay(self, size):
+        rate = self.ssh.testbed.delays["sftp_rate"]
+        self.ssh.testbed.sleep(self.ssh.testbed.delays["ssh_latency"])
+        if rate:
+            self.ssh.testbed.sleep(size / rate)
+
+    def get(self, remote_path, local_path, callback=None):
+        source = self.ssh.local(remote_path)
+        if not source.exists():
+            raise FileNotFoundError(2, "No such file", remote_path)
+        self._transfer_delay(source.stat().st_size)
+        shutil.copy(source, local_path)
+
+    def put(self, local_path, remote_path, callback=None):
+        self._transfer_delay(Path(local_path).stat().st_size)
+        shutil.copy(local_path, self.ssh.local(remote_path))
+
+    def stat(self, remote_path):
+        source = self.ssh.local(remote_path)
+        if not source.exists():
+            raise FileNotFoundError(2, "No such file", remote_path)
+        return source.stat()
+
+    def open(self, remote_path, mode="r", bufsize=-1):
+        return open(self.ssh.local(remote_path), mode.replace("b", "") + "b")
+
+    def get_channel(self):
+        return SimulatedChannel()
+
+    def close(self):
+        pass
+
+
+class SimulatedP2PLink(P2PLink):
+    """P2PLink whose SSH and SFTP sessions talk to the simulated radios"""
+
+    def __init__(self, testbed, **options):
+        self.testbed = testbed
+        super().__init__(**options)
+
+    def connect(self, address):
+        if address == self.p2p_parent_address:
+            return SimulatedSSHClient(
+                self.testbed, Path(self.testbed.root, "parent"), child_address=self.p2p_child_address
+            )
+        return SimulatedSSHClient(self.testbed, Path(self.testbed.root, "child"))
+
+
+class SimulatedUsrpX410(UsrpX410):
+    """UsrpX410 connected to a SimulatedX410Server"""
+
+    def __del__(self):
+        # the server threads may already be gone at interpreter exit
+        pass
+
+
+class SimulatedX410Handler(socketserver.StreamRequestHandler):
+    """Speaks the chan1uhd_playback_server protocol"""
+
+    def handle(self):
+        testbed = self.server.testbed
+        state = testbed.x410_state
+        while True:
+            data = self.rfile.readline().strip()
+            if not data:
+                break
+            data = str(data, "utf-8")
+            value = data.split("=")[-1]
+            testbed.sleep(testbed.delays["x410_latency"])
+            fault = testbed.fault("x410")
+            if fault == "drop":
+                # a restarted server forgets the session
+                state.update({"rf_output": False, "power": -10.0, "wv_file": None})
+                state.pop("freq", None)
+                break
+            if data.startswith("temp=?"):
+                response = f"{self.server.temperature():.1f} {self.server.temperature() - 5:.1f}"
+            elif data.startswith("rf out?"):
+                response = str(state["rf_output"])
+            elif data.startswith("telemetry"):
+                since = float(value) if "since=" in data else 0.0
+                samples = [sample for sample in self.server.telemetry if sample[0] > since]
+                response = json.dumps({"fields": ["time", "temp_fpga", "temp_tx", "power_ref", "rf_output"],
+                                       "samples": samples}, separators=(",", ":")) + "\n"
+            elif data.startswith("time=?"):
+                response = f"{testbed.device_time('x410'):.6f}"
+            elif data.startswith("freq="):
+                if value != "?":
+                    state["freq"] = float(value)
+                response = state.get("freq", 2.4e6)
+            elif data.startswith("power="):
+                if value != "?":
+                    state["power"] = float(value)
+                response = state["power"]
+            elif data.startswith("wv_file="):
+                # like the server, a waveform still in the replay buffer is not reloaded
+                if value != "?" and value != state["wv_file"]:
+                    testbed.sleep(testbed.delays["x410_load_time"])
+                    state["wv_file"] = value
+                response = str(state["wv_file"])
+            elif data.startswith("wv_has="):
+                stored = Path(self.server.wv_store, f"{value}.wv")
+                response = str(stored) if stored.exists() else "False"
+            elif data.startswith("wv_stat="):
+                partial = Path(self.server.wv_store, f"{value}.part")
+                response = str(partial.stat().st_size if partial.exists() else 0)
+            elif data.startswith("wv_chunk="):
+                digest, offset, length = value.split(",")
+                payload = self.rfile.read(int(length))
+                testbed.sleep(len(payload) / testbed.delays["sftp_rate"] if testbed.delays["sftp_rate"] else 0)
+                partial = Path(self.server.wv_store, f"{digest}.part")
+                size = partial.stat().st_size if partial.exists() else 0
+                if int(offset) != size:
+                    response = f"Error: expected offset {size}"
+                else:
+                    with open(partial, "ab") as out_file:
+                        out_file.write(payload)
+                    response = str(size + len(payload))
+            elif data.startswith("wv_commit="):
+                partial = Path(self.server.wv_store, f"{value}.part")
+                if not partial.exists():
+                    response = "Error: no upload for digest"
+                elif hashlib.sha256(partial.read_bytes()).hexdigest() != value:
+                    partial.unlink()
+                    response = "Error: digest mismatch"
+                else:
+                    os.replace(partial, Path(self.server.wv_store, f"{value}.wv"))
+                    response = str(Path(self.server.wv_store, f"{value}.wv"))
+            elif data.startswith("synth="):
+                kind = data[len("synth="):].split(",")[0]
+                if state["wv_file"] == "synth:" + data[len("synth="):]:
+                    response = state["wv_file"]
+                elif kind in ("noise", "pulsed", "cw", "multitone"):
+                    testbed.sleep(testbed.delays["x410_load_time"])
+                    state["wv_file"] = "synth:" + data[len("synth="):]
+                    response = state["wv_file"]
+                else:
+                    response = f"Error: unknown waveform {kind}"
+            elif data.startswith("start"):
+                if state["wv_file"] is None:
+                    response = "Error: IQ data not defined"
+                else:
+                    state["rf_output"] = True
+                    response = "RF output started"
+            elif data.startswith("stop"):
+                if not state["rf_output"]:
+                    response = "RF output not enabled"
+                else:
+                    state["rf_output"] = False
+                    response = "RF output stopped"
+            else:
+                response = "Error: Invalid command"
+            self.server.record_telemetry()
+            if fault == "hang":
+                # the command took effect but its response is lost, wait for the client to give up
+                self.rfile.read()
+                break
+            self.wfile.write(bytes(str(response), "utf-8"))
+            self.wfile.flush()
+
+
+class SimulatedX410Server(socketserver.ThreadingTCPServer):
+    """Localhost playback server on a free port, served from a daemon thread"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, testbed):
+        super().__init__(("127.0.0.1", 0), SimulatedX410Handler)
+        self.testbed = testbed
+        # content addressed store of pushed waveforms
+        self.wv_store = Path(testbed.root, "x410", "wv_files", "by_hash")
+        self.wv_store.mkdir(parents=True, exist_ok=True)
+        self.port = self.server_address[1]
+        self.start_time = time.time()
+        self.telemetry = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def temperature(self):
+        # slow warm up while the waveform is playing
+        return 45 + min(time.time() - self.start_time, 600) / 60
+
+    def record_telemetry(self):
+        state = self.testbed.x410_state
+        self.telemetry.append([round(time.time(), 3), round(self.temperature(), 1),
+                               round(self.temperature() - 5, 1), state["power"], state["rf_output"]])
+
+
+class SimulatedAttenuator:
+    """Stand-in for MiniCircuitsRCDAT with a latency per access"""
+
+    def __init__(self, testbed, channel):
+        self.testbed = testbed
+        self.channel = channel
+        self.testbed.attenuation.setdefault(channel, 0.0)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def attenuation_setting(self):
+        self.testbed.sleep(self.testbed.delays["attenuator_latency"])
+        return self.testbed.attenuation[self.channel]
+
+    @attenuation_setting.setter
+    def attenuation_setting(self, value):
+        self.testbed.sleep(self.testbed.delays["attenuator_latency"])
+        self.testbed.attenuation[self.channel] = float(value)
+
+
+class SimulatedPowerSupply:
+    """Stand-in for RigolDP800Series that answers SCPI measurement queries"""
+
+    def __init__(self, testbed):
+        self.testbed = testbed
+        self.voltages = {1: 28.0, 2: 5.0, 3: 5.0}
+        self.currents = {1: 0.120, 2: 0.250, 3: 0.200}
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def query(self, command):
+        self.testbed.sleep(self.testbed.delays["power_supply_latency"])
+        match = re.match(r":MEAS(?:ure)?:ALL\?\s*CH(\d)", command, re.IGNORECASE)
+        if match is None:
+            raise ValueError(f"unsupported query {command}")
+        channel = int(match.group(1))
+        voltage = self.voltages[channel] * (1 + self.testbed.random.gauss(0, 0.001))
+        current = self.currents[channel] * (1 + self.testbed.random.gauss(0, 0.01))
+        return f"{voltage:.3f},{current:.4f},{voltage * current:.3f}"
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative parameter sweeps expanded lazily into runner configs.
+
+Instead of spelling out every config of a runner csv, the experiment yaml
+of a run can hold a sweep section.  Its axes are runner columns whose
+values are a list or a range, independent axes are combined as a product
+and axes listed under zip advance together:
+
+    sweep:
+      method: lhs             # grid (default), random or lhs
+      samples: 200            # configs drawn by random and lhs
+      seed: 1
+      constants:
+        interval: 1
+        packet_size: 1400
+        test_time: 60
+        start_settle_time: 30
+        test_settle_time: 10
+        test_noise_diode_attn: 10
+      product:
+        - test_interferer_attn: {start: 0, stop: 60, step: 0.5}
+        - wv_file: [/data/wv_files/a.wv, /data/wv_files/b.wv]
+        - zip:
+            test_p2p_parent_attn: {start: 0, stop: 30, step: 10}
+            test_p2p_child_attn: [0, 10, 20, 30]
+
+Ranges include their stop value, {start, stop, num} spaces num values
+evenly.  Start attenuations the sweep does not set follow the test
+attenuation.
+
+A Sweep knows the size of its space and the bounds of every axis without
+expanding it, so the whole space is validated up front and a config is
+computed from its index only when it is needed.  A grid walks the whole
+space like nested loops with the last axis fastest, random draws samples
+distinct points, and a Latin hypercube stratifies every product axis into
+samples intervals and visits each interval once.  The configs are numbered
+in the order they are drawn.
+
+    python sweep.py runner.yaml --preview 5
+    python sweep.py runner.yaml --csv runner.csv
+"""
+
+import argparse
+import csv
+import math
+import random
+from pathlib import Path
+
+from adaptive import ADAPTIVE_COLUMNS
+from latency import LATENCY_COLUMNS, latency_problems
+from logs import YamlSerializer
+
+METHODS = ["grid", "random", "lhs"]
+ATTENUATORS = ["p2p_parent_attn", "p2p_child_attn", "noise_diode_attn", "interferer_attn"]
+TIME_COLUMNS = ["interval", "test_time", "start_settle_time", "test_settle_time", "packet_size"]
+REQUIRED_COLUMNS = TIME_COLUMNS + [f"test_{name}" for name in ATTENUATORS]
+COLUMNS = (
+    ["config"]
+    + TIME_COLUMNS
+    + [f"{phase}_{name}" for phase in ("start", "test") for name in ATTENUATORS]
+    + ["wv_file"]
+    + ADAPTIVE_COLUMNS
+    + LATENCY_COLUMNS
+)
+# range values are rounded to this many decimals so float steps stay exact
+RANGE_DECIMALS = 9
+
+
+class Axis:
+    """Values of one runner column, a list or an evenly spaced range
+
+    Args:
+        name (String): runner column
+        spec: list of values, a single value, or a mapping with start, stop
+            and either step or num
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.values = None
+        if isinstance(spec, dict):
+            unknown = set(spec) - {"start", "stop", "step", "num"}
+            if unknown or "start" not in spec or "stop" not in spec:
+                raise ValueError(f"{name}: a range needs start, stop and step or num, got {sorted(spec)}")
+            self.start, self.stop = float(spec["start"]), float(spec["stop"])
+            if "num" in spec:
+                self.length = int(spec["num"])
+                self.step = (self.stop - self.start) / (self.length - 1) if self.length > 1 else 0.0
+            elif "step" in spec:
+                self.step = float(spec["step"])
+                if self.step == 0 or (self.stop - self.start) * self.step < 0:
+                    raise ValueError(f"{name}: step {self.step} does not lead from {self.start} to {self.stop}")
+                self.length = int(math.floor((self.stop - self.start) / self.step + 1e-9)) + 1
+            else:
+                raise ValueError(f"{name}: a range needs a step or num")
+        else:
+            self.values = list(spec) if isinstance(spec, (list, tuple)) else [spec]
+            self.length = len(self.values)
+        if self.length < 1:
+            raise ValueError(f"{name}: the axis has no values")
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if self.values is not None:
+            return self.values[index]
+        value = round(self.start + index * self.step, RANGE_DECIMALS)
+        return int(value) if value.is_integer() else value
+
+    def bounds(self):
+        """Lowest and highest value, None for axes that are not numeric"""
+        if self.values is None:
+            return sorted([self[0], self[self.length - 1]])
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in self.values):
+            return [min(self.values), max(self.values)]
+        return None
+
+
+class Sweep:
+    """Lazily expanded space of runner configs
+
+    Args:
+        spec (dict): the sweep section of an experiment yaml
+
+    Raises:
+        ValueError: listing every problem of the spec
+    """
+
+    def __init__(self, spec):
+        problems = []
+        self.method = spec.get("method", "grid")
+        self.seed = spec.get("seed")
+        self.samples = spec.get("samples")
+        self.constants = dict(spec.get("constants") or {})
+        # every factor of the product is a list of axes of equal length
+        self.factors = []
+        for entry in spec.get("product") or []:
+            if not isinstance(entry, dict):
+                problems.append(f"product entries are mappings of axes, got {entry!r}")
+                continue
+            for name, axis_spec in entry.items():
+                try:
+                    if name == "zip":
+                        if not axis_spec:
+                            raise ValueError("zip needs at least one axis")
+                        self.factors.append([Axis(key, value) for key, value in axis_spec.items()])
+                    else:
+                        self.factors.append([Axis(name, axis_spec)])
+                except ValueError as error:
+                    problems.append(str(error))
+        self.size = math.prod(len(factor[0]) for factor in self.factors)
+        problems += self.validate()
+        if problems:
+            raise ValueError("invalid sweep:\n    " + "\n    ".join(problems))
+
+    @classmethod
+    def from_yaml(cls, file_path):
+        """Sweep of an experiment yaml, None if it has no sweep section"""
+        metadata = YamlSerializer().load(file_path) or {}
+        if "sweep" not in metadata:
+            return None
+        return cls(metadata["sweep"])
+
+    @property
+    def axes(self):
+        return [axis for factor in self.factors for axis in factor]
+
+    def validate(self):
+        """Check the spec without expanding it
+
+        Returns:
+            problems (List): descriptions of everything wrong with the spec
+        """
+        problems = []
+        names = [axis.name for axis in self.axes] + list(self.constants)
+        for name in sorted({name for name in names if names.count(name) > 1}):
+            problems.append(f"{name} is set more than once")
+        for name in sorted(set(names) - set(COLUMNS)):
+            problems.append(f"{name} is not a runner column")
+        if "config" in names:
+            problems.append("config numbers are assigned by the sweep")
+        for name in REQUIRED_COLUMNS:
+            if name not in names:
+                problems.append(f"{name} is not set")
+        for factor in self.factors:
+            if len({len(axis) for axis in factor}) > 1:
+                lengths = ", ".join(f"{axis.name} {len(axis)}" for axis in factor)
+                problems.append(f"zipped axes differ in length: {lengths}")
+        if self.method not in METHODS:
+            problems.append(f"method {self.method} is not one of {METHODS}")
+        if self.method in ("random", "lhs"):
+            if not isinstance(self.samples, int) or self.samples < 1:
+                problems.append(f"{self.method} sampling needs a positive number of samples")
+            elif self.method == "random" and self.samples > self.size:
+                problems.append(f"{self.samples} samples drawn from a space of {self.size} configs")
+        bounds = {axis.name: axis.bounds() for axis in self.axes}
+        bounds.update({name: Axis(name, value).bounds() for name, value in self.constants.items()})
+        for name, limits in bounds.items():
+            if name.endswith("_attn") or name in TIME_COLUMNS:
+                if limits is None:
+                    problems.append(f"{name} has values that are not numbers")
+                elif limits[0] < 0 or (name in ("interval", "test_time", "packet_size") and limits[0] <= 0):
+                    problems.append(f"{name} goes down to {limits[0]}")
+        axes = [axis for axis in self.axes if axis.name in LATENCY_COLUMNS]
+        axes += [Axis(name, value) for name, value in self.constants.items() if name in LATENCY_COLUMNS]
+        for axis in axes:
+            for value in axis.values or [axis[0], axis[len(axis) - 1]]:
+                problems += [problem for problem in latency_problems({axis.name: value}) if problem not in problems]
+        return problems
+
+    def __len__(self):
+        """Number of configs the sweep runs"""
+        return self.size if self.method == "grid" else self.samples
+
+    def point(self, indices):
+        """Config dictionary of one value index per product factor"""
+        row = dict(self.constants)
+        for factor, index in zip(self.factors, indices):
+            for axis in factor:
+                row[axis.name] = axis[index]
+        for name in ATTENUATORS:
+            row.setdefault(f"start_{name}", row[f"test_{name}"])
+        return row
+
+    def unravel(self, index):
+        """Factor indices of a grid index, the last factor varies fastest"""
+        indices = []
+        for factor in reversed(self.factors):
+            index, remainder = divmod(index, len(factor[0]))
+            indices.append(remainder)
+        return indices[::-1]
+
+    def indices(self):
+        """Generate the factor indices of the configs in the order they run"""
+        if self.method == "grid":
+            for index in range(self.size):
+                yield self.unravel(index)
+        elif self.method == "random":
+            # sampling a range does not expand it
+            for index in random.Random(self.seed).sample(range(self.size), self.samples):
+                yield self.unravel(index)
+        else:
+            generator = random.Random(self.seed)
+            strata = []
+            for factor in self.factors:
+                order = list(range(self.samples))
+                generator.shuffle(order)
+                strata.append(order)
+            for sample in range(self.samples):
+                yield [
+                    min(int((order[sample] + generator.random()) / self.samples * len(factor[0])), len(factor[0]) - 1)
+                    for factor, order in zip(self.factors, strata)
+                ]
+
+    def __iter__(self):
+        """Generate the config dictionaries, numbered from 1"""
+        for number, indices in enumerate(self.indices(), start=1):
+            yield {"config": number, **self.point(indices)}
+
+    def summary(self):
+        """Size, bounds and waveforms of the space, computed without expanding it"""
+        bounds = {axis.name: axis.bounds() for axis in self.axes}
+        bounds.update({name: Axis(name, value).bounds() for name, value in self.constants.items()})
+        waveforms = set()
+        for axis in self.axes:
+            if axis.name == "wv_file":
+                waveforms.update(str(axis[index]) for index in range(len(axis)))
+        if "wv_file" in self.constants:
+            waveforms.update(str(value) for value in Axis("wv_file", self.constants["wv_file"]).values)
+        return {
+            "method": self.method,
+            "space": self.size,
+            "configs": len(self),
+            "bounds": bounds,
+            "waveforms": sorted(waveforms),
+        }
+
+
+def validate_rows(rows):
+    """Check the rows of a runner csv, read as strings
+
+    Args:
+        rows (List): dictionaries of csv.DictReader
+
+    Columns the runner does not use, such as notes, are reported but are
+    not a problem.
+
+    Returns:
+        problems (List): descriptions of everything wrong with the rows
+    """
+    if not rows:
+        return ["the runner has no configs"]
+    columns = list(rows[0])
+    required = ["config"] + REQUIRED_COLUMNS + [f"start_{name}" for name in ATTENUATORS]
+    problems = [f"column {name} is missing" for name in required if name not in columns]
+    if problems:
+        # the rows can not be checked without their columns
+        return problems
+    for name in columns:
+        if name not in COLUMNS:
+            print(f"column {name} is not a runner column and is ignored")
+    numeric = [name for name in columns if name.endswith("_attn") or name in TIME_COLUMNS]
+    configs = set()
+    for line, row in enumerate(rows, start=2):
+        if row["config"] in configs:
+            problems.append(f"line {line}: config {row['config']} is repeated")
+        configs.add(row["config"])
+        for name in numeric:
+            try:
+                value = float(row[name])
+            except (TypeError, ValueError):
+                problems.append(f"line {line}: {name} {row[name]!r} is not a number")
+                continue
+            if value < 0 or (value == 0 and name in ("interval", "test_time", "packet_size")):
+                problems.append(f"line {line}: {name} is {row[name]}")
+        problems += [f"line {line}: {problem}" for problem in latency_problems(row)]
+    return problems
+
+
+class SweepRunner:
+    """Runner of a sweep run, recorded to its csv as the configs are generated
+
+    The test_conditions.csv of a sweep run grows as the configs are
+    started, configs that are already in the file, e.g. those of a resumed
+    run, are not repeated.
+
+    Args:
+        sweep (Sweep): the sweep of the run
+        file_path (Path): the test_conditions.csv of the run
+        skip (Iterable): configs that are left out, e.g. completed ones
+    """
+
+    def __init__(self, sweep, file_path, skip=()):
+        self.sweep = sweep
+        self.file_path = Path(file_path)
+        self.skip = {str(config) for config in skip}
+
+    def __len__(self):
+        return len(self.sweep) - len(self.skip)
+
+    def __iter__(self):
+        written = set()
+        if self.file_path.exists():
+            with open(self.file_path, "r", newline="") as in_file:
+                written = {row["config"] for row in csv.DictReader(in_file)}
+        with open(self.file_path, "a", newline="") as out_file:
+            writer = csv.DictWriter(out_file, fieldnames=COLUMNS, extrasaction="ignore")
+            if out_file.tell() == 0:
+                writer.writeheader()
+            for test_config in self.sweep:
+                if str(test_config["config"]) in self.skip:
+                    continue
+                if str(test_config["config"]) not in written:
+                    writer.writerow(test_config)
+                    out_file.flush()
+                    written.add(str(test_config["config"]))
+                yield test_config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate and expand the sweep of an experiment yaml")
+    parser.add_argument("yaml_file", help="experiment yaml with a sweep section")
+    parser.add_argument("--preview", type=int, default=0, metavar="N", help="print the first N configs")
+    parser.add_argument("--csv", help="write the configs to a runner csv")
+    args = parser.parse_args()
+    sweep = Sweep.from_yaml(args.yaml_file)
+    if sweep is None:
+        raise SystemExit(f"{args.yaml_file} has no sweep section")
+    summary = sweep.summary()
+    print(f"{summary['method']} sweep of {summary['configs']} configs from a space of {summary['space']}")
+    for name, limits in summary["bounds"].items():
+        print(f"    {name}: {limits}")
+    for test_config, _ in zip(sweep, range(args.preview)):
+        print(test_config)
+    if args.csv:
+        with open(args.csv, "w", newline="") as out_file:
+            writer = csv.DictWriter(out_file, fieldnames=COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(sweep)
+        print(f"{len(sweep)} configs written to {args.csv}")
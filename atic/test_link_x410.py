@@ -2,6 +2,7 @@
 the hardware to be checked out and rudimentary performance tests to be 
 performed."""
 
+import os
 import time
 import datetime
 import shutil
@@ -9,85 +10,328 @@ import json
 from copy import deepcopy
 from pathlib import Path
 
-import pandas as pd
 import labbench as lb
-from ssmdevices.instruments import MiniCircuitsRCDAT
-from ssmdevices.instruments import RigolDP800Series
+from adaptive import adaptive_enabled, settle_criterion, measurement_criterion
+from catalog import Catalog
+from checkpoint import Checkpoint, file_md5
+from clocksync import ClockSync
+from io_policy import IOPolicy
+from iperf_parser import close_truncated_array
 from p2p_link import P2PLink
 from config import testbed_config
-from logs import Log
-from x410_driver import UsrpX410
+from latency import measurement_mode, ping_settings
+from logs import SegmentedLog
+from metrics import MetricsServer, metrics
+from planner import plan_configs, evaluate_plan
+from power_monitor import PowerSampler, summarize
+from scheduler import CampaignScheduler
+from sweep import Sweep, SweepRunner
+from tracing import span, tracer, with_config
+from x410_driver import SYNTH_PREFIX, UsrpX410
 
-def write_log(event, config_number):
+# end of run clock offsets, reused by a campaign that starts right after
+last_clock_sync = None
+
+def attenuator_state():
+    """Read the current setting of every attenuator
+
+    Returns:
+        state (dict): attenuator name -> attenuation setting
+    """
+    return {
+        "p2p_parent_attn": p2p_parent_attn.attenuation_setting,
+        "p2p_child_attn": p2p_child_attn.attenuation_setting,
+        "noise_diode_attn": noise_diode_attn.attenuation_setting,
+        "interferer_attn": interferer_attn.attenuation_setting,
+    }
+
+
+def write_log(event, config_number, state=None):
     """Write log with meta information of attenuators
     Args:
         event (String): a description of when the logging occured
         config_number (Int): the configuration number when the logging occured
+        state (dict): previously read attenuator_state, read now if None
+
+    Returns:
+        None
+    """
+    if state is None:
+        state = attenuator_state()
+    log.add_entry({"event": f"{event}", "config_number": config_number, **state})
+
+
+def write_x410_log(config_number):
+    """Write log with meta information of X410
+
+    Args: 
+        config_number (Int): the configuration number when the logging occured
 
     Returns:
         None
     """
+    entry = {
+        "event": "X410 Ouput parameters",
+        "config_number": config_number,
+        "RF Output": usrp.query_rf(),
+        "Playback WV": usrp.playback_wv_file,
+        "Set power output": set_power,
+        "Reported power output": usrp.rf_output_power,
+        "Center Freq": usrp.center_freq,
+        "x410 temp": usrp.get_temp(),
+    }
+    log.add_entry(entry)
+    metrics.interferer = {
+        "rf_output": entry["RF Output"],
+        "wv_file": entry["Playback WV"],
+        "power": entry["Reported power output"],
+    }
+    metrics.temperatures = dict(zip(["fpga", "tx"], map(float, entry["x410 temp"].split())))
+
+
+def stage_wv_files(wv_files):
+    """Push the runner waveforms that are files on this computer to the X410
+
+    The X410 stores pushed files by content, so files it already holds are
+    not sent again.
+
+    Args:
+        wv_files (Iterable): wv_file values of the runner
+
+    Returns:
+        staged (dict): local file -> path of the waveform on the X410
+    """
+    staged = {}
+    for wv_file in sorted(set(wv_files)):
+        if str(wv_file).startswith(SYNTH_PREFIX) or not Path(wv_file).is_file():
+            continue
+        staged[wv_file] = usrp.push_wv_file(wv_file)
+        log.add_entry({"event": "waveform staged", "wv_file": wv_file, "remote_file": staged[wv_file]})
+    return staged
+
+
+def write_telemetry_log(config_number):
+    """Write log with the X410 telemetry sampled since the last fetch
+
+    Args:
+        config_number (Int): the configuration number when the logging occured
+
+    Returns:
+        None
+    """
+    global telemetry_since
+    samples = usrp.get_telemetry(since=telemetry_since)
+    if samples:
+        telemetry_since = samples[-1]["time"]
+        metrics.temperatures = {"fpga": samples[-1]["temp_fpga"], "tx": samples[-1]["temp_tx"]}
     log.add_entry(
         {
-            "event": f"{event}",
+            "event": "X410 telemetry",
             "config_number": config_number,
-            "p2p_parent_attn": p2p_parent_attn.attenuation_setting,
-            "p2p_child_attn": p2p_child_attn.attenuation_setting,
-            "noise_diode_attn": noise_diode_attn.attenuation_setting,
-            "interferer_attn": interferer_attn.attenuation_setting,
+            "samples": samples,
         }
     )
 
 
-def write_x410_log(config_number):
-    """Write log with meta information of X410
+def write_power_log(config_number):
+    """Write the power supply samples of a config to its *_power.json file
+    and log their ranges and any supply faults
 
-    Args: 
-        config_number (Int): the configuration number when the logging occured
+    Args:
+        config_number (Int): the configuration number the samples belong to
 
     Returns:
         None
     """
+    samples = power_sampler.write(
+        config_number, Path(local_directory, f"{config_number}_power.json")
+    )
+    summary = summarize(samples, testbed_config["power_supply_config"])
+    for fault in summary["faults"]:
+        print(f"power supply fault in config {config_number}: {fault}")
     log.add_entry(
-            {
-            "event": "X410 Ouput parameters",
+        {
+            "event": "power supply",
             "config_number": config_number,
-            "RF Output": usrp.query_rf(),
-            "Playback WV": usrp.playback_wv_file,
-            "Set power output": set_power,
-            "Reported power output": usrp.rf_output_power,
-            "Center Freq": usrp.center_freq,
-            "x410 temp": usrp.get_temp(),
-            }
+            "read_errors": power_sampler.errors,
+            **summary,
+        }
     )
 
 
-def shell_run_mcs_iperf(test_config, run_directory, local_directory):
-    """Use the labbench concurrently functionality to run the MCS acquisition script
-    and the iperf acquisition script
-    
+def write_device_io_log(config_number):
+    """Log the tail latencies, retries and reconnects of the device
+    operations of a config
+
     Args:
-        test_config (String):  the configuration number of the test
-        run_directory (String):  the remote directory where the files are stored
-        local_directory (Path):  the local directory to store the files
-    
+        config_number (Int): the configuration number the operations belong to
+
+    Returns:
+        None
+    """
+    operations = device_io.take(config_number)
+    metrics.device_io = {"config": config_number, "operations": operations}
+    log.add_entry({"event": "device io", "config_number": config_number, "operations": operations})
+
+
+def sync_clocks(event):
+    """Measure the device clock offsets and save them to the meta directory
+
+    Args:
+        event (String): why the offsets are measured, e.g. "start"
+
+    Returns:
+        None
+    """
+    measurement = clock_sync.measure(event)
+    clock_sync.save(Path(local_directory, "meta", "clock_sync.json"))
+    offsets = ", ".join(
+        f"{clock} {1000 * offset['uncertainty']:.1f} ms" for clock, offset in measurement["clocks"].items()
+    )
+    print(f"clock offsets measured, uncertainty {offsets}")
+
+
+def prepare_stage(test_config, context):
+    """Campaign stage that readies the interferer and the iperf server
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+
+    Returns:
+        None
+    """
+    global previous_wv
+    context["start_time"] = time.time()
+    checkpoint.start_config(test_config["config"])
+    metrics.start_config(test_config["config"], context["start_time"])
+    #power supply samples from now on belong to this config
+    power_sampler.config = test_config["config"]
+    #so do device operations of threads the scheduler did not tag
+    device_io.config = test_config["config"]
+    #if the wv_file is in the test config make sure correct waveform is playing
+    if 'wv_file' in test_config:
+        current_wv = test_config['wv_file']
+        if current_wv != previous_wv:
+            usrp.playback_wv_file = staged_wv.get(current_wv, current_wv)
+            previous_wv = current_wv
+            write_x410_log(test_config['config'])
+    #make sure the power is on
+    if not usrp.query_rf():
+        raise Exception("RF output is not on, check interferer")
+    print('starting next config')
+    #refresh the clock offsets once the period has passed
+    last_sync = clock_sync.measurements[-1]["host_time"]
+    if time.time() - last_sync > testbed_config["clock_sync_config"]["period"]:
+        sync_clocks("periodic")
+    #reuse the running iperf server, it is only restarted if the probe fails
+    server_state = p2p_link.ensure_iperf_server(interval=test_config["interval"])
+    if server_state["restarted"]:
+        log.add_entry({**server_state, "config_number": test_config["config"]})
+
+
+def settle_stage(test_config, context):
+    """Campaign stage that sets the attenuators and runs the settle iperfs
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+
     Returns:
         None
     """
-    #Look for and kill stale servers
-    p2p_link.find_kill_iperf_server()
-    #Start a new server
-    p2p_link.start_child_iperf_server(interval=test_config["interval"])
     #create a configuration for the settle time, and run it.
     settle_config = deepcopy(test_config)
     settle_config["test_time"] = settle_config["start_settle_time"]
     settle_config["config"] = str(settle_config["config"]) + "s"
     set_channel_attenuation(settle_config, test_config)
+    context["settle_config"] = settle_config
+
+
+def measure_stage(test_config, context):
+    """Campaign stage that uses the labbench concurrently functionality to
+    run the MCS acquisition script and the iperf acquisition script
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+
+    Returns:
+        None
+    """
+    #a stop file of an earlier attempt at this config would end the MCS loop at once
+    stdin, stdout, stderr = p2p_link.run_command(
+        p2p_link.ssh_p2p_parent, f"rm -f {run_directory}/{test_config['config']}.stop"
+    )
+    p2p_link.check_stderr(stderr)
+    #the calls run on new threads, their spans are tagged with this config
+    config = test_config["config"]
+    if adaptive_enabled(test_config):
+        measurement = lb.Call(with_config(config, measure_iperf_adaptive), test_config, context)
+    else:
+        measurement = lb.Call(with_config(config, p2p_link.run_iperf), test_config, run_directory)
+    calls = [lb.Call(with_config(config, p2p_link.run_mcsloop), test_config, run_directory), measurement]
+    #round trip probes run next to the stream if the runner row asks for them
+    probes = ping_settings(test_config)
+    if probes is not None:
+        calls.append(lb.Call(with_config(config, measure_ping), test_config, context, *probes))
     #call the iperf and mcs measurements on the remote device.
-    lb.concurrently(
-        lb.Call(p2p_link.run_mcsloop, test_config, run_directory),
-        lb.Call(p2p_link.run_iperf, test_config, run_directory),
+    lb.concurrently(*calls)
+    #samples after the measurement belong to no config, this one persists them
+    power_sampler.config = None
+    # read now, the next config changes the attenuators while this one persists
+    context["after_test"] = attenuator_state()
+
+
+def measure_iperf_adaptive(test_config, context):
+    """Run the measurement iperf until its stop criterion is met and end the
+    MCS loop with it
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+
+    Returns:
+        None
+    """
+    result = p2p_link.run_iperf_adaptive(
+        test_config, run_directory, measurement_criterion(test_config)
     )
+    if result["reason"] in ("converged", "link_down"):
+        #mcs_loop.sh checks for this file every loop
+        p2p_link.run_command(
+            p2p_link.ssh_p2p_parent,
+            f"touch {run_directory}/{test_config['config']}.stop"
+        )
+    context["adaptive_measurement"] = result
+
+
+def measure_ping(test_config, context, interval, size):
+    """Probe the round trip time of the link for the measurement window
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+        interval (float):  seconds between probes
+        size (Int):  payload bytes of every probe
+
+    Returns:
+        None
+    """
+    context["ping"] = p2p_link.run_ping(test_config, interval, size)
+
+
+def collect_stage(test_config, context):
+    """Campaign stage that moves the data of this config off the radio
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+
+    Returns:
+        None
+    """
+    settle_config = context["settle_config"]
     #if there was a settle measurement move that data, move the remainder of the data
     if settle_config["start_settle_time"] != 0:
         print("moving settle")
@@ -96,6 +340,62 @@ def shell_run_mcs_iperf(test_config, run_directory, local_directory):
     move_data_files("mcs", test_config, run_directory, local_directory)
     print("moving test")
     move_data_files("iperf", test_config, run_directory, local_directory)
+    if "ping" in context:
+        #the replies were parsed on the host as they arrived
+        context["ping_summary"] = context["ping"].write(
+            Path(local_directory, f'{test_config["config"]}_ping.json')
+        )
+    metrics.record_config_data(
+        test_config["config"],
+        Path(local_directory, f'{test_config["config"]}_iperf.json'),
+    )
+
+
+def persist_stage(test_config, context):
+    """Campaign stage that writes the log entries of this config
+
+    Args:
+        test_config (dict):  the test condition row from the runner
+        context (dict):  state shared by the stages of this config
+
+    Returns:
+        None
+    """
+    write_log("after_test", test_config["config"], state=context["after_test"])
+    if "adaptive_measurement" in context:
+        log.add_entry(
+            {
+                "event": "adaptive measurement",
+                "config_number": test_config["config"],
+                **context["adaptive_measurement"],
+            }
+        )
+    if "ping_summary" in context:
+        log.add_entry(
+            {
+                "event": "ping",
+                "config_number": test_config["config"],
+                "mode": measurement_mode(test_config),
+                **context["ping_summary"],
+            }
+        )
+    write_telemetry_log(test_config["config"])
+    write_power_log(test_config["config"])
+    write_device_io_log(test_config["config"])
+    checkpoint.complete_config(test_config["config"])
+    catalog.complete_config(local_directory.name, test_config["config"], test_config)
+    metrics.completed += 1
+    print(f"test config {test_config['config']} took "
+          f"{int(time.time()-context['start_time'])} seconds")
+
+
+campaign_stages = {
+    "prepare": prepare_stage,
+    "settle": settle_stage,
+    "measure": measure_stage,
+    "collect": collect_stage,
+    "persist": persist_stage,
+}
 
 
 def set_channel_attenuation(settle_conf, in_config):
@@ -108,23 +408,61 @@ def set_channel_attenuation(settle_conf, in_config):
     """
 
     write_log("before_start_settle", settle_conf["config"])
-    p2p_parent_attn.attenuation_setting = settle_conf["start_p2p_parent_attn"]
-    noise_diode_attn.attenuation_setting = settle_conf["start_noise_diode_attn"]
-    interferer_attn.attenuation_setting = settle_conf["start_interferer_attn"]
-    p2p_child_attn.attenuation_setting = settle_conf["start_p2p_child_attn"]
+    set_attenuators("start", settle_conf)
     if settle_conf["test_time"] != 0:
-        p2p_link.run_iperf(settle_conf, run_directory)
+        run_settle_iperf(settle_conf, in_config, "start")
     write_log("after_start_settle", in_config["config"])
-    p2p_parent_attn.attenuation_setting = in_config["test_p2p_parent_attn"]
-    noise_diode_attn.attenuation_setting = in_config["test_noise_diode_attn"]
-    interferer_attn.attenuation_setting = in_config["test_interferer_attn"]
-    p2p_child_attn.attenuation_setting = in_config["test_p2p_child_attn"]
+    set_attenuators("test", in_config)
     settle_conf["test_time"] = settle_conf["test_settle_time"]
     if settle_conf["test_time"] != 0:
-        p2p_link.run_iperf(settle_conf, run_directory)
+        run_settle_iperf(settle_conf, in_config, "test")
     write_log("after_test_settle", in_config["config"])
 
 
+def set_attenuators(phase, conf):
+    """Write the start or test attenuator settings of a runner row and log
+    the values written
+
+    Args:
+        phase (String):  "start" or "test" columns of the runner
+        conf (dict):  the runner row
+    """
+    settings = {}
+    for name, attenuator in (
+        ("p2p_parent_attn", p2p_parent_attn),
+        ("noise_diode_attn", noise_diode_attn),
+        ("interferer_attn", interferer_attn),
+        ("p2p_child_attn", p2p_child_attn),
+    ):
+        setting = conf[f"{phase}_{name}"]
+        with span("attenuator write", "attenuator", attenuator=name, setting=setting):
+            attenuator.attenuation_setting = setting
+        settings[name] = setting
+    #settle intervals take the attenuations from the log, see dataset.py
+    write_log(f"set_{phase}_attenuators", conf["config"], state=settings)
+    metrics.attenuators = settings
+
+
+def run_settle_iperf(settle_conf, in_config, phase):
+    """Run a settle iperf window, ending it early once the link is stable if
+    the runner row asks for adaptive windows
+
+    Args:
+        settle_conf (dict):  a dictionary for running the settling test
+        in_config (dict):  a dictionary for the primary test
+        phase (String):  "start" or "test" settle window
+    """
+    if adaptive_enabled(in_config):
+        result = p2p_link.run_iperf_adaptive(
+            settle_conf, run_directory, settle_criterion(in_config, phase)
+        )
+        log.add_entry(
+            {"event": f"adaptive {phase} settle", "config_number": in_config["config"], **result}
+        )
+    else:
+        p2p_link.run_iperf(settle_conf, run_directory)
+
+
 def move_data_files(datastream, test_config, run_directory, local_directory):
     """Uses paramiko ssh connection to move data files generated on the p2p link to a local directory
     
@@ -138,20 +476,41 @@ def move_data_files(datastream, test_config, run_directory, local_directory):
         None.
     """
     remote_file = run_directory + rf'/{test_config["config"]}_{datastream}.json'
-    local_file = str(local_directory) + rf'\{test_config["config"]}_{datastream}.json'
-    p2p_link.sftp_p2p_parent.get(remote_file, local_file)
-    print(remote_file + " moved.")
-    stdin, stdout, stderr = p2p_link.ssh_p2p_parent.exec_command(f"rm -f {remote_file}")
+    local_file = str(Path(local_directory, f'{test_config["config"]}_{datastream}.json'))
+    # settle data belongs to the config it settles, "3s" -> "3"
+    transfer_file(remote_file, local_file, str(test_config["config"]).rstrip("s"))
+
+
+def transfer_file(remote_file, local_file, config):
+    """Moves a single data file off the p2p link and records it in the checkpoint
+
+    The remote file is only removed once the local copy matches its digest
+    and the digest of the local file as kept is in the checkpoint.
+
+    Args:
+        remote_file (String):  path of the file on the remote machine
+        local_file (String):  path to store the file on the local machine
+        config (String):  the configuration number the file belongs to
+
+    Returns:
+        None.
+    """
+    checkpoint.start_transfer(remote_file, local_file, config)
+    details = p2p_link.fetch_file(remote_file, local_file)
+    print(f"{remote_file} moved, {details['transferred']} of {details['size']} bytes transferred.")
     # prematurely stopped files will be malformed json, clean up.
-    with open(local_file, "r") as fh:
-        print(f"reading {local_file}")
-        file_contents = fh.read()
-        new_file_contents = file_contents
-        if file_contents.strip()[-1] == ",":
-            new_file_contents = file_contents.strip()[:-1] + "\n]"
-            with open(local_file, "w") as nfh:
-                nfh.write(new_file_contents)
-                print(f"writing nfh {local_file}")
+    if close_truncated_array(local_file):
+        print(f"closed the array of {local_file}")
+    # the digest is of the file as kept, which differs from the radio copy once closed
+    checkpoint.record_transfer(
+        local_file,
+        size=os.path.getsize(local_file),
+        md5=file_md5(local_file),
+        remote_md5=details["md5"],
+        transferred=details["transferred"],
+    )
+    stdin, stdout, stderr = p2p_link.run_command(p2p_link.ssh_p2p_parent, f"rm -f {remote_file}")
+    checkpoint.finish_transfer(local_file)
 
 
 def initiate_run(test_conditions_filepath):
@@ -160,33 +519,118 @@ def initiate_run(test_conditions_filepath):
     - Pulling the name of the run from the input file
     - Creating a run directory
     - Copying the csv & yaml & config to the meta directory
-    - Pulling in the test runner as a dataframe
+    - Pulling in the test runner as a dataframe, or generating it from the
+      sweep of the experiment yaml
     - Creating a 'remaining' tests frame
     - Logging that the run was initiated
+    - Registering the run in the catalog of the local data root
 
     Args:
-        test_conditions_filepath (Path): *.csv file containing test conditions
+        test_conditions_filepath (Path): *.csv file containing test conditions, or
+            the experiment *.yaml of a run defined by a sweep
 
     Returns:
-        test_runner (List): List of test condition dictionaries
+        test_runner (List): List of test condition dictionaries, a SweepRunner
+            that generates them for a sweep
         run_directory (Path): filepath on the DUT
         local_directory (Path): data storage path on the local system
     """
     #getting the name of the run based on the testconditions .csv file
     run_name = Path(test_conditions_filepath).stem
+    yaml_file = Path(test_conditions_filepath).with_suffix(".yaml")
+    #a sweep in the metadata replaces the run sheet, validated before anything is created
+    sweep = Sweep.from_yaml(yaml_file)
     local_directory, meta_directory, run_directory = create_run_directory(run_name)
-    #Copying the run sheet to the meta folder
-    shutil.copy(test_conditions_filepath, str(meta_directory) + "\\test_conditions.csv")
     #capturing the experimental metadata file and moving it to the data folder
-    yaml_file = Path(test_conditions_filepath).with_suffix(".yaml")
-    shutil.copy(yaml_file, str(meta_directory) + "\\experiment_metadata.yaml")
+    shutil.copy(yaml_file, Path(meta_directory, "experiment_metadata.yaml"))
     #capturing the testbed physical component configurations
-    with open(str(meta_directory) + "\\testbed_config.py", "w") as dict_file:
+    with open(Path(meta_directory, "testbed_config.py"), "w") as dict_file:
         json.dump(testbed_config, dict_file, indent=4)
-    #reading the runsheet into memory as a list of dictionaries
-    test_runner = pd.read_csv(test_conditions_filepath, keep_default_na=False).to_dict(
-        "records"
+    if sweep is None:
+        #Copying the run sheet to the meta folder
+        shutil.copy(test_conditions_filepath, Path(meta_directory, "test_conditions.csv"))
+        #reading the runsheet into memory as a list of dictionaries
+        import pandas as pd
+
+        test_runner = pd.read_csv(test_conditions_filepath, keep_default_na=False).to_dict(
+            "records"
+        )
+    else:
+        #generating the configs as they run, recording them to the meta folder
+        test_runner = SweepRunner(sweep, Path(meta_directory, "test_conditions.csv"))
+        print(f"{sweep.method} sweep of {len(sweep)} configs from a space of {sweep.size}")
+    catalog.register_run(local_directory)
+    return test_runner, run_directory, local_directory
+
+
+def resume_run(local_directory):
+    """
+    Resume an interrupted run by:
+    - Reading the checkpoint and the runner from the meta directory
+    - Making sure the remote run directory still exists
+    - Re-verifying the files whose transfer did not finish
+    - Removing partial remote data of configs that were in progress
+    - Dropping the completed configs from the runner
+    - Refreshing the run in the catalog of the local data root
+
+    Args:
+        local_directory (Path): data storage path of the interrupted run
+
+    Returns:
+        test_runner (List): List of the remaining test condition dictionaries
+        run_directory (Path): filepath on the DUT
+        local_directory (Path): data storage path on the local system
+    """
+    local_directory = Path(local_directory)
+    meta_directory = Path(local_directory, "meta")
+    run_directory = checkpoint.run_directory
+    stdin, stdout, stderr = p2p_link.run_command(
+        p2p_link.ssh_p2p_parent,
+        f"mkdir -p {run_directory}"
     )
+    p2p_link.check_stderr(stderr)
+    #re-verify files that were being moved when the run stopped
+    for local_file, record in checkpoint.unfinished_transfers().items():
+        try:
+            p2p_link.sftp_p2p_parent.stat(record["remote"])
+        except FileNotFoundError:
+            #the remote copy is only removed after the digest of the local file was recorded
+            if Path(local_file).exists() and "md5" in record:
+                close_truncated_array(local_file)
+                if file_md5(local_file) == record["md5"]:
+                    checkpoint.finish_transfer(local_file)
+                    continue
+                print(f"{local_file} does not match its recorded digest")
+            checkpoint.reopen_config(record["config"])
+            continue
+        print(f"re-transferring {record['remote']}")
+        transfer_file(record["remote"], local_file, record["config"])
+    #iperf appends to its output, so clear partial data and stop files before measuring again
+    for config in checkpoint.in_progress():
+        stdin, stdout, stderr = p2p_link.run_command(
+            p2p_link.ssh_p2p_parent,
+            f"rm -f {run_directory}/{config}_* {run_directory}/{config}s_* {run_directory}/{config}.stop"
+        )
+        p2p_link.check_stderr(stderr)
+    sweep = Sweep.from_yaml(Path(meta_directory, "experiment_metadata.yaml"))
+    if sweep is not None and not checkpoint.state["config_order"]:
+        #regenerating the remaining configs of the sweep
+        test_runner = SweepRunner(
+            sweep, Path(meta_directory, "test_conditions.csv"), checkpoint.state["completed_configs"]
+        )
+    else:
+        #a run sheet, or a planned sweep that recorded every config when it was planned
+        import pandas as pd
+
+        test_runner = pd.read_csv(
+            Path(meta_directory, "test_conditions.csv"), keep_default_na=False
+        ).to_dict("records")
+        if checkpoint.state["config_order"]:
+            order = checkpoint.state["config_order"]
+            test_runner.sort(key=lambda row: order.index(str(row["config"])))
+        test_runner = [row for row in test_runner if not checkpoint.is_complete(row["config"])]
+    catalog.register_run(local_directory)
+    print(f"resuming {run_directory} with {len(test_runner)} configs remaining")
     return test_runner, run_directory, local_directory
 
 
@@ -206,7 +650,8 @@ def create_run_directory(run_name):
     ts_str = folder_ts.strftime("%Y_%m_%d-%H_%M_%S")
     #make a sub directory under /data/ on the embedded device
     run_directory = "/data/" + run_name + "-" + ts_str
-    stdin, stdout, stderr = p2p_link.ssh_p2p_parent.exec_command(
+    stdin, stdout, stderr = p2p_link.run_command(
+        p2p_link.ssh_p2p_parent,
         f"mkdir {run_directory}"
     )
     p2p_link.check_stderr(stderr)
@@ -218,12 +663,76 @@ def create_run_directory(run_name):
     return local_directory, meta_directory, run_directory
 
 
+def open_instruments(simulate=False, **simulate_options):
+    """Instantiate and open the testbed instruments
+
+    Args:
+        simulate (bool): use the local stand-ins of simulators.py instead of
+            the hardware described in testbed_config
+        **simulate_options: SimulatedTestbed options such as time_scale and delays
+
+    Returns:
+        None
+    """
+    global p2p_link, p2p_parent_attn, p2p_child_attn, interferer_attn
+    global noise_diode_attn, power_supply, power_sampler, usrp, testbed, device_io
+    #deadlines and retries of every operation on the radios and the X410
+    device_io = IOPolicy(**testbed_config["io_config"])
+    if simulate:
+        from simulators import SimulatedTestbed
+        testbed = SimulatedTestbed(**simulate_options)
+        p2p_link = testbed.p2p_link(policy=device_io, **testbed_config["link_config"])
+        p2p_parent_attn = testbed.attenuator(**testbed_config["p2p_parent_attn_config"])
+        p2p_child_attn = testbed.attenuator(**testbed_config["p2p_child_attn_config"])
+        interferer_attn = testbed.attenuator(**testbed_config["interferer_attn_config"])
+        noise_diode_attn = testbed.attenuator(**testbed_config["noise_diode_attn_config"])
+        power_supply = testbed.power_supply(testbed_config["power_supply_config"]["resource"])
+        usrp = testbed.x410(freq=6.02e9, rf_power=5, policy=device_io)
+    else:
+        # the drivers load VISA and serial backends, only needed on the testbed
+        from ssmdevices.instruments import MiniCircuitsRCDAT, RigolDP800Series
+
+        testbed = None
+        p2p_link = P2PLink(policy=device_io, **testbed_config["link_config"])
+        p2p_parent_attn = MiniCircuitsRCDAT(**testbed_config["p2p_parent_attn_config"])
+        p2p_child_attn = MiniCircuitsRCDAT(**testbed_config["p2p_child_attn_config"])
+        interferer_attn = MiniCircuitsRCDAT(**testbed_config["interferer_attn_config"])
+        noise_diode_attn = MiniCircuitsRCDAT(**testbed_config["noise_diode_attn_config"])
+        power_supply = RigolDP800Series(testbed_config["power_supply_config"]["resource"])
+        usrp = UsrpX410(freq=6.02e9, rf_power=5, policy=device_io)
+    #opening instruments
+    power_supply.open()
+    #control calls go through power_sampler.query to share the instrument with it
+    power_sampler = PowerSampler(
+        power_supply,
+        channels=testbed_config["power_supply_config"]["sample_channels"],
+        period=testbed_config["power_supply_config"]["sample_period"],
+    )
+    p2p_parent_attn.open()
+    p2p_child_attn.open()
+    noise_diode_attn.open()
+    interferer_attn.open()
+
+
+def close_instruments():
+    """Close the instruments and the device connections once the test is over"""
+    p2p_parent_attn.close()
+    p2p_child_attn.close()
+    noise_diode_attn.close()
+    interferer_attn.close()
+    p2p_link.close()
+    usrp.close()
+    power_supply.close()
+
+
 def set_x410_playback(enable, usrp_obj, power_set):
     """Setup x410 for playback"""
     if enable:
         usrp.center_freq = 6.02e9
         usrp.rf_output_power = power_set
-        usrp.playback_wv_file = "/data/wv_files/pulsedWN_100mson_100msoff.wv"
+        #a waveform left by the previous campaign stays loaded
+        if usrp.playback_wv_file == "None":
+            usrp.playback_wv_file = "/data/wv_files/pulsedWN_100mson_100msoff.wv"
         usrp.start_wv()
         print("x410 enabled")
     else:
@@ -231,59 +740,134 @@ def set_x410_playback(enable, usrp_obj, power_set):
         print("X410 disabled")
 
 
-if __name__ == "__main__":
-    log = Log()
-    #User input of the test to run
-    test_conditions_filepath = (
-        r"C:\Users\Public\Documents\Local_Queue\test_conditions_WNpulse100ms_equal.csv"
-    )     
-    #User input to the power of the X410
-    set_power = 5
+def run_campaign(
+    test_conditions_filepath,
+    resume=None,
+    reorder=False,
+    power=5,
+    data_root=None,
+    trace=False,
+    metrics_port=None,
+):
+    """Run every config of a runner, or the remaining configs of an
+    interrupted run, on the opened instruments
+
+    Args:
+        test_conditions_filepath (Path): *.csv file containing test conditions, or
+            the experiment *.yaml of a run defined by a sweep
+        resume (Path): local data directory of an interrupted run to resume
+        reorder (bool): reorder the runner to minimize transition time
+        power (float): X410 output power
+        data_root (Path): root directory for data storage, defaults to testbed_config
+        trace (bool): record spans of every testbed operation to meta/trace.jsonl
+        metrics_port (int): serve live metrics of the campaign on this port
+
+    Returns:
+        campaign_report (dict): per-stage timing report of the scheduler
+    """
+    global log, checkpoint, catalog, clock_sync, run_directory, local_directory, local_data_root
+    global set_power, previous_wv, telemetry_since, staged_wv, last_clock_sync
+    set_power = power
     #pulling in root directory for data storage
-    local_data_root = testbed_config["filepaths"]["local_data_root"]
-    #instantiating instruments
-    p2p_link = P2PLink(**testbed_config["link_config"])
-    p2p_parent_attn = MiniCircuitsRCDAT(**testbed_config["p2p_parent_attn_config"])
-    p2p_child_attn = MiniCircuitsRCDAT(**testbed_config["p2p_child_attn_config"])
-    interferer_attn = MiniCircuitsRCDAT(**testbed_config["interferer_attn_config"])
-    noise_diode_attn = MiniCircuitsRCDAT(**testbed_config["noise_diode_attn_config"])
-    power_supply = RigolDP800Series(testbed_config["power_supply_config"]["resource"])
-    usrp = UsrpX410(freq=6.02e9, rf_power=5)
-    #opening instruments
-    power_supply.open()
-    p2p_parent_attn.open()
-    p2p_child_attn.open()
-    noise_diode_attn.open()
-    interferer_attn.open()
-    test_runner, run_directory, local_directory = initiate_run(test_conditions_filepath)
+    local_data_root = data_root or testbed_config["filepaths"]["local_data_root"]
+    Path(local_data_root).mkdir(parents=True, exist_ok=True)
+    catalog = Catalog.for_data_root(local_data_root)
+    if resume:
+        #reusing the directories, checkpoint and log of the interrupted run
+        checkpoint = Checkpoint(Path(resume, "meta", "checkpoint.json"))
+        log = SegmentedLog(Path(resume, "meta", "log"), **testbed_config["log_config"])
+        test_runner, run_directory, local_directory = resume_run(resume)
+        log.add_entry({"event": "resume", "remaining_configs": len(test_runner)})
+        reorder = False
+    else:
+        test_runner, run_directory, local_directory = initiate_run(test_conditions_filepath)
+        checkpoint = Checkpoint(
+            Path(local_directory, "meta", "checkpoint.json"), run_directory
+        )
+        #logging to rolling segments in the meta directory
+        log = SegmentedLog(Path(local_directory, "meta", "log"), **testbed_config["log_config"])
+    #exposing the progress of the campaign over http
+    metrics.start(local_directory.name, len(test_runner))
+    p2p_link.on_interval = metrics.record_interval
+    p2p_link.on_mcs_sample = metrics.record_mcs_sample
+    if metrics_port is not None:
+        metrics_server = MetricsServer(
+            metrics, metrics_port, host=testbed_config["metrics_config"]["host"]
+        )
+        print(f"serving live metrics on port {metrics_server.port}")
+    #copying the waveform files of the runner to the X410
+    if isinstance(test_runner, SweepRunner):
+        staged_wv = stage_wv_files(test_runner.sweep.summary()["waveforms"])
+    else:
+        staged_wv = stage_wv_files(str(row["wv_file"]) for row in test_runner if "wv_file" in row)
     #setting up X410 USRP for playback
     set_x410_playback(True, usrp, set_power)
-    #pointing log to meta directory
-    log.file_path = Path(local_directory, "meta", "log.yaml")
     #logging the information for the interferer
     previous_wv = usrp.playback_wv_file
     write_x410_log(0)
-    #running the test configs
-    for test_config in test_runner:
-        before = time.time()
-        #if the wv_file is in the test config make sure correct waveform is playing
-        if 'wv_file' in test_config:
-            current_wv = test_config['wv_file']
-            if current_wv != previous_wv:
-                usrp.playback_wv_file = current_wv
-                previous_wv = current_wv
-                write_x410_log(test_config['config'])
-        #make sure the power is on
-        if not usrp.query_rf():
-            raise Exception("RF output is not on, check interferer")
-        print('starting next config')
-        #running the performance test 
-        shell_run_mcs_iperf(test_config, run_directory, local_directory)
-        write_log("after_test", test_config["config"])
-        print(f"test config took {int(time.time()-before)} seconds")
-    #closing all the instruments once the test is over
-    p2p_parent_attn.close()
-    p2p_child_attn.close()
-    noise_diode_attn.close()
-    interferer_attn.close()
-    set_x410_playback(False, usrp, set_power)
+    telemetry_since = 0
+    #measuring the device clock offsets, continuing those of an interrupted run
+    clock_sync = ClockSync(
+        p2p_link,
+        usrp,
+        samples=testbed_config["clock_sync_config"]["samples"],
+        spacing=testbed_config["clock_sync_config"]["spacing"],
+    )
+    clock_sync.load(Path(local_directory, "meta", "clock_sync.json"))
+    previous_sync = last_clock_sync
+    reuse_age = testbed_config["clock_sync_config"]["reuse_age"]
+    if not resume and previous_sync and time.time() - previous_sync["host_time"] < reuse_age:
+        #back to back campaigns of the queue daemon, the last offsets are still current
+        clock_sync.measurements.append({**previous_sync, "event": "start", "reused": True})
+        clock_sync.save(Path(local_directory, "meta", "clock_sync.json"))
+        print("clock offsets of the previous campaign reused")
+    else:
+        sync_clocks("resume" if resume else "start")
+    if reorder:
+        test_runner, plan = plan_configs(
+            test_runner, testbed_config["planner_config"], initial_wv=previous_wv
+        )
+        log.add_entry({"event": "planned config order", **plan})
+        checkpoint.set_config_order(plan["config_order"])
+        if plan["reordered"]:
+            print(f"planned order predicted to save {plan['predicted_saving']} seconds")
+        else:
+            print("no planned order is faster, the configs run in file order")
+    #running the test configs, collecting each config while the next one settles
+    scheduler = CampaignScheduler(campaign_stages, overlap=True)
+    if trace:
+        tracer.enable()
+    power_sampler.start()
+    try:
+        campaign_report = scheduler.run(test_runner)
+    finally:
+        power_sampler.stop()
+        power_sampler.config = None
+        device_io.config = None
+        if trace:
+            tracer.disable()
+            tracer.save(Path(local_directory, "meta", "trace.jsonl"))
+        if metrics_port is not None:
+            metrics_server.close()
+    sync_clocks("end")
+    last_clock_sync = clock_sync.measurements[-1]
+    #operations outside of the configs, e.g. clock syncs and file staging
+    campaign_report["device_io"] = device_io.take(None)
+    log.add_entry({"event": "campaign report", **campaign_report})
+    scheduler.print_report()
+    if reorder:
+        evaluation = evaluate_plan(plan, test_runner, scheduler.records)
+        log.add_entry({"event": "planned config order evaluation", **plan, **evaluation})
+        print(f"planned order saved an estimated {evaluation['estimated_actual_saving']} seconds")
+    #merging the log segments into meta/log.yaml
+    log.compact()
+    return campaign_report
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
+
+    # python test_link_x410.py RUNNER.csv [options] is the same as atic run
+    main(["run", *sys.argv[1:]])
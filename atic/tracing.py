@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Span tracing of testbed operations.
+
+Every SSH command, SFTP transfer, attenuator write, X410 round trip and
+log save is recorded as a span with its start time, duration, thread and
+the config number the thread is working on.  Tracing is off by default;
+span() then returns a shared no-op context manager so the instrumented
+code pays a single attribute check.
+
+Spans are saved to a compact json lines file, one array per span, which
+can be converted to the Chrome trace event format read by chrome://tracing
+and Perfetto.  Each config becomes its own process in the exported trace
+so the spans are grouped by config:
+
+    python tracing.py meta/trace.jsonl trace.json
+"""
+
+import functools
+import json
+import sys
+import threading
+import time
+
+TRACE_FIELDS = ["name", "category", "start_ns", "duration_ns", "thread", "config", "args"]
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        tracer = self.tracer
+        tracer.spans.append(
+            (
+                self.name,
+                self.category,
+                self.start - tracer.origin_ns,
+                end - self.start,
+                threading.get_ident(),
+                getattr(tracer.local, "config", None),
+                self.args,
+            )
+        )
+        return False
+
+
+class Tracer:
+    """Collects spans in memory until they are saved"""
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.local = threading.local()
+        self.origin_ns = time.perf_counter_ns()
+        self.origin_time = time.time()
+
+    def enable(self):
+        """Start recording spans, clears previously recorded spans"""
+        self.spans = []
+        self.origin_ns = time.perf_counter_ns()
+        self.origin_time = time.time()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def set_config(self, config):
+        """Tag the spans of the calling thread with a config number"""
+        self.local.config = None if config is None else str(config)
+
+    def span(self, name, category="atic", **args):
+        """Context manager recording a span, a no-op while tracing is off"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def save(self, file_path):
+        """Write the recorded spans as compact json lines
+
+        The first line holds the field names and the wall clock time of the
+        trace origin, every other line is one span.
+        """
+        spans = list(self.spans)
+        with open(file_path, "w") as out_file:
+            out_file.write(json.dumps({"fields": TRACE_FIELDS, "origin_time": self.origin_time}) + "\n")
+            for span_record in spans:
+                out_file.write(json.dumps(span_record, separators=(",", ":"), default=str) + "\n")
+        return file_path
+
+
+tracer = Tracer()
+
+
+def span(name, category="atic", **args):
+    """Record a span on the module tracer, see Tracer.span"""
+    if not tracer.enabled:
+        return NULL_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def traced(name, category="atic"):
+    """Decorator recording every call of a function as a span"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with _Span(tracer, name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def with_config(config, function):
+    """Wrap a function handed to another thread so that its spans are tagged
+    with the config of the caller"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        tracer.set_config(config)
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def load_trace(file_path):
+    """Read a compact trace file
+
+    Returns:
+        header (dict): field names and origin_time
+        spans (List): one dictionary per span
+    """
+    with open(file_path, "r") as in_file:
+        header = json.loads(in_file.readline())
+        spans = [dict(zip(header["fields"], json.loads(line))) for line in in_file if line.strip()]
+    return header, spans
+
+
+def export_chrome(trace_path, output_path):
+    """Convert a compact trace file to the Chrome trace event format
+
+    Args:
+        trace_path (Path): compact trace written by Tracer.save
+        output_path (Path): json file for chrome://tracing or Perfetto
+    """
+    header, spans = load_trace(trace_path)
+    processes = {None: 0}
+    events = []
+    for record in spans:
+        config = record["config"]
+        if config not in processes:
+            processes[config] = len(processes)
+        events.append(
+            {
+                "name": record["name"],
+                "cat": record["category"],
+                "ph": "X",
+                "ts": record["start_ns"] / 1e3,
+                "dur": record["duration_ns"] / 1e3,
+                "pid": processes[config],
+                "tid": record["thread"],
+                "args": record["args"],
+            }
+        )
+    for config, pid in processes.items():
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "campaign" if config is None else f"config {config}"},
+            }
+        )
+        events.append({"name": "process_sort_index", "ph": "M", "pid": pid, "args": {"sort_index": pid}})
+    with open(output_path, "w") as out_file:
+        json.dump({"traceEvents": events, "otherData": {"origin_time": header["origin_time"]}}, out_file)
+    return output_path
+
+
+if __name__ == "__main__":
+    export_chrome(sys.argv[1], sys.argv[2])
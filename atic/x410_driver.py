@@ -5,9 +5,23 @@ used by the p2p interference testbed.
 
 __author__ = "jlb20"
 
+import hashlib
+import json
+import os
 import socket
+import threading
 from time import sleep
 
+from io_policy import IOPolicy
+from tracing import span
+
+# wv_file values with this prefix are waveform specs synthesized on the X410
+SYNTH_PREFIX = "synth:"
+# bytes per wv_chunk command, one round trip each
+PUSH_CHUNK = 1 << 20
+# seconds the stop sent when the driver is collected may wait for its answer
+STOP_ON_DELETE_TIMEOUT = 1.0
+
 
 class UsrpX410:
     """
@@ -16,13 +30,99 @@ class UsrpX410:
     Requires setup on X410, seen here on this repository https://github.com/jordanbe-nist/uhd-wv-playback
     """
 
-    def __init__(self, usrp_ip_addr="10.0.0.47", freq=2.4e6, rf_power=-40):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((usrp_ip_addr, 9999))  # TODO consider port as variable
+    def __init__(self, usrp_ip_addr="10.0.0.47", freq=2.4e6, rf_power=-40, port=9999, policy=None):
+        self.address = (usrp_ip_addr, port)
+        # deadlines and retries of the commands, see io_policy.py
+        self.policy = policy or IOPolicy()
+        self.sock = None
+        self.connect()
+        # serializes command/response pairs when called from several threads
+        self._lock = threading.Lock()
+        # last frequency, power, waveform and playback commands, sent again
+        # after a reconnect
+        self._session = {}
 
         self.rf_output_power = rf_power
         self.center_freq = freq
         self.wv_file = None
+        # (path, size, mtime) of pushed local files -> path on the X410
+        self._pushed = {}
+
+    def connect(self):
+        """Open the connection to the server within the connect deadline,
+        with keepalive probes while it is idle
+        """
+        sock = socket.create_connection(self.address, timeout=self.policy.deadline("connect"))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(int(self.policy.heartbeat), 1))
+        self.sock = sock
+
+    def reconnect(self, attempt=1):
+        """Open the connection again and restore the session
+
+        A timed out command may still answer on the old connection, so a new
+        one is always opened.  The server may have restarted with its
+        defaults, so the frequency, power and waveform last set are sent
+        again and playback is resumed if it was on.
+
+        Args:
+            attempt (Int): the retry about to be made
+        """
+        print(f"reconnecting to the X410 at {self.address[0]}")
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.connect()
+        for key in ("freq", "power", "wv", "start"):
+            command = self._session.get(key)
+            if command is not None:
+                kind = "x410_load" if key == "wv" else "x410"
+                self._exchange(command, timeout=self.policy.deadline(kind))
+
+    def _exchange(self, command, terminator=None, payload=None, timeout=None):
+        """Send a command and read its response once, without retries
+
+        Raises:
+            OSError: if the connection fails or no response arrives in time
+        """
+        self.sock.settimeout(timeout)
+        self.sock.sendall(bytes(f"{command}\n", "utf-8"))
+        if payload is not None:
+            self.sock.sendall(payload)
+        data = self.sock.recv(1024)
+        if not data:
+            raise ConnectionError(f"X410 closed connection during {command}")
+        while terminator is not None and not data.endswith(terminator):
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError(f"X410 closed connection during {command}")
+            data += chunk
+        return data
+
+    def _query(self, command, terminator=None, payload=None, kind="x410"):
+        """Send a command to the server and return its response
+
+        A command without a response within its deadline is sent again on a
+        new connection, following the I/O policy.
+
+        Args:
+            command (str): command string without the trailing newline
+            terminator (bytes): if set, keep reading until the response ends with it
+            payload (bytes): raw data sent right after the command line
+            kind (str): deadline of the command, "x410" or "x410_load"
+
+        Returns:
+            str: decoded response from the server
+        """
+        with self._lock, span("x410 query", "x410", command=command):
+            data = self.policy.call(
+                "x410 query",
+                lambda: self._exchange(command, terminator, payload, self.policy.deadline(kind)),
+                reconnect=self.reconnect,
+            )
+        return str(data, "utf-8")
 
     @property
     def center_freq(self):
@@ -31,8 +131,7 @@ class UsrpX410:
         Returns:
             float: center frequency in Hz
         """
-        self.sock.sendall(bytes("freq=?\n", "utf-8"))
-        self._center_freq = float(str(self.sock.recv(1024), "utf-8"))
+        self._center_freq = float(self._query("freq=?"))
         return self._center_freq
 
     @center_freq.setter
@@ -45,52 +144,126 @@ class UsrpX410:
             None.
         """
         self._center_freq = frequency
-        self.sock.sendall(bytes(f"freq={frequency}\n", "utf-8"))
+        self._session["freq"] = f"freq={frequency}"
         # TODO if _center_frequency != frequency: warn
-        self._center_freq = float(str(self.sock.recv(1024), "utf-8"))
+        self._center_freq = float(self._query(f"freq={frequency}"))
 
     @property
     def rf_output_power(self):
         """Getter for"""
-        self.sock.sendall(bytes("power=?\n", "utf-8"))
-        self._rf_power = float(str(self.sock.recv(1024), "utf-8"))
+        self._rf_power = float(self._query("power=?"))
         return self._rf_power
 
     @rf_output_power.setter
     def rf_output_power(self, power):
         self._rf_power = power
-        self.sock.sendall(bytes(f"power={power}\n", "utf-8"))
+        self._session["power"] = f"power={power}"
         # TODO if received power != sent power: warn or whatever
-        self._rf_power = float(str(self.sock.recv(1024), "utf-8"))
+        self._rf_power = float(self._query(f"power={power}"))
 
     # TODO add class methods for peak power (PEP), requires math on x410
 
     @property
     def playback_wv_file(self):
-        self.sock.sendall(bytes("wv_file=?\n", "utf-8"))
-        self._wv_file = str(self.sock.recv(1024), "utf-8")
+        self._wv_file = self._query("wv_file=?")
         return self._wv_file
 
     @playback_wv_file.setter
     def playback_wv_file(self, wv_file):
-        self.sock.sendall(bytes(f"wv_file={wv_file}\n", "utf-8"))
         # TODO handle bad file
-        self._wv_file = str(self.sock.recv(1024), "utf-8")
+        if str(wv_file).startswith(SYNTH_PREFIX):
+            # generated on the X410 instead of read from a file
+            command = f"synth={wv_file[len(SYNTH_PREFIX):]}"
+        else:
+            command = f"wv_file={wv_file}"
+        self._session["wv"] = command
+        self._wv_file = self._query(command, kind="x410_load")
+
+    def synthesize(self, kind, **params):
+        """Generate a waveform on the X410 and load it for playback
+
+        Args:
+            kind (str): "noise", "pulsed", "cw" or "multitone"
+            **params: waveform parameters, e.g. bandwidth=20e6, on=0.1, off=0.1,
+                see x410_server/wv_synth.py
+
+        Returns:
+            str: the playback waveform, "synth:" followed by the spec
+        """
+        spec = ",".join([kind] + [f"{name}={value}" for name, value in params.items()])
+        self.playback_wv_file = SYNTH_PREFIX + spec
+        if self._wv_file.startswith("Error"):
+            raise ValueError(self._wv_file)
+        return self._wv_file
+
+    def push_wv_file(self, local_file, chunk_size=PUSH_CHUNK):
+        """Upload a local waveform file to the content addressed store of the X410
+
+        Files are identified by the sha256 of their content, so a file the
+        X410 already holds is not sent again, an interrupted upload resumes
+        where it stopped, and the server verifies the digest before the file
+        can be loaded.  The offset the server expects is followed, so a chunk
+        sent again after its response was lost is not stored twice.
+
+        Args:
+            local_file (Path): .wv file on this computer
+            chunk_size (int): bytes sent per command
+
+        Returns:
+            str: path of the waveform on the X410, for playback_wv_file
+        """
+        stat = os.stat(local_file)
+        key = (str(local_file), stat.st_size, stat.st_mtime_ns)
+        if key in self._pushed:
+            return self._pushed[key]
+        digest = hashlib.sha256()
+        with open(local_file, "rb") as in_file:
+            for block in iter(lambda: in_file.read(1 << 20), b""):
+                digest.update(block)
+        digest = digest.hexdigest()
+        remote_file = self._query(f"wv_has={digest}")
+        if remote_file == "False":
+            offset = resumed = int(self._query(f"wv_stat={digest}"))
+            if offset > stat.st_size:
+                raise IOError(f"X410 holds {offset} bytes of {stat.st_size} byte file {local_file}")
+            with open(local_file, "rb") as in_file:
+                while offset < stat.st_size:
+                    in_file.seek(offset)
+                    block = in_file.read(chunk_size)
+                    response = self._query(
+                        f"wv_chunk={digest},{offset},{len(block)}", payload=block, kind="x410_load"
+                    )
+                    if response.startswith("Error: expected offset"):
+                        expected = int(response.split()[-1])
+                        if expected == offset or expected > stat.st_size:
+                            raise IOError(f"upload of {local_file} failed: {response}")
+                        offset = expected
+                    elif response.startswith("Error"):
+                        raise IOError(f"upload of {local_file} failed: {response}")
+                    else:
+                        offset = int(response)
+            remote_file = self._query(f"wv_commit={digest}", kind="x410_load")
+            if remote_file.startswith("Error"):
+                # a commit sent again after its response was lost finds no upload
+                stored = self._query(f"wv_has={digest}")
+                remote_file = remote_file if stored == "False" else stored
+            print(f"{local_file} pushed to the X410, {offset - resumed} bytes sent")
+        if remote_file.startswith("Error"):
+            raise IOError(f"upload of {local_file} failed: {remote_file}")
+        self._pushed[key] = remote_file
+        return remote_file
 
     def start_wv(self, duty=None):
-        if duty is None:
-            self.sock.sendall(bytes("start\n", "utf-8"))
-        else:
-             self.sock.sendall(bytes(f"start duty={duty}\n", "utf-8"))
-        print(str(self.sock.recv(1024), "utf-8"))
+        command = "start" if duty is None else f"start duty={duty}"
+        self._session["start"] = command
+        print(self._query(command))
 
     def stop_wv(self):
-        self.sock.sendall(bytes("stop\n", "utf-8"))
-        print(str(self.sock.recv(1024), "utf-8"))
+        self._session.pop("start", None)
+        print(self._query("stop"))
 
     def query_rf(self):
-        self.sock.sendall(bytes("rf out?\n", "utf-8"))
-        recv = str(self.sock.recv(1024), "utf-8")
+        recv = self._query("rf out?")
         if recv == "True":
             return True
         elif recv == "False":
@@ -99,12 +272,39 @@ class UsrpX410:
             raise ValueError
 
     def get_temp(self):
-        self.sock.sendall(bytes("temp=?\n", "utf-8"))
-        return str(self.sock.recv(1024), "utf-8")
+        return self._query("temp=?")
+
+    def get_device_time(self):
+        """Returns the system time of the X410 in seconds since the epoch"""
+        return float(self._query("time=?"))
+
+    def get_telemetry(self, since=0):
+        """Fetch the telemetry samples buffered on the server since a time
+
+        Args:
+            since (float): X410 timestamp, only newer samples are returned
+
+        Returns:
+            list: one dictionary per sample keyed by the server field names
+        """
+        data = self._query(f"telemetry since={since}", terminator=b"\n")
+        telemetry = json.loads(data)
+        return [dict(zip(telemetry["fields"], sample)) for sample in telemetry["samples"]]
+
+    def close(self):
+        """Close the connection to the server, playback is left as it is"""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
 
     def __del__(self):
-        # TODO: consider check on this
-        self.stop_wv()
+        # stop the interferer once, without retries, if the connection ever opened
+        if getattr(self, "sock", None) is None:
+            return
+        try:
+            self._exchange("stop", timeout=STOP_ON_DELETE_TIMEOUT)
+        except OSError:
+            pass
 
 
 if __name__ == "__main__":
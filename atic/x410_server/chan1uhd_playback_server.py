@@ -2,12 +2,24 @@ import socketserver
 import socket
 import time
 from uhd_play_wv import read_wv_file
+from wv_synth import synthesize
 import uhd
 from pathlib import Path
 import threading
 import logging
+import json
+import hashlib
+import os
+import re
+from collections import deque
 from subprocess import run
 
+TELEMETRY_FIELDS = ["time", "temp_fpga", "temp_tx", "power_ref", "rf_output"]
+# pushed waveforms are stored by the sha256 of their content
+WV_STORE = Path("/data/wv_files/by_hash")
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+MAX_CHUNK = 1 << 24
+
 
 def play_wv(event, buff_addr, buff_size, usrp_obj):
     replay_block = usrp_obj["replay"]
@@ -17,9 +29,12 @@ def play_wv(event, buff_addr, buff_size, usrp_obj):
     replay_block.stop(0)
 
 def load_wv(iq, usrp_obj):
+    return load_chunks([iq], iq.shape[-1], usrp_obj)
+
+def load_chunks(chunks, data_len, usrp_obj):
+    """Record sc16 chunks of data_len samples in total into the replay buffer"""
     replay_block = usrp_obj["replay"]
     tx_stream = usrp_obj["stream"]
-    data_len = iq.shape[-1]
     sample_size = 4  # Complex signed 16-bit is 32 bits per sample
     replay_buff_addr = 0
     replay_buff_size = data_len * sample_size
@@ -30,10 +45,70 @@ def load_wv(iq, usrp_obj):
     # Send iq data to replay block via tx stream
     tx_metadata = uhd.types.TXMetadata()
     # replay_buff_addr, replay_buff_size, replay_chan, time_spec, repeat
-    num_sent = tx_stream.send(server.iq, tx_metadata)
+    for chunk in chunks:
+        num_sent = tx_stream.send(chunk, tx_metadata)
     return replay_buff_addr, replay_buff_size
 
 
+def read_telemetry(usrp_obj, rf_output):
+    """Read a single telemetry sample, ordered as TELEMETRY_FIELDS"""
+    return [
+        round(time.time(), 3),
+        float(usrp_obj["mboard"].get_sensor("temp_fpga").value),
+        float(usrp_obj["radio"].get_tx_sensor("temperature", 1).value),
+        usrp_obj["radio"].get_tx_power_reference(1),
+        rf_output,
+    ]
+
+
+class TelemetrySampler(threading.Thread):
+    """Background thread that samples device telemetry into a ring buffer
+
+    Samples are appended to a fixed size deque so the oldest samples are
+    dropped once the buffer is full.  The server lock is held while the
+    device is read so sampling never interleaves with a client command.
+    """
+
+    def __init__(self, server_obj, period=1.0, size=3600):
+        super().__init__(daemon=True)
+        self.server = server_obj
+        self.period = period
+        self.buffer = deque(maxlen=size)
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.period):
+            try:
+                with self.server.usrp_lock:
+                    sample = read_telemetry(self.server.usrp, self.server.rf_output)
+            except Exception:
+                logging.exception("Telemetry sample failed")
+                continue
+            self.buffer.append(sample)
+
+    def since(self, timestamp):
+        """Returns the buffered samples newer than timestamp as compact json"""
+        samples = [sample for sample in list(self.buffer) if sample[0] > timestamp]
+        return json.dumps(
+            {"fields": TELEMETRY_FIELDS, "samples": samples}, separators=(",", ":")
+        )
+
+
+def stored_wv(digest, suffix=".wv"):
+    """Path of a waveform in the store, None for malformed digests"""
+    if not DIGEST_PATTERN.fullmatch(digest):
+        return None
+    return Path(WV_STORE, digest + suffix)
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 class UsrpTCPHandler(socketserver.StreamRequestHandler):
     def handle(self):
         while True:
@@ -42,88 +117,181 @@ class UsrpTCPHandler(socketserver.StreamRequestHandler):
                 break
             self.data = str(self.data, "utf-8")
             value = self.data.split("=")[-1]
-            # X410 Python 3 version is 3.7(?), no switch statments
-            ### Get general device status
-            if self.data.startswith("temp=?"):
-                logging.debug("Getting temp")
-                response = str(server.usrp["mboard"].get_sensor("temp_fpga").value)
-                response += " " + str(
-                    server.usrp["radio"].get_tx_sensor("temperature", 1).value
-                )
-            elif self.data.startswith("rf out?"):
-                logging.debug("Getting rf playback status")
-                response = str(server.rf_output)
-            ### Get/set rf parameters
-            elif self.data.startswith("freq="):
-                if value == "?":
-                    logging.debug("Getting frequency")
-                    response = server.usrp["radio"].get_tx_frequency(1)
-                else:
-                    logging.debug("Setting frequency")
-                    server.usrp["radio"].set_tx_frequency(float(value), 1)
-                    response = server.usrp["radio"].get_tx_frequency(1)
-            elif self.data.startswith("power="):
-                if value == "?":
-                    logging.debug("Getting power")
-                    response = server.usrp["radio"].get_tx_power_reference(1)
-                else:
-                    logging.debug("Setting power")
-                    server.usrp["radio"].set_tx_power_reference(float(value), 1)
-                    response = server.usrp["radio"].get_tx_power_reference(1)
-            elif self.data.startswith("wv_file="):
-                if value == "?":
-                    logging.debug("Getting wv file")
-                    if server.wv_file is None:
-                        response = "None"
-                    else:
-                        response = str(server.wv_file)
+            with server.usrp_lock:
+                response = self.dispatch(value)
+            self.wfile.write(bytes(str(response), "utf-8"))
+            self.wfile.flush()
+
+    def dispatch(self, value):
+        """Runs the received command and returns the response to send"""
+        # X410 Python 3 version is 3.7(?), no switch statments
+        ### Get general device status
+        if self.data.startswith("temp=?"):
+            logging.debug("Getting temp")
+            response = str(server.usrp["mboard"].get_sensor("temp_fpga").value)
+            response += " " + str(
+                server.usrp["radio"].get_tx_sensor("temperature", 1).value
+            )
+        elif self.data.startswith("rf out?"):
+            logging.debug("Getting rf playback status")
+            response = str(server.rf_output)
+        elif self.data.startswith("telemetry"):
+            logging.debug("Getting telemetry")
+            since = float(value) if "since=" in self.data else 0.0
+            # newline terminated since the response can exceed one recv
+            response = server.telemetry.since(since) + "\n"
+        elif self.data.startswith("time=?"):
+            logging.debug("Getting device time")
+            response = "%.6f" % time.time()
+        ### Get/set rf parameters
+        elif self.data.startswith("freq="):
+            if value == "?":
+                logging.debug("Getting frequency")
+                response = server.usrp["radio"].get_tx_frequency(1)
+            else:
+                logging.debug("Setting frequency")
+                server.usrp["radio"].set_tx_frequency(float(value), 1)
+                response = server.usrp["radio"].get_tx_frequency(1)
+        elif self.data.startswith("power="):
+            if value == "?":
+                logging.debug("Getting power")
+                response = server.usrp["radio"].get_tx_power_reference(1)
+            else:
+                logging.debug("Setting power")
+                server.usrp["radio"].set_tx_power_reference(float(value), 1)
+                response = server.usrp["radio"].get_tx_power_reference(1)
+        elif self.data.startswith("wv_file="):
+            if value == "?":
+                logging.debug("Getting wv file")
+                if server.wv_file is None:
+                    response = "None"
                 else:
-                    logging.info("Loading wv file")
-                    server.wv_file = Path(value)
-                    if Path(server.wv_file).exists():
-                        logging.debug("Setting wv file")
-                        server.iq, server.data_rate = read_wv_file(server.wv_file)
-                        logging.debug(f"Setting data rate to {server.data_rate}")
-                        server.usrp["duc"].set_input_rate(server.data_rate, 1)
-                        server.buf_adr, server.buf_sze = load_wv(server.iq, server.usrp)
-                        response = server.wv_file
-                    else:
-                        response = "Error: file does not exist"
-            ### Control device playback
-            elif self.data.startswith("start"):
-                logging.debug("Attempting to start playback")
-                if server.iq is not None:
-                    logging.info("Starting playback")
-                    self.play_thread = threading.Thread(
-                        target=play_wv,
-                        args=(
-                            server.event,
-                            server.buf_adr,
-                            server.buf_sze,
-                            server.usrp,
-                        ),
-                    )
-                    self.play_thread.start()
-                    server.rf_output = True
-                    response = "RF output started"
+                    response = str(server.wv_file)
+            elif (
+                server.buf_sze is not None
+                and server.wv_file == Path(value)
+                and Path(value).exists()
+                and Path(value).stat().st_mtime_ns == server.wv_mtime
+            ):
+                # the replay buffer still holds the file, across campaigns too
+                logging.info("wv file already loaded")
+                response = server.wv_file
+            else:
+                logging.info("Loading wv file")
+                server.wv_file = Path(value)
+                if Path(server.wv_file).exists():
+                    logging.debug("Setting wv file")
+                    server.iq, server.data_rate = read_wv_file(server.wv_file)
+                    logging.debug(f"Setting data rate to {server.data_rate}")
+                    server.usrp["duc"].set_input_rate(server.data_rate, 1)
+                    server.buf_adr, server.buf_sze = load_wv(server.iq, server.usrp)
+                    server.wv_mtime = server.wv_file.stat().st_mtime_ns
+                    response = server.wv_file
                 else:
-                    logging.error("IQ data not defined")
-                    response = "Error: IQ data not defined"
-            elif self.data.startswith("stop"):
-                if not server.rf_output:
-                    response = "RF output not enabled"
+                    response = "Error: file does not exist"
+        ### Content addressed waveform upload
+        elif self.data.startswith("wv_has="):
+            path = stored_wv(value)
+            if path is None:
+                response = "Error: bad digest"
+            else:
+                response = str(path) if path.exists() else "False"
+        elif self.data.startswith("wv_stat="):
+            # bytes of an interrupted upload, the client resumes from there
+            partial = stored_wv(value, ".part")
+            if partial is None:
+                response = "Error: bad digest"
+            else:
+                response = str(partial.stat().st_size if partial.exists() else 0)
+        elif self.data.startswith("wv_chunk="):
+            # wv_chunk=<digest>,<offset>,<length> followed by length raw bytes
+            digest, offset, length = value.split(",")
+            offset, length = int(offset), int(length)
+            partial = stored_wv(digest, ".part")
+            if partial is None or not 0 < length <= MAX_CHUNK:
+                # the payload cannot be skipped, drop the connection
+                raise ConnectionError("Malformed waveform chunk")
+            payload = self.rfile.read(length)
+            WV_STORE.mkdir(parents=True, exist_ok=True)
+            size = partial.stat().st_size if partial.exists() else 0
+            if offset != size or len(payload) != length:
+                response = f"Error: expected offset {size}"
+            else:
+                with open(partial, "ab") as out_file:
+                    out_file.write(payload)
+                response = str(size + length)
+        elif self.data.startswith("wv_commit="):
+            # verify the content before it can be loaded
+            partial = stored_wv(value, ".part")
+            if partial is None or not partial.exists():
+                response = "Error: no upload for digest"
+            elif file_sha256(partial) != value:
+                partial.unlink()
+                response = "Error: digest mismatch"
+            else:
+                os.replace(partial, stored_wv(value))
+                logging.info(f"Stored waveform {value}")
+                response = str(stored_wv(value))
+        elif self.data.startswith("synth="):
+            # the spec holds "=" itself, so it is not split like the other values
+            spec = self.data[len("synth="):]
+            logging.info(f"Synthesizing waveform {spec}")
+            if server.buf_sze is not None and server.wv_file == "synth:" + spec:
+                logging.info("waveform already synthesized")
+                response = server.wv_file
+            else:
+                try:
+                    word_samples = server.usrp["replay"].get_word_size() // 4
+                    rate, data_len, chunks = synthesize(spec, multiple=max(word_samples, 1))
+                except ValueError as error:
+                    response = f"Error: {error}"
                 else:
-                    logging.debug("stopping playback")
-                    server.event.set()
-                    self.play_thread.join()
-                    server.rf_output = False
-                    server.event.clear()
-                    response = "RF output stopped"
+                    server.data_rate = rate
+                    server.usrp["duc"].set_input_rate(server.data_rate, 1)
+                    server.buf_adr, server.buf_sze = load_chunks(chunks, data_len, server.usrp)
+                    # the samples only live in the replay buffer
+                    server.iq = None
+                    server.wv_file = "synth:" + spec
+                    response = server.wv_file
+        ### Control device playback
+        elif self.data.startswith("start"):
+            logging.debug("Attempting to start playback")
+            if server.rf_output:
+                # a client that reconnected sends start again, one playback
+                # thread per replay buffer
+                logging.info("playback already running")
+                response = "RF output started"
+            elif server.buf_sze is not None:
+                logging.info("Starting playback")
+                # the thread belongs to the server, a stop may come on another connection
+                server.play_thread = threading.Thread(
+                    target=play_wv,
+                    args=(
+                        server.event,
+                        server.buf_adr,
+                        server.buf_sze,
+                        server.usrp,
+                    ),
+                )
+                server.play_thread.start()
+                server.rf_output = True
+                response = "RF output started"
             else:
-                response = "Error: Invalid command"
-
-            self.wfile.write(bytes(str(response), "utf-8"))
-            self.wfile.flush()
+                logging.error("IQ data not defined")
+                response = "Error: IQ data not defined"
+        elif self.data.startswith("stop"):
+            if not server.rf_output:
+                response = "RF output not enabled"
+            else:
+                logging.debug("stopping playback")
+                server.event.set()
+                server.play_thread.join()
+                server.rf_output = False
+                server.event.clear()
+                response = "RF output stopped"
+        else:
+            response = "Error: Invalid command"
+        return response
 
 
 if __name__ == "__main__":
@@ -180,7 +348,13 @@ if __name__ == "__main__":
         server.data_rate = default_rate
         server.wv_file = wv_file
         server.rf_output = False
+        server.play_thread = None
         server.iq = None
+        server.buf_sze = None
+        server.wv_mtime = None
         server.event = threading.Event()
+        server.usrp_lock = threading.Lock()
+        server.telemetry = TelemetrySampler(server, period=1.0, size=3600)
+        server.telemetry.start()
         while True:
             received_data = server.handle_request()
@@ -0,0 +1,173 @@
+"""
+Waveform synthesis for the X410 playback server.
+
+Generates common interference waveforms directly as sc16 samples for the
+replay buffer, so they need no .wv file.  A waveform is described by a
+spec string, the kind followed by comma separated parameters:
+
+    noise,bandwidth=20e6                  band limited white noise
+    pulsed,bandwidth=20e6,on=0.1,off=0.1  noise gated on and off, seconds
+    cw,freq=1e6                           tone at an offset from the center
+    multitone,tones=8,spacing=1e6         tones centered on the center frequency
+
+Common parameters are the sample rate (rate, default 30.72e6), the buffer
+length in seconds (duration, default 0.1, one on/off period for pulsed),
+the RMS level in dB full scale (level, default -15) and the noise seed.
+The buffer is replayed in a loop, so tones are moved to the nearest
+frequency with a whole number of cycles in the buffer and noise is
+filtered circularly.  Samples are generated in chunks to bound memory.
+"""
+
+import numpy as np
+
+# same layout as uhd_play_wv.cplx_int
+SC16 = np.dtype([("re", np.int16), ("im", np.int16)])
+FULL_SCALE = 32767
+CHUNK_SAMPLES = 1 << 18
+FILTER_TAPS = 255
+DEFAULTS = {"rate": 30.72e6, "duration": 0.1, "level": -15.0, "seed": 0}
+KINDS = {
+    "noise": {"bandwidth"},
+    "pulsed": {"bandwidth", "on", "off"},
+    "cw": {"freq"},
+    "multitone": {"tones", "spacing"},
+}
+
+
+def parse_spec(spec):
+    """Split a spec string into the kind and its numeric parameters
+
+    Raises:
+        ValueError: for unknown kinds, unknown or missing parameters
+    """
+    kind, *pairs = [part.strip() for part in spec.split(",")]
+    if kind not in KINDS:
+        raise ValueError("unknown waveform %s, expected one of %s" % (kind, ", ".join(KINDS)))
+    params = dict(DEFAULTS)
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        if name not in KINDS[kind] and name not in DEFAULTS:
+            raise ValueError("%s does not take %s" % (kind, name))
+        params[name] = float(value)
+    missing = KINDS[kind] - set(params) - ({"freq"} if kind == "cw" else set())
+    if missing:
+        raise ValueError("%s needs %s" % (kind, ", ".join(sorted(missing))))
+    if params.get("bandwidth", 1) <= 0 or params.get("bandwidth", 0) > params["rate"]:
+        raise ValueError("bandwidth must be positive and at most the rate")
+    for name in ("rate", "duration", "tones", "spacing"):
+        if params.get(name, 1) <= 0:
+            raise ValueError("%s must be positive" % name)
+    if kind == "pulsed" and (params["on"] <= 0 or params["off"] < 0):
+        raise ValueError("pulses need a positive on time and a non negative off time")
+    return kind, params
+
+
+def _lowpass(bandwidth, rate):
+    """Blackman windowed sinc with a two sided bandwidth, unit DC gain"""
+    index = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2
+    taps = np.sinc(bandwidth / rate * index) * np.blackman(FILTER_TAPS)
+    return taps / taps.sum()
+
+
+def _chunk_sizes(total, chunk_samples):
+    return [min(chunk_samples, total - start) for start in range(0, total, chunk_samples)]
+
+
+def _white(seed, index, size):
+    """Complex unit power noise of one chunk, reproducible from its index"""
+    generator = np.random.RandomState([int(seed), index])
+    return (generator.standard_normal(size) + 1j * generator.standard_normal(size)) / np.sqrt(2)
+
+
+def _noise_chunks(params, total, chunk_samples):
+    """Band limited noise whose filter wraps around the end of the buffer"""
+    taps = _lowpass(params["bandwidth"], params["rate"])
+    # unit power white noise leaves the filter with this rms
+    gain = np.sqrt(np.sum(taps ** 2))
+    sizes = _chunk_sizes(total, chunk_samples)
+    overlap = FILTER_TAPS - 1
+    # the end of the buffer precedes its start when it is replayed
+    tail = []
+    for index in range(len(sizes) - 1, -1, -1):
+        tail.insert(0, _white(params["seed"], index, sizes[index]))
+        if sum(len(chunk) for chunk in tail) >= overlap:
+            break
+    tail = np.concatenate(tail)
+    history = tail[np.arange(-overlap, 0) % len(tail)]
+    nfft = 1 << int(np.ceil(np.log2(chunk_samples + overlap)))
+    spectrum = np.fft.fft(taps, nfft)
+    for index, size in enumerate(sizes):
+        block = np.concatenate([history, _white(params["seed"], index, size)])
+        filtered = np.fft.ifft(np.fft.fft(block, nfft) * spectrum)[overlap : overlap + size]
+        history = block[-overlap:]
+        yield filtered / gain
+
+
+def _tone_chunks(frequencies, rate, total, chunk_samples):
+    """Sum of unit power tones with low crest factor Schroeder phases"""
+    count = len(frequencies)
+    phases = -np.pi * np.arange(count) * (np.arange(count) - 1) / count
+    for start in range(0, total, chunk_samples):
+        time = np.arange(start, min(start + chunk_samples, total)) / rate
+        chunk = np.zeros(len(time), complex)
+        for frequency, phase in zip(frequencies, phases):
+            chunk += np.exp(1j * (2 * np.pi * frequency * time + phase))
+        yield chunk / np.sqrt(count)
+
+
+def _gated(chunks, on_samples):
+    """Zero the samples after the on time of the buffer"""
+    start = 0
+    for chunk in chunks:
+        position = np.arange(start, start + len(chunk))
+        chunk[position >= on_samples] = 0
+        start += len(chunk)
+        yield chunk
+
+
+def to_sc16(samples, level):
+    """Scale unit power samples to an rms level in dBFS, clipped to int16"""
+    scale = FULL_SCALE * 10 ** (level / 20)
+    output = np.empty(2 * len(samples), np.int16)
+    output[0::2] = np.clip(np.round(samples.real * scale), -FULL_SCALE, FULL_SCALE)
+    output[1::2] = np.clip(np.round(samples.imag * scale), -FULL_SCALE, FULL_SCALE)
+    return output.view(SC16)
+
+
+def synthesize(spec, multiple=1, chunk_samples=CHUNK_SAMPLES):
+    """Generate the samples of a waveform spec
+
+    Args:
+        spec (str): waveform spec, see the module description
+        multiple (int): the number of samples is rounded up to a multiple of this
+        chunk_samples (int): samples generated at a time
+
+    Returns:
+        rate (float): sample rate of the waveform
+        total (int): number of samples
+        chunks (generator): sc16 arrays that make up the waveform
+    """
+    kind, params = parse_spec(spec)
+    rate = params["rate"]
+    if kind == "pulsed":
+        duration = params["on"] + params["off"]
+    else:
+        duration = params["duration"]
+    total = int(np.ceil(max(round(duration * rate), 1) / multiple)) * multiple
+    if kind in ("noise", "pulsed"):
+        chunks = _noise_chunks(params, total, chunk_samples)
+    else:
+        if kind == "cw":
+            frequencies = np.array([params.get("freq", 0.0)])
+        else:
+            count = int(params["tones"])
+            frequencies = (np.arange(count) - (count - 1) / 2) * params["spacing"]
+        # whole cycles in the buffer so the loop has no phase jump
+        frequencies = np.round(frequencies * total / rate) * rate / total
+        chunks = _tone_chunks(frequencies, rate, total, chunk_samples)
+    if kind == "pulsed":
+        on_samples = int(round(params["on"] * rate))
+        # the noise keeps its rms level while it is on
+        chunks = _gated(chunks, on_samples)
+    return rate, total, (to_sc16(chunk, params["level"]) for chunk in chunks)
+